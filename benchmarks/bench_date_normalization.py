@@ -0,0 +1,68 @@
+"""
+Benchmark: date normalisation engine vs. the previous standardize_date_columns.
+
+Usage:
+    python benchmarks/bench_date_normalization.py
+    python benchmarks/bench_date_normalization.py --rows 20000000 --days 1500
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from date_normalization import DateNormalizer
+
+
+# The implementation standardize_date_columns used before the normalisation engine, followed by the
+# second to_datetime call data_cleaning made on its string output.
+def legacy_standardize_dates(series):
+    strings = (series.astype(str).str.strip().str.replace(r'\s+', '', regex=True).str.replace('/', '-', regex=False)
+               .pipe(pd.to_datetime, errors='coerce').dt.strftime('%Y-%m-%d'))
+    return pd.to_datetime(strings, errors='coerce')
+
+
+# Raw date strings with the irregularities seen in transactions.csv: '/' separators, stray and inner whitespace.
+def make_raw_dates(rows, days, seed=0):
+    rng = np.random.default_rng(seed)
+    dates = (pd.Timestamp('2020-01-01') + pd.to_timedelta(np.arange(days), unit='D')).strftime('%Y-%m-%d')
+    variants = np.concatenate([
+        dates,
+        dates.str.replace('-', '/'),
+        ' ' + dates + ' ',
+        dates.str.slice(0, 5) + ' ' + dates.str.slice(5),
+    ])
+    return pd.Series(variants[rng.integers(0, len(variants), rows)])
+
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Date normalisation benchmark")
+    parser.add_argument("--rows", type=int, default=10_000_000, help="Rows of raw dates")
+    parser.add_argument("--days", type=int, default=1000, help="Distinct calendar days")
+    args = parser.parse_args()
+
+    raw = make_raw_dates(args.rows, args.days)
+    print(f"{args.rows:,} rows, {raw.nunique():,} distinct raw strings")
+
+    legacy, legacy_secs = timed(legacy_standardize_dates, raw)
+    new, new_secs = timed(DateNormalizer().normalize, raw)
+
+    mismatches = int((legacy.to_numpy(dtype='datetime64[ns]') != new.to_numpy()).sum())
+    print(f"legacy standardize_date_columns: {legacy_secs:8.2f}s  ({args.rows / legacy_secs:,.0f} rows/s)")
+    print(f"DateNormalizer:                  {new_secs:8.2f}s  ({args.rows / new_secs:,.0f} rows/s)")
+    print(f"speedup: {legacy_secs / new_secs:.1f}x, mismatching rows: {mismatches:,}")
+
+
+if __name__ == "__main__":
+    main()
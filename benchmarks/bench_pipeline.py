@@ -0,0 +1,199 @@
+"""
+Benchmark: pipeline stages on synthetic data at several scales, compared against a stored baseline.
+
+Usage:
+    python benchmarks/bench_pipeline.py
+    python benchmarks/bench_pipeline.py --scales 10000 1000000 100000000 --chunksize 5000000
+    python benchmarks/bench_pipeline.py --save_baseline
+    python benchmarks/bench_pipeline.py --steps cleaning analysis --engine chunked
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import shutil
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import data_analysis
+import data_cleaning
+import instrumentation
+import schema
+from generate_data import generate
+
+# Each step runs in a fresh process, so its peak RSS is its own and caches (e.g. parsed dates) start cold.
+# Peak RSS includes the inputs the step loads; the timed section excludes loading for the
+# profile_dataframes and standardize_date_columns steps, which benchmark a single function.
+# cleaning writes the clean tables (csv) that the analysis step reads back.
+
+STEPS = ['profile_dataframes', 'standardize_date_columns', 'cleaning', 'analysis']
+
+DEFAULT_SCALES = [10_000, 100_000, 1_000_000]
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+
+# Slower or bigger than the baseline by more than this fraction is a regression ...
+DEFAULT_TOLERANCE = 0.25
+# ... unless the difference is below these noise floors
+MIN_SECONDS_DELTA = 0.05
+MIN_RSS_DELTA_MB = 20
+
+
+def load_raw(raw_dir, table):
+    return schema.read_csv(os.path.join(raw_dir, f"{table}.csv"), table, compact_money=False)
+
+
+def run_step(step, raw_dir, work_dir, chunksize=None, engine='pandas'):
+    clean_dir = os.path.join(work_dir, 'clean')
+    with contextlib.redirect_stdout(io.StringIO()):
+        if step == 'profile_dataframes':
+            frames = {table: load_raw(raw_dir, table) for table in ['customers', 'products', 'transactions']}
+            start = time.perf_counter()
+            data_cleaning.profile_dataframes(frames)
+        elif step == 'standardize_date_columns':
+            transactions = load_raw(raw_dir, 'transactions')
+            start = time.perf_counter()
+            data_cleaning.standardize_date_columns(transactions, ['transaction_date'])
+        elif step == 'cleaning':
+            start = time.perf_counter()
+            data_cleaning.main(raw_dir=raw_dir, clean_dir=clean_dir, chunksize=chunksize, write='sync')
+        elif step == 'analysis':
+            start = time.perf_counter()
+            data_analysis.main(clean_dir=clean_dir, reports_dir=os.path.join(work_dir, 'reports'),
+                               plots_dir=os.path.join(work_dir, 'plots'), plots=False, engine=engine, chunksize=chunksize)
+        else:
+            raise ValueError(f"Unknown benchmark step '{step}', expected one of {STEPS}")
+        seconds = time.perf_counter() - start
+    return {'seconds': seconds, 'peak_rss_mb': instrumentation.peak_rss_mb()}
+
+
+def measure(step, raw_dir, work_dir, rows, repeat, chunksize=None, engine='pandas'):
+    runs = []
+    for _ in range(repeat):
+        with ProcessPoolExecutor(max_workers=1, mp_context=get_context('spawn')) as pool:
+            runs.append(pool.submit(run_step, step, raw_dir, work_dir, chunksize, engine).result())
+    best = min(runs, key=lambda run: run['seconds'])
+    return {
+        'seconds': round(best['seconds'], 4),
+        'rows_per_sec': round(rows / best['seconds']) if best['seconds'] > 0 else None,
+        'peak_rss_mb': None if best['peak_rss_mb'] is None else round(best['peak_rss_mb'], 1),
+    }
+
+
+def environment():
+    return {
+        'python': platform.python_version(),
+        'pandas': pd.__version__,
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+    }
+
+
+# Regressions of results against baseline, as printable lines
+def compare(results, baseline, tolerance):
+    regressions = []
+    for scale, steps in results.items():
+        for step, result in steps.items():
+            reference = baseline.get(scale, {}).get(step)
+            if reference is None:
+                continue
+            slower = result['seconds'] - reference['seconds']
+            if slower > MIN_SECONDS_DELTA and result['seconds'] > reference['seconds'] * (1 + tolerance):
+                regressions.append(f"{step} @ {int(scale):,} rows: {result['seconds']:.2f}s vs baseline {reference['seconds']:.2f}s")
+            if result['peak_rss_mb'] is not None and reference.get('peak_rss_mb') is not None:
+                bigger = result['peak_rss_mb'] - reference['peak_rss_mb']
+                if bigger > MIN_RSS_DELTA_MB and result['peak_rss_mb'] > reference['peak_rss_mb'] * (1 + tolerance):
+                    regressions.append(f"{step} @ {int(scale):,} rows: peak RSS {result['peak_rss_mb']:.0f} MB "
+                                       f"vs baseline {reference['peak_rss_mb']:.0f} MB")
+    return regressions
+
+
+def print_results(results, baseline):
+    print(f"{'Rows':>12} {'Step':<26} {'Seconds':>9} {'Rows/s':>13} {'Peak MB':>8} {'vs baseline':>12}")
+    for scale, steps in results.items():
+        for step, result in steps.items():
+            reference = baseline.get(scale, {}).get(step)
+            ratio = f"{result['seconds'] / reference['seconds']:.2f}x" if reference and reference['seconds'] else ''
+            rows_per_sec = '' if result['rows_per_sec'] is None else f"{result['rows_per_sec']:,}"
+            peak = '' if result['peak_rss_mb'] is None else f"{result['peak_rss_mb']:.0f}"
+            print(f"{int(scale):>12,} {step:<26} {result['seconds']:>9.3f} {rows_per_sec:>13} {peak:>8} {ratio:>12}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pipeline benchmark suite")
+    parser.add_argument("--scales", type=int, nargs="+", default=DEFAULT_SCALES, help="Transaction row counts to benchmark")
+    parser.add_argument("--steps", nargs="+", default=STEPS, choices=STEPS, help="Steps to benchmark")
+    parser.add_argument("--repeat", type=int, default=1, help="Runs per step; the fastest is kept")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for the synthetic data")
+    parser.add_argument("--chunksize", type=int, help="Run the cleaning step in streaming mode with this chunk size")
+    parser.add_argument("--engine", default="pandas", choices=data_analysis.ENGINES, help="Analysis engine of the analysis step")
+    parser.add_argument("--data_dir", default="bench_data", help="Directory for generated data (reused across runs) and step outputs")
+    parser.add_argument("--baseline", default=BASELINE_PATH, help="Baseline results to compare against")
+    parser.add_argument("--save_baseline", action="store_true", help="Store these results as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE, help="Allowed slowdown/growth as a fraction of the baseline")
+    parser.add_argument("--output", help="Also write the results as JSON to this path")
+    args = parser.parse_args()
+
+    if 'analysis' in args.steps and 'cleaning' not in args.steps:
+        parser.error("the analysis step reads the output of the cleaning step, include 'cleaning' too")
+
+    baseline_file = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as fh:
+            baseline_file = json.load(fh)
+    baseline = baseline_file.get('results', {})
+    if baseline_file and baseline_file.get('environment') != environment():
+        print(f"Note: baseline was recorded on a different environment: {baseline_file.get('environment')}")
+
+    results = {}
+    for rows in args.scales:
+        raw_dir = os.path.join(args.data_dir, f"raw_{rows}_seed{args.seed}")
+        if not os.path.exists(os.path.join(raw_dir, 'transactions.csv')):
+            print(f"Generating {rows:,} transactions in {raw_dir}")
+            generate(raw_dir, rows, seed=args.seed)
+
+        work_dir = os.path.join(args.data_dir, f"work_{rows}")
+        shutil.rmtree(work_dir, ignore_errors=True)
+        results[str(rows)] = {}
+        for step in [step for step in STEPS if step in args.steps]:
+            results[str(rows)][step] = measure(step, raw_dir, work_dir, rows, args.repeat, args.chunksize, args.engine)
+            print(f"{rows:>12,} {step:<26} {results[str(rows)][step]['seconds']:.3f}s")
+
+    print()
+    print_results(results, baseline)
+
+    report = {'environment': environment(), 'chunksize': args.chunksize, 'engine': args.engine, 'results': results}
+    if args.output:
+        with open(args.output, 'w') as fh:
+            json.dump(report, fh, indent=2)
+
+    if args.save_baseline:
+        # Scales not rerun keep their previous baseline
+        report['results'] = {**baseline, **results}
+        with open(args.baseline, 'w') as fh:
+            json.dump(report, fh, indent=2)
+        print(f"\nBaseline saved to {args.baseline}")
+        return
+
+    regressions = compare(results, baseline, args.tolerance)
+    if regressions:
+        print(f"\n{len(regressions)} regression(s) against the baseline (tolerance {args.tolerance:.0%}):")
+        for line in regressions:
+            print(f"  {line}")
+        sys.exit(1)
+    if baseline:
+        print("\nNo regressions against the baseline")
+
+
+if __name__ == "__main__":
+    main()
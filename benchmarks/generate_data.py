@@ -0,0 +1,167 @@
+"""
+Synthetic raw data for benchmarks: customers.csv, products.csv and transactions.csv with the
+irregularities the cleaner handles.
+
+Usage:
+    python benchmarks/generate_data.py --rows 1000000 --out_dir bench_data
+    python benchmarks/generate_data.py --rows 100000000 --out_dir /data/bench_100m --seed 7
+"""
+
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+
+# Messy properties reproduced, as fractions of rows:
+#   dates       '/' separators, stray outer whitespace, whitespace inside the date, a few unparseable values
+#   countries   spelling and case variants of the mapped countries ('usa', 'U.S.', 'U.K.', ' uk ') plus unmapped ones
+#   nulls       missing prices, statuses and emails
+#   duplicates  exact duplicate rows in products.csv
+# Transactions are generated and written in blocks of GENERATE_CHUNK rows, so 100M rows never sit in memory.
+# Each block has its own seed, so the output only depends on --rows and --seed.
+
+GENERATE_CHUNK = 1_000_000
+
+DATE_RANGE = ('2023-01-01', '2024-12-31')
+
+# Share of dates written as: canonical, '/' separated, outer whitespace, inner whitespace, unparseable
+DATE_VARIANT_WEIGHTS = [0.55, 0.25, 0.10, 0.09, 0.01]
+
+COUNTRY_VARIANTS = {
+    'United States': ['United States', 'USA', 'usa', 'US', 'us', 'U.S.', 'united states '],
+    'United Kingdom': ['United Kingdom', 'UK', 'uk', 'U.K.', ' u.k.', 'Great Britain'],
+    'Canada': ['Canada', 'canada', 'CA', 'ca'],
+    'Germany': ['Germany', 'germany', 'DE', 'de'],
+    'Australia': ['Australia', 'australia', 'AU', 'au'],
+    'France': ['France'],
+    'India': ['India'],
+}
+COUNTRY_WEIGHTS = [0.35, 0.2, 0.12, 0.1, 0.08, 0.08, 0.07]
+
+CATEGORIES = ['Electronics', 'Clothing', 'Home', 'Books', 'Sports', 'Toys', 'Beauty', 'Grocery']
+STATUSES = ['Completed', 'Pending', 'Cancelled', 'Refunded']
+STATUS_WEIGHTS = [0.8, 0.08, 0.07, 0.05]
+
+NULL_EMAIL_RATE = 0.08
+NULL_PRICE_RATE = 0.03
+NULL_STATUS_RATE = 0.04
+DUPLICATE_PRODUCT_RATE = 0.05
+
+
+# Default dimension sizes for a given number of transactions
+def default_customers(rows):
+    return max(1_000, rows // 20)
+
+
+def default_products(rows):
+    return max(100, min(50_000, rows // 1_000))
+
+
+# Every raw spelling of every day in DATE_RANGE, laid out as [variant, day]
+def date_variant_table():
+    days = pd.date_range(*DATE_RANGE, freq='D').strftime('%Y-%m-%d')
+    unparseable = np.array(['not a date', 'N/A', '00-00-0000', '2023-13-45'])
+    return np.stack([
+        days.to_numpy(dtype=object),
+        days.str.replace('-', '/').to_numpy(dtype=object),
+        (' ' + days + ' ').to_numpy(dtype=object),
+        (days.str.slice(0, 5) + ' ' + days.str.slice(5)).to_numpy(dtype=object),
+        unparseable[np.arange(len(days)) % len(unparseable)].astype(object),
+    ])
+
+
+def random_dates(rng, variants, n):
+    variant = rng.choice(len(variants), size=n, p=DATE_VARIANT_WEIGHTS)
+    day = rng.integers(0, variants.shape[1], size=n)
+    return variants[variant, day]
+
+
+def with_nulls(rng, values, rate):
+    values = np.asarray(values, dtype=object)
+    values[rng.random(len(values)) < rate] = None
+    return values
+
+
+def generate_customers(n, seed=0):
+    rng = np.random.default_rng([seed, 1])
+    ids = np.arange(1, n + 1)
+    countries = list(COUNTRY_VARIANTS)
+    country = rng.choice(len(countries), size=n, p=COUNTRY_WEIGHTS)
+    spelling = [COUNTRY_VARIANTS[countries[c]][s % len(COUNTRY_VARIANTS[countries[c]])]
+                for c, s in zip(country, rng.integers(0, 1_000, size=n))]
+    return pd.DataFrame({
+        'customer_id': ids,
+        'name': 'Customer ' + pd.Series(ids).astype(str),
+        'email': with_nulls(rng, 'customer' + pd.Series(ids).astype(str) + '@example.com', NULL_EMAIL_RATE),
+        'signup_date': random_dates(rng, date_variant_table(), n),
+        'country': spelling,
+    })
+
+
+def generate_products(n, seed=0):
+    rng = np.random.default_rng([seed, 2])
+    ids = np.arange(1, n + 1)
+    products = pd.DataFrame({
+        'product_id': ids,
+        'product_name': 'Product ' + pd.Series(ids).astype(str),
+        'category': rng.choice(CATEGORIES, size=n),
+        'cost_price': rng.uniform(2, 500, size=n).round(2),
+    })
+    duplicates = products.sample(frac=DUPLICATE_PRODUCT_RATE, random_state=seed)
+    return pd.concat([products, duplicates], ignore_index=True)
+
+
+# One block of transactions with ids [first_id, first_id + n)
+def generate_transactions(first_id, n, customers, cost_price, seed=0):
+    rng = np.random.default_rng([seed, 3, first_id])
+    product_id = rng.integers(1, len(cost_price) + 1, size=n)
+    price = (cost_price[product_id - 1] * rng.uniform(1.05, 1.8, size=n)).round(2)
+    price[rng.random(n) < NULL_PRICE_RATE] = np.nan
+    return pd.DataFrame({
+        'transaction_id': np.arange(first_id, first_id + n),
+        'customer_id': rng.integers(1, customers + 1, size=n),
+        'product_id': product_id,
+        'transaction_date': random_dates(rng, date_variant_table(), n),
+        'quantity': rng.integers(1, 6, size=n),
+        'price': price,
+        'status': with_nulls(rng, rng.choice(STATUSES, size=n, p=STATUS_WEIGHTS), NULL_STATUS_RATE),
+    })
+
+
+def generate(out_dir, rows, customers=None, products=None, seed=0):
+    customers = customers or default_customers(rows)
+    products = products or default_products(rows)
+    os.makedirs(out_dir, exist_ok=True)
+
+    generate_customers(customers, seed).to_csv(os.path.join(out_dir, 'customers.csv'), index=False)
+    product_table = generate_products(products, seed)
+    product_table.to_csv(os.path.join(out_dir, 'products.csv'), index=False)
+
+    cost_price = product_table.drop_duplicates('product_id').sort_values('product_id')['cost_price'].to_numpy()
+    path = os.path.join(out_dir, 'transactions.csv')
+    for first_row in range(0, rows, GENERATE_CHUNK):
+        block = generate_transactions(first_row + 1, min(GENERATE_CHUNK, rows - first_row), customers, cost_price, seed)
+        block.to_csv(path, index=False, mode='w' if first_row == 0 else 'a', header=first_row == 0)
+    if rows == 0:
+        generate_transactions(1, 0, customers, cost_price, seed).to_csv(path, index=False)
+
+    return {'transactions': rows, 'customers': customers, 'products': products}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Synthetic raw data generator")
+    parser.add_argument("--rows", type=int, default=100_000, help="Transactions to generate")
+    parser.add_argument("--customers", type=int, help="Customers (default: rows / 20, at least 1,000)")
+    parser.add_argument("--products", type=int, help="Products before duplicates (default: rows / 1,000, between 100 and 50,000)")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed")
+    parser.add_argument("--out_dir", default="data_raw", help="Directory for the raw CSV files")
+    args = parser.parse_args()
+
+    sizes = generate(args.out_dir, args.rows, args.customers, args.products, args.seed)
+    print(f"Wrote {sizes['transactions']:,} transactions, {sizes['customers']:,} customers and "
+          f"{sizes['products']:,} products to {args.out_dir}")
+
+
+if __name__ == "__main__":
+    main()
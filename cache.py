@@ -0,0 +1,313 @@
+import hashlib
+import importlib.util
+import json
+import os
+import shutil
+import time
+
+import numpy as np
+import pandas as pd
+
+import data_analysis
+import data_cleaning
+import instrumentation
+import normalization
+import storage
+import validation
+
+# Content-addressed result cache for full pipeline runs.
+#
+# Every artifact a run produces is cached on its own, under a key hashed from what it depends on:
+#
+#   clean/<table>    the clean table files   raw CSVs it is built from (data_cleaning.CLEAN_INPUTS), dates
+#                    and its quarantined rows  (customers, transactions), format, layout
+#   report/<table>   one report CSV          raw CSVs of the clean tables it reads (data_analysis.REPORT_INPUTS),
+#                                            dates, its own arguments (data_analysis.REPORT_ARGUMENTS)
+#   plot/<table>     the plot of a report    the report's key
+#
+# Each key also includes a version of the code that builds the artifact: a hash of the source of the
+# modules involved (and of normalization.json for anything cleaned), LOGIC_VERSION and the pandas/numpy
+# versions. Editing the cleaning code therefore invalidates everything, editing plotting.py only the plots. Changing products.csv invalidates the clean
+# products and transactions (transactions are validated against the product ids) and every report built
+# from them, while clean customers and the country summary are reused.
+#
+# Options that change how the work is done but not its result (--chunksize, --workers, --engine,
+# --clean_write) are not part of the keys.
+#
+# Input files are fingerprinted by size and modification time ('stat'), or by a SHA-256 of their
+# content ('content'), which also survives copies and touch but reads every input once per run.
+#
+# An entry is a directory <cache_dir>/<key> holding the artifact files and meta.json. Entries are
+# written under a temporary name and renamed into place, so a crashed run never leaves a partial
+# entry behind. A hit refreshes the entry's modification time; after each run the least recently used
+# entries are evicted until the cache fits in max_bytes.
+
+LOGIC_VERSION = 1
+META_FILE = 'meta.json'
+FILES_DIR = 'files'
+DEFAULT_MAX_MB = 2048
+FINGERPRINTS = ['stat', 'content']
+HASH_BLOCK_BYTES = 2**20
+
+CLEAN_MODULES = ['data_cleaning', 'date_normalization', 'normalization', 'partitioning', 'profiling', 'schema', 'storage', 'validation']
+# Config files read by the cleaning code
+CLEAN_FILES = [normalization.CONFIG_PATH]
+ANALYSIS_MODULES = CLEAN_MODULES + ['data_analysis', 'metrics', 'retention']
+PLOT_MODULES = ['plotting']
+
+# Clean tables filtered by start_date/end_date
+DATED_TABLES = ['customers', 'transactions']
+
+
+def _module_source(name):
+    with open(importlib.util.find_spec(name).origin, 'rb') as fh:
+        return fh.read()
+
+
+# Hash of the source of the given modules, of the config files they read and of the library versions their output depends on.
+def code_version(modules, files=()):
+    digest = hashlib.sha256(f"{LOGIC_VERSION}|{pd.__version__}|{np.__version__}".encode())
+    for name in sorted(modules):
+        digest.update(name.encode())
+        digest.update(_module_source(name))
+    for path in files:
+        with open(path, 'rb') as fh:
+            digest.update(fh.read())
+    return digest.hexdigest()
+
+
+def _content_hash(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as fh:
+        for block in iter(lambda: fh.read(HASH_BLOCK_BYTES), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _date_param(value):
+    return None if value is None else pd.Timestamp(value).isoformat()
+
+
+def _directory_size(path):
+    return sum(os.path.getsize(os.path.join(root, f)) for root, _, files in os.walk(path) for f in files)
+
+
+class ResultCache:
+    def __init__(self, directory, max_bytes=DEFAULT_MAX_MB * 2**20, fingerprint='stat'):
+        if fingerprint not in FINGERPRINTS:
+            raise ValueError(f"Unknown cache fingerprint '{fingerprint}', expected one of {FINGERPRINTS}")
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.fingerprint_mode = fingerprint
+        self.fingerprints = {}
+        os.makedirs(directory, exist_ok=True)
+
+    # Fingerprint of an input file, computed once per run
+    def fingerprint(self, path):
+        if path not in self.fingerprints:
+            if not os.path.exists(path):
+                self.fingerprints[path] = None
+            elif self.fingerprint_mode == 'content':
+                self.fingerprints[path] = _content_hash(path)
+            else:
+                stat = os.stat(path)
+                self.fingerprints[path] = f"{stat.st_size}:{stat.st_mtime_ns}"
+        return self.fingerprints[path]
+
+    def key(self, artifact, inputs=(), params=None, version=''):
+        description = {
+            'artifact': artifact,
+            'inputs': {os.path.basename(path): self.fingerprint(path) for path in inputs},
+            'params': params or {},
+            'version': version,
+        }
+        return hashlib.sha256(json.dumps(description, sort_keys=True, default=str).encode()).hexdigest()
+
+    def entry_path(self, key):
+        return os.path.join(self.directory, key)
+
+    # Entry directory of key, or None on a miss. A hit marks the entry as recently used.
+    def get(self, key):
+        entry = self.entry_path(key)
+        if not os.path.exists(os.path.join(entry, META_FILE)):
+            return None
+        os.utime(entry)
+        return entry
+
+    # Stores an artifact. write_files(files_dir) copies the artifact's files into files_dir.
+    def put(self, key, artifact, write_files):
+        entry = self.entry_path(key)
+        if os.path.exists(os.path.join(entry, META_FILE)):
+            os.utime(entry)
+            return entry
+        staging = f"{entry}.partial-{os.getpid()}"
+        shutil.rmtree(staging, ignore_errors=True)
+        files_dir = os.path.join(staging, FILES_DIR)
+        os.makedirs(files_dir)
+        write_files(files_dir)
+        meta = {'artifact': artifact, 'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                'bytes': _directory_size(files_dir)}
+        with open(os.path.join(staging, META_FILE), 'w') as fh:
+            json.dump(meta, fh, indent=2)
+        shutil.rmtree(entry, ignore_errors=True)
+        os.rename(staging, entry)
+        return entry
+
+    # Stores a clean table with its quarantined rows and validation counts
+    def put_table(self, key, name, clean_dir, fmt):
+        def write_files(files_dir):
+            storage.copy_table(clean_dir, files_dir, name, fmt)
+            quarantine_dir = os.path.join(clean_dir, validation.QUARANTINE_DIR)
+            counts = validation.load_summary(quarantine_dir).get(name)
+            if counts is not None:
+                validation.save_summary(os.path.join(files_dir, validation.QUARANTINE_DIR), {name: counts})
+            if os.path.exists(os.path.join(quarantine_dir, f"{name}.csv")):
+                shutil.copy2(os.path.join(quarantine_dir, f"{name}.csv"), os.path.join(files_dir, validation.QUARANTINE_DIR))
+        return self.put(key, f"clean/{name}", write_files)
+
+    def restore_table(self, key, name, clean_dir, fmt):
+        files_dir = os.path.join(self.entry_path(key), FILES_DIR)
+        paths = storage.copy_table(files_dir, clean_dir, name, fmt)
+        cached_quarantine = os.path.join(files_dir, validation.QUARANTINE_DIR)
+        quarantine_dir = os.path.join(clean_dir, validation.QUARANTINE_DIR)
+        quarantine_path = os.path.join(quarantine_dir, f"{name}.csv")
+        if os.path.exists(quarantine_path):
+            os.remove(quarantine_path)
+        counts = validation.load_summary(cached_quarantine).get(name)
+        if counts is not None:
+            validation.save_summary(quarantine_dir, {name: counts})
+        if os.path.exists(os.path.join(cached_quarantine, f"{name}.csv")):
+            paths.append(shutil.copy2(os.path.join(cached_quarantine, f"{name}.csv"), quarantine_path))
+        return paths
+
+    def put_files(self, key, artifact, paths):
+        def write_files(files_dir):
+            for path in paths:
+                shutil.copy2(path, files_dir)
+        return self.put(key, artifact, write_files)
+
+    def restore_files(self, key, directory):
+        files_dir = os.path.join(self.entry_path(key), FILES_DIR)
+        os.makedirs(directory, exist_ok=True)
+        return [shutil.copy2(os.path.join(files_dir, name), directory) for name in sorted(os.listdir(files_dir))]
+
+    # Removes least recently used entries until the cache fits in max_bytes. Returns the number removed.
+    def evict(self):
+        entries = []
+        for key in os.listdir(self.directory):
+            meta_path = os.path.join(self.directory, key, META_FILE)
+            if not os.path.exists(meta_path):
+                continue
+            with open(meta_path) as fh:
+                entries.append((os.path.getmtime(os.path.join(self.directory, key)), key, json.load(fh)['bytes']))
+
+        total = sum(size for _, _, size in entries)
+        evicted = 0
+        for _, key, size in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(self.entry_path(key), ignore_errors=True)
+            total -= size
+            evicted += 1
+        return evicted
+
+
+# Plot files rendered for each report table, from the plotting module that was loaded to render them
+def _plot_files(plots_dir, tables):
+    import plotting
+
+    files = {table: [] for table in tables}
+    for filename, _, table in plotting.PLOTS:
+        if table in files:
+            files[table].append(os.path.join(plots_dir, f"{filename}.png"))
+    return files
+
+
+# Full pipeline run (cleaning and analysis) that reuses every cached artifact whose inputs are unchanged
+# and only computes the rest. Takes the arguments of data_cleaning.main and data_analysis.main.
+def main(raw_dir="data_raw", clean_dir="data_clean", reports_dir="reports", plots_dir="plots", cache_dir="cache",
+         max_bytes=DEFAULT_MAX_MB * 2**20, fingerprint='stat', start_date=None, end_date=None, chunksize=None, fmt="csv",
+         write="async", workers=1, partitioned=False, period_months=None, plots=True, plot_workers=1, engine="pandas"):
+    cache = ResultCache(cache_dir, max_bytes, fingerprint)
+    period_months = period_months or data_analysis.PERIOD_MONTHS
+    dates = {'start_date': _date_param(start_date), 'end_date': _date_param(end_date)}
+    arguments = {'period_months': list(period_months)}
+
+    def raw_path(name):
+        return os.path.join(raw_dir, f"{name}.csv")
+
+    with instrumentation.stage('lookup') as stage:
+        clean_version = code_version(CLEAN_MODULES, CLEAN_FILES)
+        clean_keys = {}
+        for name in data_cleaning.CLEAN_TABLES:
+            params = {'fmt': fmt, 'partitioned': partitioned and name in storage.PARTITION_COLUMNS,
+                      **(dates if name in DATED_TABLES else {})}
+            clean_keys[name] = cache.key(f"clean/{name}", [raw_path(table) for table in data_cleaning.CLEAN_INPUTS[name]], params, clean_version)
+
+        analysis_version = code_version(ANALYSIS_MODULES, CLEAN_FILES)
+        plot_version = code_version(PLOT_MODULES) if plots else None
+        report_keys, plot_keys = {}, {}
+        for name, inputs in data_analysis.REPORT_INPUTS.items():
+            params = {**dates, **{arg: arguments[arg] for arg in data_analysis.REPORT_ARGUMENTS.get(name, [])}}
+            raw_inputs = sorted({raw for table in inputs for raw in data_cleaning.CLEAN_INPUTS[table]})
+            report_keys[name] = cache.key(f"report/{name}", [raw_path(table) for table in raw_inputs], params, analysis_version)
+            if plots:
+                plot_keys[name] = cache.key(f"plot/{name}", params={'report': report_keys[name]}, version=plot_version)
+
+        # A report counts as cached only together with its plot
+        cached_reports = [name for name in report_keys
+                          if cache.get(report_keys[name]) and (not plots or cache.get(plot_keys[name]))]
+        missing_reports = [name for name in report_keys if name not in cached_reports]
+        if write == "none":
+            # Clean tables are not written, so they are neither restored nor cached; only the inputs
+            # of the missing reports are cleaned
+            cached_clean = []
+            needed = {table for name in missing_reports for table in data_analysis.REPORT_INPUTS[name]}
+            to_clean = [name for name in data_cleaning.CLEAN_TABLES if name in needed]
+        else:
+            cached_clean = [name for name in data_cleaning.CLEAN_TABLES if cache.get(clean_keys[name])]
+            to_clean = [name for name in data_cleaning.CLEAN_TABLES if name not in cached_clean]
+        stage.rows_out = len(cached_clean) + len(cached_reports)
+
+    customers = products = transactions = None
+    if to_clean:
+        with instrumentation.stage('cleaning'):
+            customers, products, transactions = data_cleaning.main(raw_dir=raw_dir, clean_dir=clean_dir, start_date=start_date, end_date=end_date,
+                                                                   chunksize=chunksize, fmt=fmt, write=write, workers=workers,
+                                                                   partitioned=partitioned, tables=to_clean)
+
+    with instrumentation.stage('restore') as stage:
+        for name in cached_clean:
+            for path in cache.restore_table(clean_keys[name], name, clean_dir, fmt):
+                stage.add_written(path)
+
+    if missing_reports:
+        with instrumentation.stage('analysis'):
+            data_analysis.main(clean_dir=clean_dir, reports_dir=reports_dir, plots_dir=plots_dir, start_date=start_date, end_date=end_date, fmt=fmt,
+                               customers=customers, products=products, transactions=transactions, period_months=period_months,
+                               plots=plots, plot_workers=plot_workers, engine=engine, chunksize=chunksize, tables=missing_reports)
+
+    with instrumentation.stage('restore') as stage:
+        for name in cached_reports:
+            restored = cache.restore_files(report_keys[name], reports_dir)
+            if plots:
+                restored += cache.restore_files(plot_keys[name], plots_dir)
+            for path in restored:
+                stage.add_written(path)
+
+    with instrumentation.stage('wait_clean_writes'):
+        storage.wait_for_background_writes()
+
+    with instrumentation.stage('store'):
+        if write != "none":
+            for name in to_clean:
+                cache.put_table(clean_keys[name], name, clean_dir, fmt)
+        plot_files = _plot_files(plots_dir, missing_reports) if plots and missing_reports else {}
+        for name in missing_reports:
+            cache.put_files(report_keys[name], f"report/{name}", [os.path.join(reports_dir, f"{name}.csv")])
+            if plots:
+                cache.put_files(plot_keys[name], f"plot/{name}", plot_files[name])
+        evicted = cache.evict()
+
+    print(f"Cache: reused {len(cached_clean)}/{len(clean_keys)} clean tables and {len(cached_reports)}/{len(report_keys)} reports"
+          f"{' with their plots' if plots else ''}; evicted {evicted} entries")
@@ -0,0 +1,222 @@
+import argparse
+import contextlib
+import importlib
+import logging
+import os
+import signal
+import sys
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Client, Listener
+
+# Resident pipeline worker.
+#
+#     python process_data.py serve --socket pipeline.sock            # start the worker
+#     python process_data.py --daemon --socket pipeline.sock ...     # run a job in it
+#
+# The worker imports numpy, pandas, the stage modules and (unless started with --no_plots) matplotlib
+# once, and keeps the clean customers and products tables of the last job in memory. A job whose raw
+# customers.csv/products.csv are unchanged (same path, size and modification time, and the same date
+# filter for customers) and whose normalization.json is unchanged reuses them instead of reading and
+# cleaning them again, and gets their quarantined rows and validation counts (see validation.py) from
+# the job that cleaned them. Module-level caches,
+# such as the parsed date spellings of date_normalization, also stay warm between jobs.
+#
+# Jobs are the usual process_data arguments, sent over a Unix domain socket. The socket and a random
+# key next to it (<socket>.key) are created readable by the owner only, and a client must prove it
+# holds the key before the worker accepts a job from it. Jobs run one at a time in the worker's process, in the submitting client's working directory,
+# and their output is streamed back to the client, which exits with the job's status. Runs with --cache
+# or --incremental keep their own state on disk and do not use the warm dimension tables.
+# Peak RSS in the run report of a job is the worker's peak over every job so far.
+
+# Imported when the worker starts, before the first job arrives
+PRELOAD_MODULES = ['data_cleaning', 'data_analysis', 'sampling', 'cache', 'incremental']
+
+# Length in bytes of the key clients authenticate with
+AUTHKEY_BYTES = 32
+
+DIMENSION_TABLES = ['customers', 'products']
+# Dimension tables filtered by start_date/end_date
+DATED_DIMENSIONS = ['customers']
+
+
+# Clean dimension tables of earlier jobs, keyed by the raw file they were cleaned from, with their quarantine
+class WarmDimensions:
+    def __init__(self):
+        self.tables = {}
+        self.pending = {}
+
+    def _key(self, raw_dir, name, start_date, end_date):
+        path = os.path.abspath(os.path.join(raw_dir, f"{name}.csv"))
+        if not os.path.exists(path):
+            return None
+        import normalization
+
+        stat, config = os.stat(path), os.stat(normalization.CONFIG_PATH)
+        dates = (start_date, end_date) if name in DATED_DIMENSIONS else ()
+        return (path, stat.st_size, stat.st_mtime_ns, config.st_mtime_ns, *dates)
+
+    # Clean tables still valid for this job's raw files, as copies. The files are fingerprinted
+    # before cleaning, so a file that changes during the job is cleaned again by the next one.
+    # The quarantine of each reused table is written to the job's clean_dir.
+    def get(self, raw_dir, clean_dir, start_date=None, end_date=None):
+        import validation
+
+        self.pending = {name: self._key(raw_dir, name, start_date, end_date) for name in DIMENSION_TABLES}
+        reused = {name: entry for name, entry in self.tables.items() if entry[0] is not None and entry[0] == self.pending.get(name)}
+        quarantine_dir = os.path.join(clean_dir, validation.QUARANTINE_DIR)
+        for name, (_, _, counts, rejected) in reused.items():
+            validation.save_summary(quarantine_dir, {name: counts})
+            path = os.path.join(quarantine_dir, f"{name}.csv")
+            if rejected is not None:
+                with open(path, 'wb') as fh:
+                    fh.write(rejected)
+            elif os.path.exists(path):
+                os.remove(path)
+        return {name: df.copy() for name, (_, df, _, _) in reused.items()}
+
+    def put(self, frames, clean_dir):
+        import validation
+
+        quarantine_dir = os.path.join(clean_dir, validation.QUARANTINE_DIR)
+        summary = validation.load_summary(quarantine_dir)
+        for name, key in self.pending.items():
+            if frames.get(name) is not None and name in summary:
+                path = os.path.join(quarantine_dir, f"{name}.csv")
+                rejected = None
+                if os.path.exists(path):
+                    with open(path, 'rb') as fh:
+                        rejected = fh.read()
+                self.tables[name] = (key, frames[name], summary[name], rejected)
+        self.pending = {}
+
+
+# File-like object that streams a job's output back to its client
+class ConnectionWriter:
+    def __init__(self, conn):
+        self.conn = conn
+        self.connected = True
+
+    def write(self, text):
+        if text and self.connected:
+            try:
+                self.conn.send(('output', text))
+            except OSError:
+                # The client went away; the job still runs to completion
+                self.connected = False
+        return len(text)
+
+    def flush(self):
+        pass
+
+
+# Logging handlers keep the stream they were created with; this one always writes to the current sys.stdout
+class CurrentStdout:
+    def write(self, text):
+        return sys.stdout.write(text)
+
+    def flush(self):
+        sys.stdout.flush()
+
+
+# SIGTERM (e.g. from a process supervisor) stops the worker like Ctrl-C. A second SIGTERM during
+# shutdown gets the default action instead of interrupting the cleanup.
+def _terminate(signum, frame):
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    raise KeyboardInterrupt
+
+
+# The file holding the worker's authentication key, next to its socket
+def _key_path(address):
+    return f"{address}.key"
+
+
+# A fresh key written to the key file and the listener for address, both created owner-only
+def _listen(address):
+    key = os.urandom(AUTHKEY_BYTES)
+    old_umask = os.umask(0o177)
+    try:
+        fd = os.open(_key_path(address), os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        with os.fdopen(fd, 'wb') as fh:
+            fh.write(key)
+        return Listener(address, family='AF_UNIX', authkey=key)
+    finally:
+        os.umask(old_umask)
+
+
+def serve(address, plots=True):
+    import process_data
+
+    try:
+        Client(address, family='AF_UNIX').close()
+        raise RuntimeError(f"A resident worker is already listening on {address}")
+    except (FileNotFoundError, ConnectionRefusedError):
+        for path in (address, _key_path(address)):
+            if os.path.exists(path):
+                os.remove(path)
+
+    for name in PRELOAD_MODULES + (['plotting'] if plots else []):
+        importlib.import_module(name)
+    logging.basicConfig(level=logging.INFO, format='%(message)s', stream=CurrentStdout(), force=True)
+    previous_handler = signal.signal(signal.SIGTERM, _terminate)
+    dimensions = WarmDimensions()
+    home = os.getcwd()
+
+    with _listen(address) as listener:
+        print(f"Resident worker listening on {address} (pid {os.getpid()})")
+        try:
+            while True:
+                try:
+                    conn = listener.accept()
+                except (AuthenticationError, EOFError, OSError):
+                    # A client without the key, or one that hung up during the handshake
+                    continue
+                with conn:
+                    try:
+                        job = conn.recv()
+                    except (EOFError, OSError):
+                        continue
+                    args = argparse.Namespace(**job['args'])
+                    print(f"Job: {args.command} from {job['cwd']}")
+                    writer = ConnectionWriter(conn)
+                    try:
+                        os.chdir(job['cwd'])
+                        with contextlib.redirect_stdout(writer), contextlib.redirect_stderr(writer):
+                            status = process_data.run_pipeline(args, dimensions)
+                    finally:
+                        os.chdir(home)
+                    print(f"Job {status}")
+                    if writer.connected:
+                        conn.send(('status', status))
+        except KeyboardInterrupt:
+            # Closing the listener removes the socket file
+            print("Resident worker stopped")
+        finally:
+            os.remove(_key_path(address))
+            signal.signal(signal.SIGTERM, previous_handler)
+
+
+# Runs args as a job in the resident worker at address, echoing its output. Returns the job's status.
+def submit(address, args):
+    job = {'cwd': os.getcwd(), 'args': {**vars(args), 'daemon': False}}
+    try:
+        with open(_key_path(address), 'rb') as fh:
+            key = fh.read()
+        conn = Client(address, family='AF_UNIX', authkey=key)
+    except (FileNotFoundError, ConnectionRefusedError):
+        logging.error(f"✗ No resident worker is listening on {address}; start one with: python process_data.py serve --socket {address}")
+        return "failed"
+    except (AuthenticationError, PermissionError):
+        logging.error(f"✗ The resident worker on {address} did not accept this client; only the user who started it can submit jobs")
+        return "failed"
+
+    with conn:
+        conn.send(job)
+        while True:
+            try:
+                kind, value = conn.recv()
+            except EOFError:
+                logging.error(f"✗ The resident worker on {address} closed the connection before the job finished")
+                return "failed"
+            if kind == 'status':
+                return value
+            sys.stdout.write(value)
@@ -1,198 +1,59 @@
 import numpy as np
 import pandas as pd
-import matplotlib.pyplot as plt
 import os
 
-def main(clean_dir="data_clean", reports_dir="reports", plots_dir="plots", start_date=None, end_date=None):
-
-     # Parse date filters safely
-    if start_date:
-        start_date = pd.to_datetime(start_date)
-    if end_date:
-        end_date = pd.to_datetime(end_date)
-
-    customers = pd.read_csv(f"{clean_dir}/customers.csv")
-    products = pd.read_csv(f"{clean_dir}/products.csv")
-    transactions = pd.read_csv(f"{clean_dir}/transactions.csv")
-
-    #to store reports and plots after analysis
-    report_tables = {}
-    plots_to_save = []
-
-    #Merging transactions and products dataframes to get an unified dataframe for analysis
-    txn_prod = transactions.merge(products, on='product_id', how='left')
-
-    # Standardize datetime
-    txn_prod['transaction_date'] = pd.to_datetime(txn_prod['transaction_date'])
-
-    # Apply date filtering
-    if start_date:
-        txn_prod = txn_prod[txn_prod['transaction_date'] >= start_date]
-    if end_date:
-        txn_prod = txn_prod[txn_prod['transaction_date'] <= end_date]
-
-    #Time-based Revenue Trends
-    txn_prod['month'] = txn_prod['transaction_date'].dt.to_period('M')
-    txn_prod['cost_amount'] = txn_prod['cost_price'] * txn_prod['quantity']
-    txn_prod['selling_amount'] = txn_prod['price'] * txn_prod['quantity']
-    txn_prod['profit'] = txn_prod['selling_amount'] - txn_prod['cost_amount']
-    txn_prod['profit_pct'] = (txn_prod['profit'] / txn_prod['cost_amount']) * 100
-
-    monthly_trends = (txn_prod.groupby('month').agg(
-            total_cost=('cost_amount', 'sum'),
-            total_revenue=('selling_amount', 'sum'),
-            total_profit=('profit', 'sum')).reset_index())
-
-    monthly_trends['profit_pct'] = (monthly_trends['total_profit'] / monthly_trends['total_cost']) * 100
+import instrumentation
+import retention
+import schema
+import storage
+from metrics import MetricAccumulator, MetricSpec, compute_metrics
+
+# Only the columns the reports use are read from the clean tables.
+TRANSACTION_COLUMNS = ['transaction_id', 'customer_id', 'product_id', 'transaction_date', 'quantity', 'price']
+PRODUCT_COLUMNS = ['product_id', 'category', 'cost_price']
+CUSTOMER_COLUMNS = ['customer_id', 'country']
+
+# Default time windows (months) for the active and repeat customer summaries
+PERIOD_MONTHS = [15, 12, 9, 6, 3]
+
+# Analysis engines:
+#   pandas   loads transactions whole and aggregates one merged fact table (txn_prod)
+#   chunked  streams transactions in chunks and folds each chunk's merged rows into partial
+#            aggregates, so txn_prod never exists in full; memory is bounded by the chunk size
+#            and the number of groups. Reports match the pandas engine (sums can differ in the
+#            last floating-point digits, since they are added up in a different order).
+ENGINES = ['pandas', 'chunked']
+ANALYSIS_CHUNKSIZE = 1_000_000
+
+#=======================
+# Report finishing steps
+#=======================
+# Shared by the full analysis below and by incremental runs, which build the
+# same aggregates from stored partial state instead of from txn_prod.
+
+def add_profit_pct(metrics):
+    metrics['profit_pct'] = (metrics['total_profit'] / metrics['total_cost']) * 100
+    return metrics
+
+def finish_monthly_trends(monthly_trends):
+    monthly_trends = add_profit_pct(monthly_trends)
     monthly_trends['revenue_growth_pct'] = monthly_trends['total_revenue'].pct_change() * 100
+    return monthly_trends
 
-    report_tables['monthly_trends'] = monthly_trends
-
-    #Plot for time-based revenue trends
-    def plot_monthly_financials_with_profit_pct(monthly_trends):
-        x = range(len(monthly_trends))  # Use numeric index instead of string
-        x_labels = monthly_trends['month'].astype(str)  # Keep labels as strings
-        fig, ax1 = plt.subplots(figsize=(9, 5))
-        
-        # Left axis: amounts
-        ax1.plot(x, monthly_trends['total_cost'], label='Total Cost')
-        ax1.plot(x, monthly_trends['total_revenue'], label='Total Revenue')
-        ax1.plot(x, monthly_trends['total_profit'], label='Total Profit')
-        ax1.set_xlabel("Month")
-        ax1.set_ylabel("Amount")
-        ax1.set_xticks(x)
-        ax1.set_xticklabels(x_labels, rotation=45)
-        
-        # Right axis: profit % and revenue growth %
-        ax2 = ax1.twinx()
-        ax2.plot(x, monthly_trends['profit_pct'], linestyle='--', marker='o', label='Profit %')
-        ax2.plot(x, monthly_trends['revenue_growth_pct'], linestyle='--', marker='s', label='Revenue Growth %')
-        ax2.axhline(0, linestyle=':', color='gray', alpha=0.5)
-        ax2.set_ylabel("Percentage (%)")
-        
-        # Legend
-        lines1, labels1 = ax1.get_legend_handles_labels()
-        lines2, labels2 = ax2.get_legend_handles_labels()
-        ax1.legend(lines1 + lines2, labels1 + labels2, loc='best')
-        
-        plt.title("Monthly Cost, Revenue, Profit, Profit % and Revenue Growth Trend")
-        plt.tight_layout()
-    
-    plots_to_save.append(("monthly_financial_trends",lambda: plot_monthly_financials_with_profit_pct(monthly_trends)))
-
-    #Product Performance Analysis
-    product_metrics = (txn_prod.groupby('product_id')
-        .agg(
-            total_cost=('cost_amount', 'sum'),
-            total_revenue=('selling_amount', 'sum'),
-            total_profit=('profit', 'sum')
-        ).reset_index())
-    product_metrics['profit_pct'] = (product_metrics['total_profit'] /product_metrics['total_cost']) * 100
-
-    report_tables['product_metrics'] = product_metrics
-
-    #Plot for Product Metrics - top 10 products
-    def plot_product_profit_pct(product_metrics, top_n=10):
-        top_products = product_metrics.sort_values('total_revenue', ascending=False).head(top_n)
-
-        plt.figure(figsize=(9, 5))
-        x = range(len(top_products))
-        x_labels = top_products['product_id'].astype(str)
-        
-        plt.bar(x, top_products['profit_pct'])
-        plt.xticks(x, x_labels, rotation=45)
-        
-        plt.xlabel("Product ID")
-        plt.ylabel("Profit %")
-        plt.title(f"Top {top_n} Products by Revenue - Profit %")
-        plt.tight_layout()
-
-    plots_to_save.append(("product_performance_analysis",lambda: plot_product_profit_pct(product_metrics))) 
-
-    #Category Performance Analysis
-    category_metrics = (txn_prod.groupby('category')
-        .agg(
-            total_cost=('cost_amount', 'sum'),
-            total_revenue=('selling_amount', 'sum'),
-            total_profit=('profit', 'sum')
-        ).reset_index())
-    category_metrics['profit_pct'] = (category_metrics['total_profit'] / category_metrics['total_cost']) * 100
-
-    report_tables['category_metrics'] = category_metrics
-
-    #Plot for Category metrics
-    def plot_category_financials(category_metrics):
-        x_pos = range(len(category_metrics))  # Numeric positions
-        x_labels = category_metrics['category']  # String labels
-        width = 0.35
-
-        fig, ax1 = plt.subplots(figsize=(9, 5))
-
-        ax1.bar([p - width/2 for p in x_pos], category_metrics['total_revenue'], width=width, label='Revenue', alpha=0.7)
-        ax1.bar([p + width/2 for p in x_pos], category_metrics['total_cost'], width=width, label='Cost', alpha=0.7)
-        ax1.set_ylabel("Amount")
-        ax1.set_xlabel("Category")
-        ax1.set_xticks(x_pos)
-        ax1.set_xticklabels(x_labels, rotation=45)
-
-        ax2 = ax1.twinx()
-        ax2.plot(x_pos, category_metrics['profit_pct'], marker='o', linestyle='--', label='Profit %')
-        ax2.set_ylabel("Profit %")
-
-        lines1, labels1 = ax1.get_legend_handles_labels()
-        lines2, labels2 = ax2.get_legend_handles_labels()
-        ax1.legend(lines1 + lines2, labels1 + labels2, loc='best')
-
-        plt.title("Category-wise Cost, Revenue and Profit %")
-        plt.tight_layout()
-
-    plots_to_save.append(("category_performance_analysis", lambda: plot_category_financials(category_metrics)))
-
-    #=======================
-    # KPIs
-    #=======================
-
-    #Average Order Value (AOV)
-    monthly_aov = (txn_prod.groupby('month')
-        .agg(
-            total_revenue=('selling_amount', 'sum'),
-            total_transactions=('transaction_id', 'nunique')
-        ).reset_index())
+def finish_monthly_aov(monthly_aov):
     monthly_aov['aov'] = monthly_aov['total_revenue'] / monthly_aov['total_transactions']
+    return monthly_aov
 
-    report_tables['monthly_aov'] = monthly_aov
-
-    #Plot for AOV
-    def plot_monthly_aov(monthly_aov):
-        x = range(len(monthly_aov))  # Use numeric index
-        x_labels = monthly_aov['month'].astype(str)  # Keep labels as strings
-        
-        plt.figure(figsize=(9, 5))
-        plt.plot(x, monthly_aov['aov'], marker='o')
-        plt.xticks(x, x_labels, rotation=45)
-        plt.xlabel("Month")
-        plt.ylabel("Average Order Value (AOV)")
-        plt.title("Monthly Average Order Value (AOV) Trend")
-        plt.tight_layout()
-
-    plots_to_save.append(("monthly_aov",lambda: plot_monthly_aov(monthly_aov)))
-
-    #Customer Purchase Behaviour
-    customer_behavior = (txn_prod.groupby('customer_id')
-        .agg(
-            total_transactions=('transaction_id', 'nunique'),
-            total_quantity=('quantity', 'sum'),
-            total_revenue=('selling_amount', 'sum'),
-            avg_order_value=('selling_amount', 'mean'),
-            first_purchase=('transaction_date', 'min'),
-            last_purchase=('transaction_date', 'max')
-        ).reset_index().sort_values('total_revenue', ascending=False))
+# Sorts customers by revenue, assigns Low/Medium/High value segments and summarises them.
+# Customers whose revenue only differs by floating-point noise keep their customer_id order (the sort is stable),
+# so the order does not depend on the order an engine added the amounts up in.
+REVENUE_SORT_DECIMALS = 6
 
+def segment_customers(customer_behavior):
+    customer_behavior = customer_behavior.sort_values('total_revenue', ascending=False, kind='stable',
+                                                      key=lambda revenue: revenue.round(REVENUE_SORT_DECIMALS))
     customer_behavior['value_segment'] = pd.qcut(customer_behavior['total_revenue'], q=3, labels=['Low', 'Medium', 'High'], duplicates='drop')
 
-    report_tables['customer_behavior'] = customer_behavior
-    report_tables['top_10_customers'] = customer_behavior.head(10)
-
     segment_summary = (customer_behavior.groupby('value_segment', observed=True)
         .agg(
             num_customers=('customer_id', 'count'),
@@ -202,108 +63,250 @@ def main(clean_dir="data_clean", reports_dir="reports", plots_dir="plots", start
 
     segment_summary['revenue_pct'] = (segment_summary['total_revenue'] / segment_summary['total_revenue'].sum()) * 100
 
-    report_tables['segment_summary'] = segment_summary
-
-    #Active Customers Summary
-    ref_date = txn_prod['transaction_date'].max()
-
-    def active_customers_last_n_months(df, n_months, ref_date):
-        cutoff_date = ref_date - pd.DateOffset(months=n_months)
-        return df.loc[df['transaction_date'] >= cutoff_date, 'customer_id'].nunique()
-
-    period_months = [15, 12, 9, 6, 3]
-    active_customers_summary = pd.DataFrame({
-        'period_months': period_months,
-        'active_customers': [active_customers_last_n_months(txn_prod, n, ref_date) for n in period_months]
-    })
-
-    report_tables['active_customers_summary'] = active_customers_summary
-
-    #Plot for Active Customers Summary
-    def plot_active_customers_windows(active_customers_summary):
-        plt.figure(figsize=(8, 5))
-        plt.plot(active_customers_summary['period_months'],active_customers_summary['active_customers'],marker='o')
-        plt.gca().invert_xaxis()  # 15 → 3 months (time narrowing)
-        plt.xlabel("Time Window (Months)")
-        plt.ylabel("Active Customers")
-        plt.title("Active Customers Across Time Windows")
-        plt.tight_layout()
-
-    plots_to_save.append(("active_customers_summary",lambda: plot_active_customers_windows(active_customers_summary)))
-
-    #Repeat Customer Summary
-    def repeat_customer_rate_last_n_months(df, n_months, ref_date):
-        cutoff_date = ref_date - pd.DateOffset(months=n_months)
-        txn_window = df[df['transaction_date'] >= cutoff_date]
-        customer_txns = (txn_window.groupby('customer_id')['transaction_id'].nunique())
-        active_customers = customer_txns.count()
-        repeat_customers = (customer_txns > 1).sum()
-        return (repeat_customers / active_customers) * 100
-
-    repeat_customer_summary = pd.DataFrame({
-        'period_months': period_months,
-        'repeat_customer_rate_pct': [
-            repeat_customer_rate_last_n_months(txn_prod, 15, ref_date),
-            repeat_customer_rate_last_n_months(txn_prod, 12, ref_date),
-            repeat_customer_rate_last_n_months(txn_prod, 9, ref_date),
-            repeat_customer_rate_last_n_months(txn_prod, 6, ref_date),
-            repeat_customer_rate_last_n_months(txn_prod, 3, ref_date)
-        ]})
-
-    report_tables['repeat_customer_summary'] = repeat_customer_summary
-
-    #Plot for Repeat Customer Summary
-    def plot_repeat_customer_rate(repeat_customer_summary):
-        plt.figure(figsize=(8, 5))
-        plt.plot(
-            repeat_customer_summary['period_months'],
-            repeat_customer_summary['repeat_customer_rate_pct'],
-            marker='o'
-        )
-        plt.gca().invert_xaxis()
-        plt.xlabel("Time Window (Months)")
-        plt.ylabel("Repeat Customer Rate (%)")
-        plt.title("Repeat Customer Rate Across Time Windows")
-        plt.tight_layout()
-
-    plots_to_save.append(("Repeat Customers Summary",lambda: plot_repeat_customer_rate(repeat_customer_summary)))
-
-    #Customer Demographics Analysis
-    customers['signup_date'] = pd.to_datetime(customers['signup_date'])
-    customer_country_summary = (customers.groupby('country')
+    return customer_behavior, segment_summary
+
+#=======================
+# Report specs
+#=======================
+# Report tables computed from txn_prod. Specs on the same grain share one groupby pass:
+# monthly_trends and monthly_aov are fused, and product/category metrics are both rolled up
+# from a single (product_id, category) aggregate.
+
+FINANCIALS = dict(
+    total_cost=('cost_amount', 'sum'),
+    total_revenue=('selling_amount', 'sum'),
+    total_profit=('profit', 'sum'))
+
+PRODUCT_GRAIN = ['product_id', 'category']
+
+REPORT_SPECS = [
+    MetricSpec('monthly_trends', by='month', aggs=FINANCIALS, finish=finish_monthly_trends),
+    MetricSpec('monthly_aov', by='month', aggs=dict(
+        total_revenue=('selling_amount', 'sum'),
+        total_transactions=('transaction_id', 'nunique')), finish=finish_monthly_aov),
+    MetricSpec('product_metrics', by='product_id', grain=PRODUCT_GRAIN, aggs=FINANCIALS, finish=add_profit_pct),
+    MetricSpec('category_metrics', by='category', grain=PRODUCT_GRAIN, aggs=FINANCIALS, finish=add_profit_pct),
+    MetricSpec('customer_behavior', by='customer_id', aggs=dict(
+        total_transactions=('transaction_id', 'nunique'),
+        total_quantity=('quantity', 'sum'),
+        total_revenue=('selling_amount', 'sum'),
+        avg_order_value=('selling_amount', 'mean'),
+        first_purchase=('transaction_date', 'min'),
+        last_purchase=('transaction_date', 'max'))),
+]
+
+# Clean tables and arguments each report table depends on, so the result cache only invalidates the
+# reports whose inputs changed. Tables built from txn_prod depend on products too, since the merge can
+# repeat transaction rows; retention only uses distinct transactions and their latest dates.
+FACT_INPUTS = ('transactions', 'products')
+RETENTION_TABLES = ['active_customers_summary', 'repeat_customer_summary', 'cohort_retention']
+SEGMENT_TABLES = ['customer_behavior', 'top_10_customers', 'segment_summary']
+REPORT_INPUTS = {
+    'monthly_trends': FACT_INPUTS,
+    'monthly_aov': FACT_INPUTS,
+    'product_metrics': FACT_INPUTS,
+    'category_metrics': FACT_INPUTS,
+    'customer_behavior': FACT_INPUTS,
+    'top_10_customers': FACT_INPUTS,
+    'segment_summary': FACT_INPUTS,
+    'active_customers_summary': ('transactions',),
+    'repeat_customer_summary': ('transactions',),
+    'cohort_retention': ('transactions',),
+    'customer_country_summary': ('customers',),
+}
+REPORT_ARGUMENTS = {
+    'active_customers_summary': ['period_months'],
+    'repeat_customer_summary': ['period_months'],
+}
+
+#Transactions joined with product costs and categories, plus the derived columns the report specs use
+def fact_rows(transactions, products):
+    txn_prod = transactions.merge(products, on='product_id', how='left')
+    txn_prod['month'] = txn_prod['transaction_date'].dt.to_period('M')
+    txn_prod['cost_amount'] = schema.widen_money(txn_prod['cost_price']) * txn_prod['quantity']
+    txn_prod['selling_amount'] = schema.widen_money(txn_prod['price']) * txn_prod['quantity']
+    txn_prod['profit'] = txn_prod['selling_amount'] - txn_prod['cost_amount']
+    return txn_prod
+
+# Chunked engine: report tables of REPORT_SPECS, retention events and the latest transaction date,
+# from transaction chunks that are each merged with products, aggregated and dropped.
+def chunked_metrics(chunks, products, specs=REPORT_SPECS):
+    metrics = MetricAccumulator(specs)
+    events = retention.EventAccumulator()
+    latest_dates = []
+    for transactions in chunks:
+        with instrumentation.stage('chunk', rows_in=len(transactions)) as stage:
+            txn_prod = fact_rows(schema.optimize_dtypes(transactions, 'transactions'), products)
+            metrics.add(txn_prod)
+            events.add(txn_prod)
+            latest_dates.append(txn_prod['transaction_date'].max())
+            stage.rows_out = len(txn_prod)
+    return metrics.tables(), events.events(), pd.Series(latest_dates, dtype='datetime64[ns]').max()
+
+def customer_country_summary_table(customers):
+    return (customers.groupby('country', observed=True)
     .agg(customer_count=('customer_id', 'count'))
     .reset_index()
     .sort_values('customer_count', ascending=False))
 
-    report_tables['customer_country_summary'] = customer_country_summary
-
-    #Plot for Customer Demographics
-    def plot_customer_demographics(customer_country_summary):
-        plt.figure(figsize=(9, 5))
-        plt.barh(customer_country_summary['country'], customer_country_summary['customer_count'])
-        plt.xlabel("Customer Count")
-        plt.ylabel("Country")
-        plt.title("Customer Count by Country")
-        plt.gca().invert_yaxis()
-        plt.tight_layout()
-
-    plots_to_save.append(("customer_demographics", lambda: plot_customer_demographics(customer_country_summary)))
-
+# Saves every report table as CSV and, unless plots is False, renders the plots of the tables present.
+# plot_workers > 1 renders plots in a process pool.
+def save_outputs(report_tables, reports_dir="reports", plots_dir="plots", plots=True, plot_workers=1):
     # Create output folders
     os.makedirs(reports_dir, exist_ok=True)
-    os.makedirs(plots_dir, exist_ok=True)
 
     # Save all report tables
-    for name, df in report_tables.items():
-        df.to_csv(f"{reports_dir}/{name}.csv", index=False)
+    with instrumentation.stage('save_reports') as stage:
+        for name, df in report_tables.items():
+            df.to_csv(f"{reports_dir}/{name}.csv", index=False)
+            stage.add_written(f"{reports_dir}/{name}.csv")
+
+    # Save all plots. Imported here so runs without plots never load matplotlib.
+    if plots:
+        with instrumentation.stage('plots', hot=True) as stage:
+            import plotting
+
+            os.makedirs(plots_dir, exist_ok=True)
+            for path in plotting.render_plots(report_tables, plots_dir, plot_workers):
+                stage.add_written(path)
+
+# customers/products/transactions may be passed in directly (e.g. the frames returned by data_cleaning.main);
+# any that are None are read from clean_dir. tables limits the run to a subset of REPORT_INPUTS (e.g. the
+# ones missing from the result cache); only the clean tables those need are loaded. Returns the report tables.
+# sample_rows switches to the sampled preview (see sampling.py): estimates of sampling.SAMPLE_TABLES with
+# error bounds, from up to sample_rows transactions per month and customer_fraction of the customers,
+# saved under <reports_dir>/sample and <plots_dir>/sample.
+def main(clean_dir="data_clean", reports_dir="reports", plots_dir="plots", start_date=None, end_date=None, fmt="csv",
+         customers=None, products=None, transactions=None, period_months=None, plots=True, plot_workers=1,
+         engine="pandas", chunksize=None, tables=None, sample_rows=None, customer_fraction=None):
+
+    if engine not in ENGINES:
+        raise ValueError(f"Unknown analysis engine '{engine}', expected one of {ENGINES}")
+    period_months = period_months or PERIOD_MONTHS
+    chunksize = chunksize or ANALYSIS_CHUNKSIZE
+    tables = list(tables or REPORT_INPUTS)
+    specs = [spec for spec in REPORT_SPECS
+             if spec.name in tables or (spec.name == 'customer_behavior' and set(tables) & set(SEGMENT_TABLES))]
+    need_transactions = bool(specs) or bool(set(tables) & set(RETENTION_TABLES))
+
+     # Parse date filters safely
+    if start_date:
+        start_date = pd.to_datetime(start_date)
+    if end_date:
+        end_date = pd.to_datetime(end_date)
+
+    # Date filtering is pushed down into the read where the storage format supports it.
+    # Every table gets the shared dtype plan (categoricals, downcast integers, float32 money).
+    def load(name, df, columns, **date_filter):
+        with instrumentation.stage(f"load_{name}") as stage:
+            if df is None:
+                df = storage.read_table(clean_dir, name, fmt, columns=columns, dtype=schema.read_dtypes(name, columns), **date_filter)
+                files = storage.table_files(clean_dir, name, fmt, **date_filter)
+                for path in files:
+                    stage.add_read(path)
+                if storage.is_partitioned(clean_dir, name):
+                    print(f"Read {len(files)} of {len(storage.table_files(clean_dir, name, fmt))} month partitions of {name}")
+            else:
+                stage.rows_in = len(df)
+                df = storage.select_table(df, columns=columns, **date_filter)
+            df = schema.optimize_dtypes(df, name)
+            stage.rows_out = len(df)
+        schema.memory_report(name, df)
+        return df
+
+    # Transactions in chunks for the chunked engine, read from clean_dir or sliced from the frame passed in
+    def transaction_chunks(date_filter):
+        if transactions is not None:
+            for offset in range(0, max(len(transactions), 1), chunksize):
+                yield storage.select_table(transactions.iloc[offset:offset + chunksize], columns=TRANSACTION_COLUMNS, **date_filter)
+        else:
+            yield from storage.iter_table(clean_dir, 'transactions', fmt, chunksize, columns=TRANSACTION_COLUMNS,
+                                          dtype=schema.read_dtypes('transactions', TRANSACTION_COLUMNS), **date_filter)
+
+    # Records the transaction files a streaming stage reads
+    def add_transaction_reads(stage, date_filter):
+        if transactions is None:
+            files = storage.table_files(clean_dir, 'transactions', fmt, **date_filter)
+            for path in files:
+                stage.add_read(path)
+            if storage.is_partitioned(clean_dir, 'transactions'):
+                print(f"Read {len(files)} of {len(storage.table_files(clean_dir, 'transactions', fmt))} month partitions of transactions")
+
+    date_filter = dict(date_col='transaction_date', start_date=start_date, end_date=end_date)
+    if sample_rows is not None:
+        import sampling
+
+        #Sampled preview: one pass over the transactions, estimates with error bounds
+        products = load('products', products, PRODUCT_COLUMNS)
+        with instrumentation.stage('sample', hot=True) as stage:
+            add_transaction_reads(stage, date_filter)
+            report_tables = sampling.preview_tables(transaction_chunks(date_filter), products, period_months, sample_rows,
+                                                    customer_fraction or sampling.DEFAULT_CUSTOMER_FRACTION)
+        save_outputs(report_tables, os.path.join(reports_dir, sampling.SAMPLE_DIR), os.path.join(plots_dir, sampling.SAMPLE_DIR), plots, plot_workers)
+        print(f"Sampled preview is completed. Files and Plots moved to the {sampling.SAMPLE_DIR} folders")
+        return report_tables
+
+    if 'customer_country_summary' in tables:
+        customers = load('customers', customers, CUSTOMER_COLUMNS)
+    if need_transactions:
+        products = load('products', products, PRODUCT_COLUMNS)
+
+    #to store reports after analysis
+    report_tables = {}
+
+    if need_transactions and engine == 'chunked':
+        #Report specs and retention events aggregated chunk by chunk, without building txn_prod
+        with instrumentation.stage('metrics', hot=True) as stage:
+            add_transaction_reads(stage, date_filter)
+            metric_tables, events, ref_date = chunked_metrics(transaction_chunks(date_filter), products, specs)
+            report_tables.update(metric_tables)
+    elif need_transactions:
+        transactions = load('transactions', transactions, TRANSACTION_COLUMNS,
+                            date_col='transaction_date', start_date=start_date, end_date=end_date)
+
+        #Merging transactions and products dataframes to get an unified dataframe for analysis
+        with instrumentation.stage('merge', rows_in=len(transactions), hot=True) as stage:
+            txn_prod = fact_rows(transactions, products)
+            stage.rows_out = len(txn_prod)
+
+        #Time-based Revenue Trends, Product and Category Performance, AOV and Customer Purchase Behaviour
+        with instrumentation.stage('metrics', rows_in=len(txn_prod), hot=True):
+            report_tables.update(compute_metrics(txn_prod, specs))
+
+    #Customer value segments
+    if set(tables) & set(SEGMENT_TABLES):
+        with instrumentation.stage('segments') as stage:
+            customer_behavior = report_tables['customer_behavior']
+            customer_behavior, segment_summary = segment_customers(customer_behavior)
+            stage.rows_out = len(segment_summary)
+
+        report_tables['customer_behavior'] = customer_behavior
+        report_tables['top_10_customers'] = customer_behavior.head(10)
+        report_tables['segment_summary'] = segment_summary
+
+    #Active and Repeat Customer Summaries - every window from one sweep over per-customer sorted dates
+    if set(tables) & set(RETENTION_TABLES):
+        with instrumentation.stage('retention', rows_in=len(txn_prod) if engine == 'pandas' else None, hot=True):
+            if engine == 'pandas':
+                events = retention.transaction_events(txn_prod)
+                ref_date = txn_prod['transaction_date'].max()
+            windows = retention.window_summary(retention.customer_sweep(events), period_months, ref_date)
+
+            report_tables['active_customers_summary'] = windows[['period_months', 'active_customers']]
+            report_tables['repeat_customer_summary'] = windows[['period_months', 'repeat_customer_rate_pct']]
+
+            #Monthly cohort retention
+            report_tables['cohort_retention'] = retention.cohort_retention(events)
+
+    #Customer Demographics Analysis
+    if 'customer_country_summary' in tables:
+        report_tables['customer_country_summary'] = customer_country_summary_table(customers)
 
-    # Save all plots
-    for filename, plot_fn in plots_to_save:
-        plot_fn()
-        plt.savefig(f"{plots_dir}/{filename}.png")
-        plt.close()
+    report_tables = {name: table for name, table in report_tables.items() if name in tables}
+    save_outputs(report_tables, reports_dir, plots_dir, plots, plot_workers)
 
     print("Analysis is completed. Files and Plots moved to folders")
+    return report_tables
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -1,129 +1,385 @@
 import numpy as np
 import pandas as pd
 import os
+from concurrent.futures import ProcessPoolExecutor
+
+import instrumentation
+import normalization
+import partitioning
+import schema
+import storage
+import validation
+from date_normalization import normalize_dates
+from profiling import FrameProfile, merge_profiles
+
+CLEAN_TABLES = ['customers', 'products', 'transactions']
+
+# Raw files each clean table is built from; transactions are validated against the product ids
+CLEAN_INPUTS = {
+    'customers': ['customers'],
+    'products': ['products'],
+    'transactions': ['transactions', 'products'],
+}
 
 # Comprehensive profile of all 3 dataframes to find unique and null counts.
-def profile_dataframes(dataframes_dict):
+# Each column is profiled in a single pass; unique_mode='approx' or 'auto' uses HyperLogLog for high-cardinality columns.
+def profile_dataframes(dataframes_dict, unique_mode='exact'):
     profiles = {}
     
     for name, df in dataframes_dict.items():
-        profile_data = {
-            'Column': df.columns,
-            'Dtype': [df[col].dtype for col in df.columns],
-            'Non-Null Count': [df[col].count() for col in df.columns],
-            'Null Count': [df[col].isnull().sum() for col in df.columns],
-            'Null %': [round(df[col].isnull().sum() / len(df) * 100, 2) for col in df.columns],
-            'Unique Count': [df[col].nunique() for col in df.columns],
-            'Sample Values': [df[col].dropna().iloc[0] if not df[col].dropna().empty else None for col in df.columns]
-        }
-        
-        profile_df = pd.DataFrame(profile_data)
-        profiles[name] = profile_df
-        
-        print(f"\n{'='*80}")
-        print(f"PROFILE: {name.upper()}")
-        print(f"Shape: {df.shape[0]:,} rows × {df.shape[1]} columns")
-        print(f"{'='*80}")
-        print(profile_df.to_string(index=False))
-        print()
+        profiles[name] = print_profile(name, FrameProfile.from_frame(schema.missing_dates_as_na(df, name), unique_mode))
     
     return profiles
 
+# Prints a (possibly merged) FrameProfile and returns it as the profile table.
+def print_profile(name, frame_profile):
+    profile_df = frame_profile.to_frame()
+
+    print(f"\n{'='*80}")
+    print(f"PROFILE: {name.upper()}")
+    print(f"Shape: {frame_profile.rows:,} rows × {len(frame_profile.columns)} columns")
+    print(f"{'='*80}")
+    print(profile_df.to_string(index=False))
+    print()
+
+    return profile_df
+
+# Parses date columns straight to datetime64 (day precision). Separator and whitespace irregularities are
+# cleaned per distinct raw string and each format group is parsed with an explicit format; unparseable values become NaT.
 def standardize_date_columns(df, cols):
-    for col in cols:
-        df[col] = (df[col].astype(str).str.strip().str.replace(r'\s+', '', regex=True).str.replace('/', '-', regex=False).pipe(pd.to_datetime, errors='coerce').dt.strftime('%Y-%m-%d'))
+    with instrumentation.stage('dates', rows_in=len(df) * len(cols)):
+        for col in cols:
+            df[col] = normalize_dates(df[col])
     return df 
 
-#All execution under the if-main block for reusability in other scripts
-def main(raw_dir="data_raw", clean_dir="data_clean", start_date=None, end_date=None):
-
-     # Parse date filters safely
+# Keeps only the rows whose date column falls inside [start_date, end_date]. Either bound may be None.
+def filter_date_range(df, col, start_date=None, end_date=None):
     if start_date:
-        start_date = pd.to_datetime(start_date)
+        df = df[df[col] >= start_date]
     if end_date:
-        end_date = pd.to_datetime(end_date)
+        df = df[df[col] <= end_date]
+    return df
 
-    #Loading Data
-    customers = pd.read_csv(f"{raw_dir}/customers.csv")
-    products = pd.read_csv(f"{raw_dir}/products.csv")
-    transactions = pd.read_csv(f"{raw_dir}/transactions.csv")
+# Product ids of the products that pass validation: the reference set of the transactions' product_id rule.
+# products is the raw products frame if it is already loaded.
+def valid_product_ids(raw_dir, products=None):
+    columns = validation.rule_columns('products')
+    if products is None:
+        products = schema.read_csv(f"{raw_dir}/products.csv", 'products', compact_money=False, usecols=columns)
+    return validation.apply(products[columns], 'products')['product_id'].unique()
 
-    profiles = profile_dataframes({
-        'customers': customers,
-        'products': products,
-        'transactions': transactions
-    })
+# Standardises and parses transaction dates, quarantines the rows failing validation (see validation.py),
+# then applies the date filters.
+def prepare_transactions(transactions, product_ids, start_date=None, end_date=None, quarantine=None):
+    raw_dates = transactions['transaction_date']
+    transactions = standardize_date_columns(transactions, ['transaction_date'])
+    transactions = validation.apply(transactions, 'transactions', {validation.PRODUCT_IDS: product_ids}, quarantine,
+                                    raw={'transaction_date': raw_dates})
+    return filter_date_range(transactions, 'transaction_date', start_date, end_date)
 
-    #Standardising dates - getting rid of separator irregularities
+def clean_customers(customers, start_date=None, end_date=None, quarantine=None):
+    #Standardising dates - getting rid of separator irregularities and converting to datetime for filtering
+    raw_dates = customers['signup_date']
     customers = standardize_date_columns(customers, ['signup_date'])
-    transactions = standardize_date_columns(transactions, ['transaction_date'])
+    customers = validation.apply(customers, 'customers', quarantine=quarantine, raw={'signup_date': raw_dates})
+    customers = filter_date_range(customers, 'signup_date', start_date, end_date)
 
-    # Converting to datetime for filtering
-    customers['signup_date'] = pd.to_datetime(customers['signup_date'], errors='coerce')
-    transactions['transaction_date'] = pd.to_datetime(transactions['transaction_date'], errors='coerce')
+    #Standardizing the country column in the customers dataframe - spelling variants mapped by normalization.json
+    customers['country'] = normalization.normalize(customers['country'], 'customers.country')
 
-    # Apply date filters
-    if start_date:
-        customers = customers[customers['signup_date'] >= start_date]
-        transactions = transactions[transactions['transaction_date'] >= start_date]
+    # Imputating missing values for 'Email' column found in customers dataframe.
+    customers['email_missing'] = customers['email'].isna()
+    customers['email'] = customers['email'].fillna('unknown')
 
-    if end_date:
-        customers = customers[customers['signup_date'] <= end_date]
-        transactions = transactions[transactions['transaction_date'] <= end_date]
-
-    #Standardizing the country column in the customers dataframe
-    customers['country_clean'] = (customers['country'].str.lower().str.strip().str.replace('.', '', regex=False))
-
-    country_mapping = {
-        # United States
-        'us': 'United States',
-        'usa': 'United States',
-        'united states': 'United States',
-        # United Kingdom
-        'uk': 'United Kingdom',
-        'united kingdom': 'United Kingdom',
-        'great britain': 'United Kingdom',
-        # Canada
-        'ca': 'Canada',
-        'canada': 'Canada',
-        # Germany
-        'de': 'Germany',
-        'germany': 'Germany',
-        # Australia
-        'au': 'Australia',
-        'australia': 'Australia'
-    }
-
-    customers['country_standardized'] = (customers['country_clean'].map(country_mapping).fillna(customers['country']))
-    customers['country'] = customers['country_standardized']
-    customers = customers.drop(columns=['country_clean', 'country_standardized'])
+    return customers
+
+def clean_products(products, quarantine=None):
+    products = validation.apply(products, 'products', quarantine=quarantine)
+    products['category'] = normalization.normalize(products['category'], 'products.category')
+
+    # Handling Duplicates in the Products dataframe.
+    return products.drop_duplicates(subset=['product_id', 'product_name', 'category', 'cost_price'], keep='first')
+
+# Cleans a transactions frame. price_by_product is computed from the frame itself unless
+# it is passed in (chunked mode computes it up front over the whole file).
+# product_ids is the reference set of the product_id validation rule (see valid_product_ids).
+def clean_transactions(transactions, product_ids, start_date=None, end_date=None, price_by_product=None, quarantine=None):
+    transactions = prepare_transactions(transactions, product_ids, start_date, end_date, quarantine)
 
     # Imputating missing values for 'Price' column found in transactions dataframe. 
     # Price of the product greatly varies with the time. So, took median rather than mean.
-    price_by_product = (transactions.groupby('product_id')['price'].median())
+    if price_by_product is None:
+        price_by_product = (transactions.groupby('product_id')['price'].median())
+    transactions = impute_prices(transactions, price_by_product)
+
+    return impute_status(transactions)
+
+def impute_prices(transactions, price_by_product):
     transactions['price'] = transactions['price'].fillna(transactions['product_id'].map(price_by_product))
+    return transactions
 
-    # Imputating missing values for 'Status' column found in transactions dataframe.
-    transactions.loc[transactions['status'].isna()]
+# Standardizing spelling variants of 'Status' and imputating its missing values in transactions dataframe.
+def impute_status(transactions):
+    transactions['status'] = normalization.normalize(transactions['status'], 'transactions.status')
     transactions['status_missing'] = transactions['status'].isna()
-    transactions['status'] = transactions['status'].fillna('Unknown')
+    transactions['status'] = schema.fill_missing(transactions['status'], 'Unknown')
+    return transactions
 
-    # Imputating missing values for 'Email' column found in customers dataframe.
-    customers['email_missing'] = customers['email'].isna()
-    customers['email'] = customers['email'].fillna('unknown')
+# Exact per-product median from a (product_id, price) -> count frequency table.
+# The table is mergeable across chunks and only grows with distinct prices, not rows.
+def median_price_from_counts(price_counts):
+    if price_counts is None or price_counts.empty:
+        return pd.Series(dtype=float)
 
-    # Handling Duplicates in the Products dataframe.
-    products.drop_duplicates(subset=['product_id', 'product_name', 'category', 'cost_price'],keep='first',inplace=True)
+    counts = price_counts.sort_index().rename('n').reset_index()
+    total = counts.groupby('product_id')['n'].transform('sum')
+    running = counts.groupby('product_id')['n'].cumsum()
+
+    # Lower and upper middle elements; they coincide when the product has an odd number of prices
+    lower = counts[running >= (total + 1) // 2].groupby('product_id')['price'].first()
+    upper = counts[running >= total // 2 + 1].groupby('product_id')['price'].first()
+    return (lower + upper) / 2
+
+# Bounded-memory cleaning of transactions.csv.
+# Pass 1 builds the per-product price frequency table for the median over the rows that pass validation,
+# pass 2 cleans each chunk, appends it to writer and its rejected rows to quarantine.
+def clean_transactions_chunked(raw_path, writer, chunksize, product_ids, start_date=None, end_date=None, quarantine=None):
+    price_counts = None
+    with instrumentation.stage('price_medians', hot=True) as stage:
+        stage.add_read(raw_path)
+        columns = validation.rule_columns('transactions')
+        for chunk in pd.read_csv(raw_path, usecols=columns, converters=schema.read_converters('transactions', columns), chunksize=chunksize):
+            chunk = schema.optimize_dtypes(chunk, 'transactions', compact_money=False)
+            stage.rows_in = (stage.rows_in or 0) + len(chunk)
+            chunk = prepare_transactions(chunk, product_ids, start_date, end_date)
+            chunk_counts = chunk.groupby(['product_id', 'price']).size()
+            price_counts = chunk_counts if price_counts is None else price_counts.add(chunk_counts, fill_value=0)
+
+        price_by_product = median_price_from_counts(price_counts)
+        stage.rows_out = len(price_by_product)
+
+    raw_profile = None
+    with instrumentation.stage('stream', hot=True) as stage:
+        stage.add_read(raw_path)
+        for chunk in pd.read_csv(raw_path, dtype=schema.read_dtypes('transactions'), converters=schema.read_converters('transactions'), chunksize=chunksize):
+            chunk = schema.optimize_dtypes(chunk, 'transactions', compact_money=False)
+            stage.rows_in = (stage.rows_in or 0) + len(chunk)
+            # Profile the raw chunk before cleaning modifies it, merging into the running profile
+            chunk_profile = FrameProfile.from_frame(schema.missing_dates_as_na(chunk, 'transactions'), unique_mode='auto')
+            raw_profile = chunk_profile if raw_profile is None else raw_profile.merge(chunk_profile)
+
+            chunk = clean_transactions(chunk, product_ids, start_date, end_date, price_by_product, quarantine)
+            writer.write(chunk)
+        stage.rows_out = writer.rows_written
+
+    if raw_profile is not None:
+        print_profile('transactions', raw_profile)
+    print(f"Streamed {writer.rows_written:,} clean transactions in chunks of {chunksize:,} rows")
+
+# Reads, profiles and cleans the tables in this process (all three unless tables lists a subset; the others
+# are returned as None). In chunked mode transactions are streamed to clean_dir and returned as None.
+def clean_in_process(raw_dir, clean_dir, start_date=None, end_date=None, chunksize=None, fmt="csv", partitioned=False, tables=None,
+                     quarantine=None):
+    tables = tables or CLEAN_TABLES
+    transactions = None
+
+    #Loading Data with the shared dtype plan (categoricals, downcast integers)
+    dimensions = [name for name in ['customers', 'products'] if name in tables]
+    with instrumentation.stage('read_dimensions') as stage:
+        frames = {}
+        for name in dimensions:
+            frames[name] = schema.read_csv(f"{raw_dir}/{name}.csv", name, compact_money=False)
+            stage.add_read(f"{raw_dir}/{name}.csv")
+        stage.rows_out = sum(len(df) for df in frames.values())
+    for name, df in frames.items():
+        schema.memory_report(name, df)
+    customers, products = frames.get('customers'), frames.get('products')
+    if 'transactions' in tables:
+        product_ids = valid_product_ids(raw_dir, products)
+
+    if 'transactions' in tables and chunksize:
+        # Streaming mode: transactions never fully loaded, only the dimension tables are
+        with instrumentation.stage('profile', hot=True):
+            profiles = profile_dataframes(frames)
+        with instrumentation.stage('transactions_chunked') as stage:
+            with storage.open_table_writer(clean_dir, 'transactions', fmt, partitioned=partitioned) as writer:
+                clean_transactions_chunked(f"{raw_dir}/transactions.csv", writer, chunksize, product_ids, start_date, end_date, quarantine)
+            stage.rows_out = writer.rows_written
+            for path in storage.table_files(clean_dir, 'transactions', fmt):
+                stage.add_written(path)
+    elif 'transactions' in tables:
+        with instrumentation.stage('read_transactions') as stage:
+            transactions = schema.read_csv(f"{raw_dir}/transactions.csv", 'transactions', compact_money=False)
+            stage.add_read(f"{raw_dir}/transactions.csv")
+            stage.rows_out = len(transactions)
+        schema.memory_report('transactions', transactions)
+
+        with instrumentation.stage('profile', hot=True):
+            profiles = profile_dataframes({**frames, 'transactions': transactions})
+
+        with instrumentation.stage('transactions', rows_in=len(transactions), hot=True) as stage:
+            transactions = clean_transactions(transactions, product_ids, start_date, end_date, quarantine=quarantine)
+            stage.rows_out = len(transactions)
+    else:
+        with instrumentation.stage('profile', hot=True):
+            profiles = profile_dataframes(frames)
+
+    if customers is not None:
+        with instrumentation.stage('customers', rows_in=len(customers)) as stage:
+            customers = clean_customers(customers, start_date, end_date, quarantine)
+            stage.rows_out = len(customers)
+    if products is not None:
+        with instrumentation.stage('products', rows_in=len(products)) as stage:
+            products = clean_products(products, quarantine)
+            stage.rows_out = len(products)
+
+    return customers, products, transactions
+
+# Reads, profiles and cleans the rows in bytes [start, end) of a raw customers or transactions file.
+# Runs in a worker process, so only row-local steps happen here; transaction prices are imputed
+# once all partitions are back, since the medians need every row of a product. Rejected rows
+# come back in an in-memory quarantine.
+def _clean_partition(table, raw_path, start, end, header, start_date=None, end_date=None, product_ids=None):
+    df = partitioning.read_csv_range(raw_path, start, end, header, dtype=schema.read_dtypes(table), converters=schema.read_converters(table))
+    df = schema.optimize_dtypes(df, table, compact_money=False)
+    part = {'rows': len(df), 'memory': schema.memory_usage(df), 'profile': FrameProfile.from_frame(schema.missing_dates_as_na(df, table)),
+            'quarantine': validation.Quarantine()}
+
+    if table == 'customers':
+        df = clean_customers(df, start_date, end_date, part['quarantine'])
+    else:
+        df = impute_status(prepare_transactions(df, product_ids, start_date, end_date, part['quarantine']))
+    part['frame'] = df
+    return part
+
+def _submit_partitions(pool, table, raw_path, workers, start_date, end_date, product_ids=None):
+    header = partitioning.read_header(raw_path)
+    return [pool.submit(_clean_partition, table, raw_path, start, end, header, start_date, end_date, product_ids)
+            for start, end in partitioning.line_ranges(raw_path, workers)]
+
+# Combines cleaned partitions in file order. Row labels continue across partitions, as when the file is read whole.
+def _collect_partitions(futures):
+    parts = [future.result() for future in futures]
+    offset = 0
+    for part in parts:
+        part['frame'].index = part['frame'].index + offset
+        offset += part['rows']
+    frame = schema.concat_frames(part['frame'] for part in parts)
+    memory = tuple(sum(sizes) for sizes in zip(*(part['memory'] for part in parts)))
+    return frame, merge_profiles(part['profile'] for part in parts), memory, parts
+
+# Parallel cleaning: customers.csv and transactions.csv are split into line-aligned byte ranges, one per worker,
+# and each range is read, profiled and cleaned in a process pool. The global steps run here once the partitions
+# are back: per-product price medians over the combined transactions, and product de-duplication.
+# The result is the same as clean_in_process, down to row labels and categories.
+def clean_partitioned(raw_dir, workers, start_date=None, end_date=None, tables=None, quarantine=None):
+    tables = tables or CLEAN_TABLES
+    customers = products = transactions = None
+
+    if 'products' in tables:
+        with instrumentation.stage('read_dimensions') as stage:
+            products = schema.read_csv(f"{raw_dir}/products.csv", 'products', compact_money=False)
+            stage.add_read(f"{raw_dir}/products.csv")
+            stage.rows_out = len(products)
+
+    partitioned = [name for name in ['customers', 'transactions'] if name in tables]
+    product_ids = valid_product_ids(raw_dir, products) if 'transactions' in tables else None
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        # Both tables are queued up front so no worker idles between them
+        jobs = {name: _submit_partitions(pool, name, f"{raw_dir}/{name}.csv", workers, start_date, end_date, product_ids)
+                for name in partitioned}
+
+        results = {}
+        for name in partitioned:
+            with instrumentation.stage(f"{name}_partitioned") as stage:
+                results[name] = _collect_partitions(jobs[name])
+                stage.add_read(f"{raw_dir}/{name}.csv")
+                stage.rows_in, stage.rows_out = results[name][1].rows, len(results[name][0])
+            if quarantine is not None:
+                for part in results[name][3]:
+                    quarantine.merge(part['quarantine'])
+
+    if 'customers' in results:
+        schema.memory_report('customers', usage=results['customers'][2])
+    if products is not None:
+        schema.memory_report('products', products)
+    if 'transactions' in results:
+        schema.memory_report('transactions', usage=results['transactions'][2])
+    if 'customers' in results:
+        customers = results['customers'][0]
+        print_profile('customers', results['customers'][1])
+    if products is not None:
+        print_profile('products', FrameProfile.from_frame(products))
+
+    if 'transactions' in results:
+        transactions, transaction_profile, _, _ = results['transactions']
+        print_profile('transactions', transaction_profile)
+        with instrumentation.stage('prices', rows_in=len(transactions)) as stage:
+            transactions = impute_prices(transactions, transactions.groupby('product_id')['price'].median())
+            stage.rows_out = len(transactions)
+
+    if products is not None:
+        with instrumentation.stage('products', rows_in=len(products)) as stage:
+            products = clean_products(products, quarantine)
+            stage.rows_out = len(products)
+
+    if results:
+        parts = results[partitioned[-1]][3]
+        print(f"Cleaned {' and '.join(partitioned)} in {len(parts)} partitions with {workers} workers")
+    return customers, products, transactions
+
+#All execution under the if-main block for reusability in other scripts
+# Returns the clean (customers, products, transactions) frames so they can be handed to data_analysis in-process.
+# write controls the clean-data files: 'sync' writes before returning, 'async' writes on a background thread
+# (see storage.wait_for_background_writes), 'none' skips them. In chunked mode transactions are always streamed
+# to disk and returned as None. workers > 1 cleans customers and transactions in partitions across a process pool.
+# partitioned=True writes transactions in the month-partitioned layout (see storage.py).
+# Rows failing validation are written to <clean_dir>/quarantine (see validation.py).
+# tables limits cleaning to a subset of CLEAN_TABLES (e.g. the ones missing from the result cache); the others are returned as None.
+# cleaned maps table names to clean frames that are already at hand (e.g. dimension tables kept warm by the resident worker,
+# see daemon.py); those are written and returned as they are instead of being read and cleaned again.
+def main(raw_dir="data_raw", clean_dir="data_clean", start_date=None, end_date=None, chunksize=None, fmt="csv", write="sync", workers=1,
+         partitioned=False, tables=None, cleaned=None):
+
+     # Parse date filters safely
+    if start_date:
+        start_date = pd.to_datetime(start_date)
+    if end_date:
+        end_date = pd.to_datetime(end_date)
 
     # Creating output folder to save clean data
     os.makedirs(clean_dir, exist_ok=True)
 
-    # Saving the clean datasets to clean_dir folder
-    customers.to_csv(f"{clean_dir}/customers.csv", index=False)
-    products.to_csv(f"{clean_dir}/products.csv", index=False)
-    transactions.to_csv(f"{clean_dir}/transactions.csv", index=False)
+    cleaned = cleaned or {}
+    tables = [name for name in (tables or CLEAN_TABLES) if name not in cleaned]
+    customers = products = transactions = None
+
+    if workers > 1 and chunksize:
+        raise ValueError("--workers and --chunksize cannot be combined: parallel cleaning keeps the clean transactions in memory")
+    quarantine = validation.Quarantine(os.path.join(clean_dir, validation.QUARANTINE_DIR), tables)
+    if tables and workers > 1:
+        customers, products, transactions = clean_partitioned(raw_dir, workers, start_date, end_date, tables, quarantine)
+    elif tables:
+        customers, products, transactions = clean_in_process(raw_dir, clean_dir, start_date, end_date, chunksize, fmt, partitioned, tables,
+                                                             quarantine)
+    quarantine.close()
+
+    frames = {**dict(zip(CLEAN_TABLES, [customers, products, transactions])), **cleaned}
+    if cleaned:
+        print(f"Reused clean {' and '.join(cleaned)} from memory")
+
+    # Saving the clean datasets to clean_dir folder in the chosen storage format
+    clean_tables = {name: frames[name] for name in CLEAN_TABLES if frames[name] is not None}
+
+    if write == "sync":
+        for name, df in clean_tables.items():
+            storage.write_table(df, clean_dir, name, fmt, partitioned)
+        print("Clean data moved to folder for analysis")
+    elif write == "async":
+        storage.write_tables_in_background(clean_tables, clean_dir, fmt, partitioned)
+        print("Clean data is being written to folder in the background")
 
-    print("Clean data moved to folder for analysis")
+    return frames['customers'], frames['products'], frames['transactions']
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
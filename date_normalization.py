@@ -0,0 +1,111 @@
+import numpy as np
+import pandas as pd
+
+# Vectorised date normalisation.
+# Raw date columns have far fewer distinct strings than rows, so all string work happens on the
+# distinct values only: the column is factorised, each unique raw string is cleaned (whitespace
+# removed, '/' -> '-') and parsed with an explicit format, and the parsed values are broadcast
+# back through the factor codes. Parsed values are cached across calls, so repeated chunks of the
+# same file only parse strings they have not seen before.
+#
+# Strings of the same shape (e.g. nn-nn-yyyy) are parsed with one format, the first that fits all of
+# them (ignoring strings no format parses), so a column is never read with both day orders:
+# 25-03-2024 makes 05-03-2024 day-first too. Only a shape no single format fits is parsed string by string.
+
+# Candidate formats for cleaned date strings, tried in order. Month-first is preferred over
+# day-first, as in pandas' default parsing; whitespace has already been removed.
+DATE_FORMATS = [
+    '%Y-%m-%d',
+    '%m-%d-%Y',
+    '%d-%m-%Y',
+    '%Y%m%d',
+    '%Y-%m-%d%H:%M:%S',
+    '%d-%b-%Y',
+]
+
+# Cache entries kept before the cache is reset.
+MAX_CACHE_SIZE = 1_000_000
+
+
+def clean_date_strings(values):
+    return (pd.Series(values, dtype=object).astype(str).str.strip()
+            .str.replace(r'\s+', '', regex=True).str.replace('/', '-', regex=False))
+
+
+# Shapes of cleaned date strings: runs of letters -> a, of 3+ digits -> Y, of 1-2 digits -> n
+def date_shapes(cleaned):
+    return (cleaned.str.replace(r'[A-Za-z]+', 'a', regex=True).str.replace(r'\d{3,}', 'Y', regex=True)
+            .str.replace(r'\d{1,2}', 'n', regex=True))
+
+
+class DateNormalizer:
+    def __init__(self, formats=None, max_cache_size=MAX_CACHE_SIZE):
+        self.formats = list(formats or DATE_FORMATS)
+        self.max_cache_size = max_cache_size
+        self.format_counts = {}
+        self._cache_keys = pd.Index([], dtype=object)
+        self._cache_values = np.array([], dtype='datetime64[ns]')
+
+    # Parses unique raw strings shape group by shape group. Strings matching no format become NaT.
+    def _parse_uniques(self, raw_uniques):
+        cleaned = clean_date_strings(raw_uniques)
+        parsed = np.full(len(cleaned), np.datetime64('NaT'), dtype='datetime64[ns]')
+        for positions in pd.Series(np.arange(len(cleaned))).groupby(date_shapes(cleaned).to_numpy()).groups.values():
+            self._parse_group(cleaned, np.asarray(positions), parsed)
+        return parsed
+
+    # Parses the strings at positions with the first format that fits every one of them some format
+    # can parse. If no format does, each string gets the first format it matches.
+    def _parse_group(self, cleaned, positions, parsed):
+        attempts = {fmt: pd.to_datetime(cleaned.iloc[positions], format=fmt, errors='coerce') for fmt in self.formats}
+        parseable = np.logical_or.reduce([attempt.notna().to_numpy() for attempt in attempts.values()])
+        for fmt, attempt in attempts.items():
+            if attempt.notna().to_numpy()[parseable].all():
+                attempts = {fmt: attempt}
+                break
+
+        remaining = np.ones(len(positions), dtype=bool)
+        for fmt, attempt in attempts.items():
+            matched = remaining & attempt.notna().to_numpy()
+            if matched.any():
+                # Dates only: any time component is dropped, as the clean tables store days
+                parsed[positions[matched]] = attempt[matched].dt.normalize().to_numpy(dtype='datetime64[ns]')
+                self.format_counts[fmt] = self.format_counts.get(fmt, 0) + int(matched.sum())
+                remaining &= ~matched
+
+    # Returns the datetime64 value for every unique raw string, using and filling the cache.
+    def _lookup(self, raw_uniques):
+        positions = self._cache_keys.get_indexer(raw_uniques)
+        values = np.empty(len(raw_uniques), dtype='datetime64[ns]')
+        hit = positions >= 0
+        values[hit] = self._cache_values[positions[hit]]
+
+        if not hit.all():
+            misses = raw_uniques[~hit]
+            values[~hit] = self._parse_uniques(misses)
+            if len(self._cache_keys) + len(misses) > self.max_cache_size:
+                self.clear_cache()
+            self._cache_keys = self._cache_keys.append(misses)
+            self._cache_values = np.concatenate([self._cache_values, values[~hit]])
+
+        return values
+
+    def normalize(self, series):
+        codes, uniques = pd.factorize(series)
+        raw_uniques = pd.Index(uniques.astype(str), dtype=object)
+
+        # One trailing NaT slot so missing values (code -1) broadcast to NaT
+        values = np.append(self._lookup(raw_uniques), np.datetime64('NaT'))
+        return pd.Series(values[codes], index=series.index, name=series.name)
+
+    def clear_cache(self):
+        self._cache_keys = pd.Index([], dtype=object)
+        self._cache_values = np.array([], dtype='datetime64[ns]')
+
+
+# Shared normaliser so the cache carries over between chunks and tables.
+default_normalizer = DateNormalizer()
+
+
+def normalize_dates(series, normalizer=None):
+    return (normalizer or default_normalizer).normalize(series)
@@ -0,0 +1,370 @@
+import hashlib
+import json
+import os
+import shutil
+
+import pandas as pd
+
+import data_analysis
+import data_cleaning
+import instrumentation
+import partitioning
+import retention
+import schema
+import storage
+import validation
+from profiling import FrameProfile
+
+# Incremental pipeline runs.
+#
+# raw transactions.csv is treated as an append-only log. A watermark (byte offset, size, mtime and a
+# hash of the file head) records how much of it has been processed, so each run only cleans the
+# rows appended since. The report tables are rebuilt from small partial aggregates kept in state_dir
+# rather than from the full fact table:
+#
+#   price_counts      (product_id, price) -> row count, for the per-product price medians
+#   month_product     sums per (month, product_id)
+#   customer_product  sums per (customer_id, product_id)
+#   customer_day      distinct transactions per (customer_id, transaction_date)
+#
+# Staying correct under increments:
+#   * Price medians: the price frequency table is merged on every run and the exact medians are
+#     recomputed from it. Rows with a missing price are not stored with the median of the day;
+#     their quantity is kept separately (imputed_quantity), and revenue is priced with the
+#     *current* medians when reports are built. Reports therefore match a full recompute even when
+#     later rows move a product's median. Rows already appended to the clean transactions file keep
+#     the median that was current when they were cleaned.
+#   * Value segments: pd.qcut needs the global revenue distribution, so it is not maintained
+#     incrementally. It is recomputed on every run from customer-level totals, which costs one pass
+#     over customers rather than over transactions.
+#   * Transaction counts are summed across runs, which assumes a transaction_id belongs to one
+#     customer and date and that its lines arrive in the same run.
+#   * products.csv and customers.csv are small dimension tables and are recleaned on every run, so
+#     cost prices, categories and countries always reflect the latest files. New transaction rows are
+#     validated against the product ids of the current products.csv; rows quarantined by earlier runs
+#     stay quarantined. The transactions' validation counts are carried in the watermark and summed across runs.
+#
+# The state is rebuilt from scratch when the raw file shrinks, its head or header changes, or the
+# --start_date/--end_date arguments differ from the ones the state was built with.
+
+STATE_VERSION = 2
+WATERMARK_FILE = 'watermark.json'
+HEAD_HASH_BYTES = 65536
+DEFAULT_CHUNKSIZE = 1_000_000
+
+VALUE_COLUMNS = ['quantity', 'priced_quantity', 'priced_revenue', 'priced_rows', 'imputed_quantity', 'imputed_rows']
+STATE_KEYS = {
+    'month_product': ['month', 'product_id'],
+    'customer_product': ['customer_id', 'product_id'],
+    'customer_day': ['customer_id', 'transaction_date'],
+}
+
+
+def _head_hash(path, length):
+    with open(path, 'rb') as fh:
+        return hashlib.sha256(fh.read(min(length, HEAD_HASH_BYTES))).hexdigest()
+
+
+def file_fingerprint(path):
+    stat = os.stat(path)
+    return {'size': stat.st_size, 'mtime': stat.st_mtime, 'header': partitioning.read_header(path)}
+
+
+def load_watermark(state_dir):
+    path = os.path.join(state_dir, WATERMARK_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path) as fh:
+        return json.load(fh)
+
+
+# Returns why the stored state cannot be extended, or None if it can.
+def rebuild_reason(watermark, raw_path, start_date, end_date):
+    if watermark is None:
+        return "no previous state"
+    if watermark.get('version') != STATE_VERSION:
+        return "state version changed"
+    if (watermark['start_date'], watermark['end_date']) != (start_date, end_date):
+        return "date filter changed"
+    fingerprint = file_fingerprint(raw_path)
+    if fingerprint['header'] != watermark['header']:
+        return "transactions header changed"
+    if fingerprint['size'] < watermark['offset']:
+        return "transactions file shrank"
+    if _head_hash(raw_path, watermark['offset']) != watermark['head_hash']:
+        return "transactions file was rewritten"
+    return None
+
+
+# End of the last complete line at or before the current file size.
+def _complete_size(path, offset):
+    size = os.path.getsize(path)
+    with open(path, 'rb') as fh:
+        end = size
+        while end > offset:
+            start = max(offset, end - HEAD_HASH_BYTES)
+            fh.seek(start)
+            block = fh.read(end - start)
+            newline = block.rfind(b'\n')
+            if newline >= 0:
+                return start + newline + 1
+            end = start
+    return offset
+
+
+# Yields chunks of the rows between byte offsets [offset, end).
+def read_new_rows(path, offset, end, header, chunksize):
+    if end <= offset:
+        return iter(())
+    return partitioning.iter_csv_range(path, offset, end, header, chunksize, converters=schema.read_converters('transactions'))
+
+
+# Partial aggregates of one chunk of date-filtered, not yet imputed transactions.
+def chunk_partials(chunk):
+    quantity = chunk['quantity']
+    selling_amount = chunk['price'] * quantity
+    priced = selling_amount.notna()
+    imputed = chunk['price'].isna() & quantity.notna()
+
+    rows = pd.DataFrame({
+        'month': chunk['transaction_date'].dt.to_period('M'),
+        'customer_id': chunk['customer_id'],
+        'product_id': chunk['product_id'],
+        'quantity': quantity,
+        'priced_quantity': quantity.where(priced, 0),
+        'priced_revenue': selling_amount.where(priced, 0),
+        'priced_rows': priced.astype(int),
+        'imputed_quantity': quantity.where(imputed, 0),
+        'imputed_rows': imputed.astype(int),
+    })
+
+    return {
+        'price_counts': chunk.groupby(['product_id', 'price']).size(),
+        'month_product': rows.groupby(STATE_KEYS['month_product'], dropna=False)[VALUE_COLUMNS].sum().reset_index(),
+        'customer_product': rows.groupby(STATE_KEYS['customer_product'], dropna=False)[VALUE_COLUMNS].sum().reset_index(),
+        'customer_day': (chunk.groupby(STATE_KEYS['customer_day'], dropna=False)['transaction_id'].nunique()
+                         .rename('transactions').reset_index()),
+    }
+
+
+# Partials of a batch without rows, such as a first run on a header-only transactions.csv
+def empty_partials(header, product_ids, start_date=None, end_date=None):
+    return chunk_partials(data_cleaning.prepare_transactions(pd.DataFrame(columns=header), product_ids, start_date, end_date))
+
+
+def _has_rows(partials):
+    return any(len(table) for table in partials.values())
+
+
+# Partials without rows are skipped, so their untyped empty columns never widen the dtypes of the other side
+def merge_partials(left, right):
+    if left is None or not _has_rows(left):
+        return right
+    if not _has_rows(right):
+        return left
+    merged = {'price_counts': left['price_counts'].add(right['price_counts'], fill_value=0)}
+    for name, keys in STATE_KEYS.items():
+        merged[name] = (pd.concat([left[name], right[name]], ignore_index=True)
+                        .groupby(keys, dropna=False, sort=False).sum().reset_index())
+    return merged
+
+
+def load_state(state_dir, watermark):
+    run_dir = os.path.join(state_dir, watermark['state_path'])
+    return {name: pd.read_pickle(os.path.join(run_dir, f"{name}.pkl")) for name in ['price_counts', *STATE_KEYS]}
+
+
+# Writes the new state into a fresh directory and then swaps the watermark to point at it,
+# so an interrupted run leaves the previous state intact.
+def save_state(state_dir, state, watermark):
+    run = watermark['runs']
+    state_path = f"run-{run:06d}"
+    run_dir = os.path.join(state_dir, state_path)
+    os.makedirs(run_dir, exist_ok=True)
+    for name, table in state.items():
+        table.to_pickle(os.path.join(run_dir, f"{name}.pkl"))
+
+    previous = watermark.get('state_path')
+    watermark['state_path'] = state_path
+    tmp_path = os.path.join(state_dir, WATERMARK_FILE + '.tmp')
+    with open(tmp_path, 'w') as fh:
+        json.dump(watermark, fh, indent=2)
+    os.replace(tmp_path, os.path.join(state_dir, WATERMARK_FILE))
+
+    if previous and previous != state_path:
+        shutil.rmtree(os.path.join(state_dir, previous), ignore_errors=True)
+
+
+# Joins a state grain with products and prices imputed quantities with the current medians.
+# Produces the same per-row measures data_analysis derives on txn_prod, summed per grain.
+def _price_grain(grain, products, price_by_product):
+    grain = grain.merge(products, on='product_id', how='left')
+    median = grain['product_id'].map(price_by_product)
+    has_median = median.notna()
+
+    selling_quantity = grain['priced_quantity'] + grain['imputed_quantity'].where(has_median, 0)
+    grain['selling_amount'] = grain['priced_revenue'] + (grain['imputed_quantity'] * median).where(has_median, 0)
+    grain['selling_rows'] = grain['priced_rows'] + grain['imputed_rows'].where(has_median, 0)
+    grain['cost_amount'] = grain['quantity'] * grain['cost_price']
+    # Row-level profit is NaN (and skipped by the sums) when either amount is missing
+    grain['profit'] = (grain['selling_amount'] - selling_quantity * grain['cost_price']).where(grain['cost_price'].notna(), 0)
+    return grain
+
+
+def reports_from_state(state, customers, products, period_months=None):
+    period_months = period_months or data_analysis.PERIOD_MONTHS
+    price_by_product = data_cleaning.median_price_from_counts(state['price_counts'])
+    products = products[data_analysis.PRODUCT_COLUMNS]
+    month_product = _price_grain(state['month_product'], products, price_by_product)
+    customer_product = _price_grain(state['customer_product'], products, price_by_product)
+    customer_day = state['customer_day']
+
+    financials = dict(total_cost=('cost_amount', 'sum'), total_revenue=('selling_amount', 'sum'), total_profit=('profit', 'sum'))
+    report_tables = {}
+
+    monthly_trends = month_product.groupby('month').agg(**financials).reset_index()
+    report_tables['monthly_trends'] = data_analysis.finish_monthly_trends(monthly_trends)
+
+    product_metrics = month_product.groupby('product_id').agg(**financials).reset_index()
+    report_tables['product_metrics'] = data_analysis.add_profit_pct(product_metrics)
+
+    category_metrics = month_product.groupby('category').agg(**financials).reset_index()
+    report_tables['category_metrics'] = data_analysis.add_profit_pct(category_metrics)
+
+    monthly_transactions = (customer_day.groupby(customer_day['transaction_date'].dt.to_period('M').rename('month'))
+                            ['transactions'].sum().rename('total_transactions'))
+    monthly_aov = (month_product.groupby('month').agg(total_revenue=('selling_amount', 'sum'))
+                   .join(monthly_transactions).reset_index())
+    report_tables['monthly_aov'] = data_analysis.finish_monthly_aov(monthly_aov)
+
+    customer_totals = customer_product.groupby('customer_id').agg(
+        total_quantity=('quantity', 'sum'),
+        total_revenue=('selling_amount', 'sum'),
+        selling_rows=('selling_rows', 'sum'))
+    customer_dates = customer_day.groupby('customer_id').agg(
+        total_transactions=('transactions', 'sum'),
+        first_purchase=('transaction_date', 'min'),
+        last_purchase=('transaction_date', 'max'))
+    customer_behavior = customer_dates[['total_transactions']].join(customer_totals)
+    customer_behavior['avg_order_value'] = customer_behavior['total_revenue'] / customer_behavior['selling_rows']
+    customer_behavior = (customer_behavior.drop(columns='selling_rows')
+                         .join(customer_dates[['first_purchase', 'last_purchase']]).reset_index())
+
+    customer_behavior, segment_summary = data_analysis.segment_customers(customer_behavior)
+    report_tables['customer_behavior'] = customer_behavior
+    report_tables['top_10_customers'] = customer_behavior.head(10)
+    report_tables['segment_summary'] = segment_summary
+
+    events = customer_day.rename(columns={'transaction_date': 'date'})
+    windows = retention.window_summary(retention.customer_sweep(events), period_months, customer_day['transaction_date'].max())
+    report_tables['active_customers_summary'] = windows[['period_months', 'active_customers']]
+    report_tables['repeat_customer_summary'] = windows[['period_months', 'repeat_customer_rate_pct']]
+    report_tables['cohort_retention'] = retention.cohort_retention(events)
+    report_tables['customer_country_summary'] = data_analysis.customer_country_summary_table(customers)
+
+    return report_tables
+
+
+def main(raw_dir="data_raw", clean_dir="data_clean", reports_dir="reports", plots_dir="plots", state_dir="state",
+         start_date=None, end_date=None, chunksize=None, fmt="csv", period_months=None, plots=True, plot_workers=1):
+    if fmt != 'csv':
+        raise ValueError("Incremental runs append to the clean transactions file and need --format csv")
+
+    chunksize = chunksize or DEFAULT_CHUNKSIZE
+    raw_path = f"{raw_dir}/transactions.csv"
+    clean_path = storage.table_path(clean_dir, 'transactions', fmt)
+    quarantine_dir = os.path.join(clean_dir, validation.QUARANTINE_DIR)
+    quarantine_path = os.path.join(quarantine_dir, 'transactions.csv')
+    os.makedirs(state_dir, exist_ok=True)
+    os.makedirs(clean_dir, exist_ok=True)
+
+    watermark = load_watermark(state_dir)
+    reason = rebuild_reason(watermark, raw_path, start_date, end_date)
+    if reason:
+        print(f"Incremental state rebuilt from scratch: {reason}")
+        state, offset = None, 0
+        previous = watermark or {}
+        watermark = {'version': STATE_VERSION, 'start_date': start_date, 'end_date': end_date,
+                     'runs': previous.get('runs', 0), 'state_path': previous.get('state_path')}
+    else:
+        state, offset = load_state(state_dir, watermark), watermark['offset']
+        # Drop clean and quarantined rows appended by a run that did not reach its commit
+        for path, size in [(clean_path, watermark['clean_size']), (quarantine_path, watermark['quarantine_size'])]:
+            if os.path.exists(path) and os.path.getsize(path) > size:
+                with open(path, 'r+b') as fh:
+                    fh.truncate(size)
+
+    parsed_start = pd.to_datetime(start_date) if start_date else None
+    parsed_end = pd.to_datetime(end_date) if end_date else None
+    header = file_fingerprint(raw_path)['header']
+    end = _complete_size(raw_path, offset)
+    raw_products = pd.read_csv(f"{raw_dir}/products.csv")
+    product_ids = data_cleaning.valid_product_ids(raw_dir, raw_products)
+    # The transactions quarantine file is appended to after the first run, like the clean file
+    quarantine = validation.Quarantine(quarantine_dir, ['customers', 'products'] + ([] if offset > 0 else ['transactions']))
+    if offset > 0 and watermark.get('validation'):
+        quarantine.add_counts('transactions', watermark['validation'])
+
+    # Pass 1: partial aggregates and price frequencies of the new rows only
+    batch, raw_profile = None, None
+    with instrumentation.stage('partials', hot=True) as stage:
+        stage.bytes_read += end - offset
+        for chunk in read_new_rows(raw_path, offset, end, header, chunksize):
+            stage.rows_in = (stage.rows_in or 0) + len(chunk)
+            chunk_profile = FrameProfile.from_frame(schema.missing_dates_as_na(chunk, 'transactions'), unique_mode='auto')
+            raw_profile = chunk_profile if raw_profile is None else raw_profile.merge(chunk_profile)
+            chunk = data_cleaning.prepare_transactions(chunk, product_ids, parsed_start, parsed_end)
+            batch = merge_partials(batch, chunk_partials(chunk))
+
+    if raw_profile is not None:
+        data_cleaning.print_profile('new transactions', raw_profile)
+    if batch is not None:
+        state = merge_partials(state, batch)
+    if state is None:
+        # A full run on a file without rows gets an empty fact table; start from empty partials the same way
+        state = empty_partials(header, product_ids, parsed_start, parsed_end)
+    price_by_product = data_cleaning.median_price_from_counts(state['price_counts'])
+
+    # Pass 2: clean the new rows with the updated medians and append them to the clean file
+    with instrumentation.stage('append_clean', hot=True) as stage:
+        clean_size = os.path.getsize(clean_path) if offset > 0 and os.path.exists(clean_path) else 0
+        stage.bytes_read += end - offset
+        with storage.open_table_writer(clean_dir, 'transactions', fmt, append=offset > 0) as writer:
+            for chunk in read_new_rows(raw_path, offset, end, header, chunksize):
+                writer.write(data_cleaning.clean_transactions(chunk, product_ids, parsed_start, parsed_end, price_by_product, quarantine))
+            # A file without rows still gets a clean transactions file (and validation counts), as in a full run
+            if not os.path.exists(clean_path):
+                writer.write(data_cleaning.clean_transactions(pd.DataFrame(columns=header), product_ids, parsed_start, parsed_end, price_by_product, quarantine))
+        stage.rows_out = writer.rows_written
+        stage.bytes_written += os.path.getsize(clean_path) - clean_size
+    print(f"Incremental run cleaned {writer.rows_written:,} new transactions")
+
+    # Dimension tables are small and recleaned in full
+    with instrumentation.stage('dimensions') as stage:
+        customers = data_cleaning.clean_customers(pd.read_csv(f"{raw_dir}/customers.csv", converters=schema.read_converters('customers')), parsed_start, parsed_end, quarantine)
+        products = data_cleaning.clean_products(raw_products, quarantine)
+        stage.add_read(f"{raw_dir}/customers.csv")
+        stage.add_read(f"{raw_dir}/products.csv")
+        storage.write_table(customers, clean_dir, 'customers', fmt)
+        storage.write_table(products, clean_dir, 'products', fmt)
+    quarantine.close()
+
+    with instrumentation.stage('reports', hot=True):
+        report_tables = reports_from_state(state, customers, products, period_months)
+    data_analysis.save_outputs(report_tables, reports_dir, plots_dir, plots, plot_workers)
+
+    max_date = state['customer_day']['transaction_date'].max()
+    watermark.update({
+        'offset': end,
+        'head_hash': _head_hash(raw_path, end),
+        'header': header,
+        'mtime': os.stat(raw_path).st_mtime,
+        'clean_size': os.path.getsize(clean_path) if os.path.exists(clean_path) else 0,
+        'quarantine_size': os.path.getsize(quarantine_path) if os.path.exists(quarantine_path) else 0,
+        'validation': quarantine.counts.get('transactions'),
+        'max_transaction_date': None if pd.isna(max_date) else str(max_date.date()),
+        'runs': watermark['runs'] + 1,
+    })
+    save_state(state_dir, state, watermark)
+
+    print(f"Incremental state saved (watermark at byte {end:,}, latest transaction {watermark['max_transaction_date']})")
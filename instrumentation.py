@@ -0,0 +1,236 @@
+import cProfile
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # Windows: peak RSS is reported as null
+    resource = None
+
+# Stage-level instrumentation for pipeline runs.
+#
+# Work is wrapped in named stages, which nest:
+#
+#     with instrumentation.stage('transactions', rows_in=len(df), hot=True) as s:
+#         ...
+#         s.rows_out = len(df)
+#
+# Every stage records wall time, process CPU time (all threads), rows in/out, the peak RSS of the
+# process at the time the stage ended and the bytes of the files it read and wrote (add_read/add_written).
+# A stage is identified by its path ('cleaning/transactions'); repeated calls, e.g. once per chunk,
+# are summed into one record with a call count. Stages opened on other threads (background writes)
+# start a new top-level path.
+#
+# With profiling enabled, stages opened with hot=True also run under cProfile and write_report()
+# dumps their stats to <profile_dir>/<path>.prof. Only one profiler can be active at a time,
+# so a hot stage nested in (or concurrent with) another one is timed but not profiled.
+
+
+# Peak resident set size of the process so far, in MB.
+# On Linux VmHWM is used: unlike ru_maxrss it is not carried over from the parent of a spawned process.
+def peak_rss_mb():
+    try:
+        with open('/proc/self/status') as fh:
+            for line in fh:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 2**10
+    except OSError:
+        pass
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and kilobytes elsewhere
+    return peak / 2**20 if sys.platform == 'darwin' else peak / 2**10
+
+
+def _file_size(path):
+    return os.path.getsize(path) if os.path.isfile(path) else 0
+
+
+# Handle for one call of a stage; the code inside the stage fills in what it knows.
+class Stage:
+    def __init__(self, rows_in=None):
+        self.rows_in = rows_in
+        self.rows_out = None
+        self.bytes_read = 0
+        self.bytes_written = 0
+
+    def add_read(self, path):
+        self.bytes_read += _file_size(path)
+
+    def add_written(self, path):
+        self.bytes_written += _file_size(path)
+
+
+class StageRecord:
+    def __init__(self, path, start_offset):
+        self.path = path
+        self.start_offset = start_offset
+        self.calls = 0
+        self.wall_seconds = 0.0
+        self.cpu_seconds = 0.0
+        self.rows_in = None
+        self.rows_out = None
+        self.peak_rss_mb = None
+        self.bytes_read = 0
+        self.bytes_written = 0
+        self.profiler = None
+
+    def add(self, call, wall_seconds, cpu_seconds, peak_rss):
+        self.calls += 1
+        self.wall_seconds += wall_seconds
+        self.cpu_seconds += cpu_seconds
+        if call.rows_in is not None:
+            self.rows_in = (self.rows_in or 0) + int(call.rows_in)
+        if call.rows_out is not None:
+            self.rows_out = (self.rows_out or 0) + int(call.rows_out)
+        if peak_rss is not None:
+            self.peak_rss_mb = max(self.peak_rss_mb or 0.0, peak_rss)
+        self.bytes_read += call.bytes_read
+        self.bytes_written += call.bytes_written
+
+    def to_dict(self):
+        return {
+            'stage': self.path,
+            'calls': self.calls,
+            'start_offset_seconds': round(self.start_offset, 4),
+            'wall_seconds': round(self.wall_seconds, 4),
+            'cpu_seconds': round(self.cpu_seconds, 4),
+            'rows_in': self.rows_in,
+            'rows_out': self.rows_out,
+            'peak_rss_mb': None if self.peak_rss_mb is None else round(self.peak_rss_mb, 1),
+            'bytes_read': self.bytes_read,
+            'bytes_written': self.bytes_written,
+        }
+
+
+class RunRecorder:
+    def __init__(self, profile_dir=None):
+        self.profile_dir = profile_dir
+        self.started_at = time.time()
+        self.wall_start = time.perf_counter()
+        self.cpu_start = time.process_time()
+        self.records = {}
+        self.profiling = False
+        self.lock = threading.Lock()
+
+    def record(self, path):
+        with self.lock:
+            if path not in self.records:
+                self.records[path] = StageRecord(path, time.perf_counter() - self.wall_start)
+            return self.records[path]
+
+    def start_profiler(self, record):
+        with self.lock:
+            if self.profiling:
+                return None
+            self.profiling = True
+            if record.profiler is None:
+                record.profiler = cProfile.Profile()
+        record.profiler.enable()
+        return record.profiler
+
+    def stop_profiler(self, profiler):
+        profiler.disable()
+        with self.lock:
+            self.profiling = False
+
+
+# Stages are recorded even when no run was started, so the modules can be used on their own.
+_run = RunRecorder()
+_local = threading.local()
+
+
+def start_run(profile_dir=None):
+    global _run
+    _run = RunRecorder(profile_dir)
+    return _run
+
+
+def _stack():
+    if not hasattr(_local, 'stack'):
+        _local.stack = []
+    return _local.stack
+
+
+@contextmanager
+def stage(name, rows_in=None, hot=False):
+    run = _run
+    stack = _stack()
+    path = f"{stack[-1]}/{name}" if stack else name
+    record = run.record(path)
+    call = Stage(rows_in)
+
+    profiler = run.start_profiler(record) if hot and run.profile_dir else None
+    stack.append(path)
+    wall_start, cpu_start = time.perf_counter(), time.process_time()
+    try:
+        yield call
+    finally:
+        wall, cpu = time.perf_counter() - wall_start, time.process_time() - cpu_start
+        stack.pop()
+        if profiler is not None:
+            run.stop_profiler(profiler)
+        with run.lock:
+            record.add(call, wall, cpu, peak_rss_mb())
+
+
+# Builds the run report from every stage recorded so far; info is added at the top level (e.g. arguments, status).
+# With path it is also written as JSON, and the cProfile stats of hot stages are dumped to the profile directory.
+def write_report(path=None, **info):
+    run = _run
+    with run.lock:
+        records = dict(run.records)
+
+    # Depth-first order: children under their parent, siblings by start time
+    def tree_position(record):
+        parts = record.path.split('/')
+        return [records['/'.join(parts[:i])].start_offset for i in range(1, len(parts) + 1)]
+    records = sorted(records.values(), key=tree_position)
+
+    profiles = {}
+    if run.profile_dir:
+        os.makedirs(run.profile_dir, exist_ok=True)
+        for record in records:
+            if record.profiler is not None:
+                profile_path = os.path.join(run.profile_dir, f"{record.path.replace('/', '.')}.prof")
+                record.profiler.dump_stats(profile_path)
+                profiles[record.path] = profile_path
+
+    stages = []
+    for record in records:
+        entry = record.to_dict()
+        entry['profile'] = profiles.get(record.path)
+        stages.append(entry)
+
+    report = {
+        **info,
+        'started_at': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(run.started_at)),
+        'wall_seconds': round(time.perf_counter() - run.wall_start, 4),
+        'cpu_seconds': round(time.process_time() - run.cpu_start, 4),
+        'peak_rss_mb': None if peak_rss_mb() is None else round(peak_rss_mb(), 1),
+        'stages': stages,
+    }
+
+    if path:
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(path, 'w') as fh:
+            json.dump(report, fh, indent=2, default=str)
+    return report
+
+
+# One line per stage, indented by nesting depth.
+def print_summary(report):
+    print(f"{'Stage':<44} {'Calls':>6} {'Wall s':>8} {'CPU s':>8} {'Rows out':>12} {'Peak MB':>8}")
+    for entry in report['stages']:
+        depth = entry['stage'].count('/')
+        label = '  ' * depth + entry['stage'].rsplit('/', 1)[-1]
+        rows_out = '' if entry['rows_out'] is None else f"{entry['rows_out']:,}"
+        peak = '' if entry['peak_rss_mb'] is None else f"{entry['peak_rss_mb']:.0f}"
+        print(f"{label:<44} {entry['calls']:>6} {entry['wall_seconds']:>8.2f} {entry['cpu_seconds']:>8.2f} {rows_out:>12} {peak:>8}")
@@ -0,0 +1,158 @@
+import pandas as pd
+
+import instrumentation
+
+# Declarative aggregation layer for the report tables.
+# Each report is a MetricSpec: the key it is grouped by, its named aggregations and an optional
+# finishing step. compute_metrics() runs one groupby per distinct grain, so specs that share a
+# grouping key are fused into a single pass over the fact table. A spec can also declare a finer
+# grain it is rolled up from (e.g. category totals from the (product_id, category) aggregate),
+# which avoids rescanning the fact table for coarser reports. Adding a KPI is a new spec, not a new scan.
+
+# How an aggregate computed at a finer grain is combined when rolling up to a coarser key.
+# mean/nunique/median are not decomposable and cannot be rolled up.
+ROLLUP_FUNCS = {
+    'sum': 'sum',
+    'count': 'sum',
+    'size': 'sum',
+    'min': 'min',
+    'max': 'max',
+}
+
+
+class MetricSpec:
+    def __init__(self, name, by, aggs, grain=None, finish=None):
+        self.name = name
+        self.by = by
+        self.aggs = aggs
+        self.grain = tuple(grain) if grain else (by,)
+        self.finish = finish
+
+        if self.grain != (by,):
+            if by not in self.grain:
+                raise ValueError(f"Metric '{name}': grouping key '{by}' is not part of its grain {self.grain}")
+            not_rollable = [out for out, (_, func) in aggs.items() if func not in ROLLUP_FUNCS]
+            if not_rollable:
+                raise ValueError(f"Metric '{name}': {not_rollable} cannot be rolled up from grain {self.grain}")
+
+
+# Specs grouped by grain, each grain with the union of the aggregations its specs need.
+def _grain_passes(specs):
+    passes = {}
+    for spec in specs:
+        passes.setdefault(spec.grain, []).append(spec)
+
+    fused = {}
+    for grain, grain_specs in passes.items():
+        fused_aggs = {}
+        for spec in grain_specs:
+            for out, agg in spec.aggs.items():
+                if fused_aggs.get(out, agg) != agg:
+                    raise ValueError(f"Metric '{spec.name}': '{out}' conflicts with another metric on grain {grain}")
+                fused_aggs[out] = agg
+        fused[grain] = (grain_specs, fused_aggs)
+    return fused
+
+
+# Rows with a missing key at a multi-key grain still belong to the rolled-up totals of the other keys
+def _groupby(df, grain):
+    return df.groupby(list(grain), dropna=(len(grain) == 1), observed=True)
+
+
+# Report tables of the specs on one grain, from that grain's fused aggregate.
+def _spec_tables(fused, grain, grain_specs):
+    tables = {}
+    for spec in grain_specs:
+        columns = list(spec.aggs)
+        if grain == (spec.by,):
+            table = fused[columns]
+        else:
+            rollup = {out: ROLLUP_FUNCS[func] for out, (_, func) in spec.aggs.items()}
+            table = fused[columns].groupby(level=spec.by, observed=True).agg(rollup)
+
+        table = table.reset_index()
+        tables[spec.name] = spec.finish(table) if spec.finish else table
+    return tables
+
+
+# Computes every spec over df and returns {spec.name: table}.
+def compute_metrics(df, specs):
+    tables = {}
+    for grain, (grain_specs, fused_aggs) in _grain_passes(specs).items():
+        # Union of the aggregations every spec on this grain needs, computed in one groupby
+        with instrumentation.stage(f"groupby_{'_'.join(grain)}", rows_in=len(df)) as stage:
+            fused = _groupby(df, grain).agg(**fused_aggs)
+            stage.rows_out = len(fused)
+
+        tables.update(_spec_tables(fused, grain, grain_specs))
+
+    return tables
+
+
+# Chunked evaluation of the same specs: add() folds each chunk into partial aggregates per grain and
+# tables() finishes them, so the fact table never has to be in memory at once.
+#   sum/count/size  summed across chunks         min/max  min/max of the chunk results
+#   mean            sum and non-null count, divided at the end
+#   nunique         distinct (grain, value) pairs of each chunk, combined and counted at the end
+# Other aggregations (e.g. median) cannot be computed from partials and are rejected.
+class MetricAccumulator:
+    PARTIAL_FUNCS = {'sum': 'sum', 'count': 'sum', 'size': 'sum', 'min': 'min', 'max': 'max'}
+
+    def __init__(self, specs):
+        self.passes = _grain_passes(specs)
+        for grain, (_, fused_aggs) in self.passes.items():
+            unsupported = [out for out, (_, func) in fused_aggs.items() if func not in self.PARTIAL_FUNCS and func not in ('mean', 'nunique')]
+            if unsupported:
+                raise ValueError(f"{unsupported} on grain {grain} cannot be computed from chunk partials")
+        self.partials = {grain: None for grain in self.passes}
+        self.distinct = {grain: {} for grain in self.passes}
+
+    @staticmethod
+    def _partial_aggs(fused_aggs):
+        aggs = {}
+        for out, (col, func) in fused_aggs.items():
+            if func == 'mean':
+                aggs[f"{out}__sum"] = (col, 'sum')
+                aggs[f"{out}__count"] = (col, 'count')
+            elif func != 'nunique':
+                aggs[out] = (col, func)
+        return aggs
+
+    def add(self, df):
+        for grain, (_, fused_aggs) in self.passes.items():
+            aggs = self._partial_aggs(fused_aggs)
+            partial = _groupby(df, grain).agg(**aggs) if aggs else None
+            if partial is not None:
+                previous = self.partials[grain]
+                if previous is not None:
+                    combine = {name: self.PARTIAL_FUNCS[func] for name, (_, func) in aggs.items()}
+                    partial = (pd.concat([previous, partial])
+                               .groupby(level=list(grain), dropna=(len(grain) == 1), observed=True).agg(combine))
+                self.partials[grain] = partial
+
+            for out, (col, func) in fused_aggs.items():
+                if func == 'nunique':
+                    # Distinct pairs from a groupby, which is much faster than drop_duplicates on periods
+                    pairs = df.dropna(subset=[col]).groupby([*grain, col], dropna=False, observed=True).size()
+                    self.distinct[grain].setdefault(out, []).append(pairs.index.to_frame(index=False))
+        return self
+
+    def tables(self):
+        tables = {}
+        for grain, (grain_specs, fused_aggs) in self.passes.items():
+            partial = self.partials[grain]
+            fused = pd.DataFrame(index=partial.index if partial is not None else None)
+            for out, (col, func) in fused_aggs.items():
+                if func == 'mean':
+                    fused[out] = partial[f"{out}__sum"] / partial[f"{out}__count"]
+                elif func == 'nunique':
+                    # The pieces are released as soon as they are combined
+                    pairs = pd.concat(self.distinct[grain].pop(out), ignore_index=True)
+                    counts = _groupby(pairs, grain)[col].nunique()
+                    del pairs
+                    fused = fused.join(counts.rename(out), how='outer') if partial is None else fused.join(counts.rename(out))
+                    fused[out] = fused[out].fillna(0).astype(int)
+                else:
+                    fused[out] = partial[out]
+            tables.update(_spec_tables(fused.sort_index(), grain, grain_specs))
+        return tables
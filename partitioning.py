@@ -0,0 +1,80 @@
+import io
+import os
+
+import pandas as pd
+
+# Byte-range access to raw CSV files, used to read one file in independent pieces
+# (incremental runs read the bytes appended since the last run, parallel cleaning reads one range per worker).
+# Ranges always end at a line break, so the files must not contain quoted fields with embedded newlines.
+
+SCAN_BYTES = 65536
+
+
+# Exposes at most `limit` bytes of a binary file, so rows appended during a run are left for the next one.
+class BoundedReader(io.RawIOBase):
+    def __init__(self, fh, limit):
+        self.fh = fh
+        self.remaining = limit
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        if self.remaining <= 0:
+            return 0
+        view = memoryview(buffer)[:self.remaining]
+        n = self.fh.readinto(view)
+        self.remaining -= n
+        return n
+
+
+def read_header(path):
+    with open(path, 'rb') as fh:
+        return fh.readline().decode('utf-8').strip().split(',')
+
+
+# Offset just past the first line break at or after position (or the file size if there is none).
+def _next_line_start(fh, position, size):
+    fh.seek(position)
+    while position < size:
+        block = fh.read(SCAN_BYTES)
+        if not block:
+            break
+        newline = block.find(b'\n')
+        if newline >= 0:
+            return position + newline + 1
+        position += len(block)
+    return size
+
+
+# Splits the file into at most `parts` byte ranges of similar size, each ending at a line break.
+# The first range starts at 0 and includes the header line.
+def line_ranges(path, parts):
+    size = os.path.getsize(path)
+    parts = max(1, parts)
+    with open(path, 'rb') as fh:
+        # The first boundary is never inside the header line
+        header_end = _next_line_start(fh, 0, size)
+        bounds = [0] + [max(_next_line_start(fh, size * i // parts, size), header_end) for i in range(1, parts)] + [size]
+    return [(start, end) for start, end in zip(bounds, bounds[1:]) if end > start]
+
+
+def _open_range(fh, start, end, header, **kwargs):
+    fh.seek(start)
+    bounded = io.BufferedReader(BoundedReader(fh, end - start))
+    if start == 0:
+        return pd.read_csv(bounded, **kwargs)
+    return pd.read_csv(bounded, header=None, names=header, **kwargs)
+
+
+# pd.read_csv over the bytes [start, end) of path. A range starting at 0 parses the file's header line,
+# any other range is read with header as its column names.
+def read_csv_range(path, start, end, header, **kwargs):
+    with open(path, 'rb') as fh:
+        return _open_range(fh, start, end, header, **kwargs)
+
+
+# Same as read_csv_range, in chunks of chunksize rows.
+def iter_csv_range(path, start, end, header, chunksize, **kwargs):
+    with open(path, 'rb') as fh:
+        yield from _open_range(fh, start, end, header, chunksize=chunksize, **kwargs)
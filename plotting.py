@@ -0,0 +1,175 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import matplotlib
+
+# Headless rendering: plots are only ever written to files
+matplotlib.use('Agg')
+
+from matplotlib.figure import Figure
+
+# Report plots drawn with the object-oriented Figure API. Nothing touches pyplot's global
+# state, so each plot can be rendered independently in a thread or worker process.
+
+#Plot for time-based revenue trends
+def plot_monthly_financials_with_profit_pct(monthly_trends):
+    x = range(len(monthly_trends))  # Use numeric index instead of string
+    x_labels = monthly_trends['month'].astype(str)  # Keep labels as strings
+    fig = Figure(figsize=(9, 5))
+    ax1 = fig.subplots()
+
+    # Left axis: amounts
+    ax1.plot(x, monthly_trends['total_cost'], label='Total Cost')
+    ax1.plot(x, monthly_trends['total_revenue'], label='Total Revenue')
+    ax1.plot(x, monthly_trends['total_profit'], label='Total Profit')
+    ax1.set_xlabel("Month")
+    ax1.set_ylabel("Amount")
+    ax1.set_xticks(x)
+    ax1.set_xticklabels(x_labels, rotation=45)
+
+    # Right axis: profit % and revenue growth %
+    ax2 = ax1.twinx()
+    ax2.plot(x, monthly_trends['profit_pct'], linestyle='--', marker='o', label='Profit %')
+    ax2.plot(x, monthly_trends['revenue_growth_pct'], linestyle='--', marker='s', label='Revenue Growth %')
+    ax2.axhline(0, linestyle=':', color='gray', alpha=0.5)
+    ax2.set_ylabel("Percentage (%)")
+
+    # Legend
+    lines1, labels1 = ax1.get_legend_handles_labels()
+    lines2, labels2 = ax2.get_legend_handles_labels()
+    ax1.legend(lines1 + lines2, labels1 + labels2, loc='best')
+
+    ax2.set_title("Monthly Cost, Revenue, Profit, Profit % and Revenue Growth Trend")
+    fig.tight_layout()
+    return fig
+
+#Plot for Product Metrics - top 10 products
+def plot_product_profit_pct(product_metrics, top_n=10):
+    top_products = product_metrics.sort_values('total_revenue', ascending=False).head(top_n)
+
+    fig = Figure(figsize=(9, 5))
+    ax = fig.subplots()
+    x = range(len(top_products))
+    x_labels = top_products['product_id'].astype(str)
+
+    ax.bar(x, top_products['profit_pct'])
+    ax.set_xticks(x)
+    ax.set_xticklabels(x_labels, rotation=45)
+
+    ax.set_xlabel("Product ID")
+    ax.set_ylabel("Profit %")
+    ax.set_title(f"Top {top_n} Products by Revenue - Profit %")
+    fig.tight_layout()
+    return fig
+
+#Plot for Category metrics
+def plot_category_financials(category_metrics):
+    x_pos = range(len(category_metrics))  # Numeric positions
+    x_labels = category_metrics['category']  # String labels
+    width = 0.35
+
+    fig = Figure(figsize=(9, 5))
+    ax1 = fig.subplots()
+
+    ax1.bar([p - width/2 for p in x_pos], category_metrics['total_revenue'], width=width, label='Revenue', alpha=0.7)
+    ax1.bar([p + width/2 for p in x_pos], category_metrics['total_cost'], width=width, label='Cost', alpha=0.7)
+    ax1.set_ylabel("Amount")
+    ax1.set_xlabel("Category")
+    ax1.set_xticks(x_pos)
+    ax1.set_xticklabels(x_labels, rotation=45)
+
+    ax2 = ax1.twinx()
+    ax2.plot(x_pos, category_metrics['profit_pct'], marker='o', linestyle='--', label='Profit %')
+    ax2.set_ylabel("Profit %")
+
+    lines1, labels1 = ax1.get_legend_handles_labels()
+    lines2, labels2 = ax2.get_legend_handles_labels()
+    ax1.legend(lines1 + lines2, labels1 + labels2, loc='best')
+
+    ax2.set_title("Category-wise Cost, Revenue and Profit %")
+    fig.tight_layout()
+    return fig
+
+#Plot for AOV
+def plot_monthly_aov(monthly_aov):
+    x = range(len(monthly_aov))  # Use numeric index
+    x_labels = monthly_aov['month'].astype(str)  # Keep labels as strings
+
+    fig = Figure(figsize=(9, 5))
+    ax = fig.subplots()
+    ax.plot(x, monthly_aov['aov'], marker='o')
+    ax.set_xticks(x)
+    ax.set_xticklabels(x_labels, rotation=45)
+    ax.set_xlabel("Month")
+    ax.set_ylabel("Average Order Value (AOV)")
+    ax.set_title("Monthly Average Order Value (AOV) Trend")
+    fig.tight_layout()
+    return fig
+
+#Plot for Active Customers Summary
+def plot_active_customers_windows(active_customers_summary):
+    fig = Figure(figsize=(8, 5))
+    ax = fig.subplots()
+    ax.plot(active_customers_summary['period_months'],active_customers_summary['active_customers'],marker='o')
+    ax.invert_xaxis()  # 15 → 3 months (time narrowing)
+    ax.set_xlabel("Time Window (Months)")
+    ax.set_ylabel("Active Customers")
+    ax.set_title("Active Customers Across Time Windows")
+    fig.tight_layout()
+    return fig
+
+#Plot for Repeat Customer Summary
+def plot_repeat_customer_rate(repeat_customer_summary):
+    fig = Figure(figsize=(8, 5))
+    ax = fig.subplots()
+    ax.plot(
+        repeat_customer_summary['period_months'],
+        repeat_customer_summary['repeat_customer_rate_pct'],
+        marker='o'
+    )
+    ax.invert_xaxis()
+    ax.set_xlabel("Time Window (Months)")
+    ax.set_ylabel("Repeat Customer Rate (%)")
+    ax.set_title("Repeat Customer Rate Across Time Windows")
+    fig.tight_layout()
+    return fig
+
+#Plot for Customer Demographics
+def plot_customer_demographics(customer_country_summary):
+    fig = Figure(figsize=(9, 5))
+    ax = fig.subplots()
+    ax.barh(customer_country_summary['country'], customer_country_summary['customer_count'])
+    ax.set_xlabel("Customer Count")
+    ax.set_ylabel("Country")
+    ax.set_title("Customer Count by Country")
+    ax.invert_yaxis()
+    fig.tight_layout()
+    return fig
+
+# Plot file name -> (plot function, report table it draws)
+PLOTS = [
+    ("monthly_financial_trends", plot_monthly_financials_with_profit_pct, 'monthly_trends'),
+    ("product_performance_analysis", plot_product_profit_pct, 'product_metrics'),
+    ("category_performance_analysis", plot_category_financials, 'category_metrics'),
+    ("monthly_aov", plot_monthly_aov, 'monthly_aov'),
+    ("active_customers_summary", plot_active_customers_windows, 'active_customers_summary'),
+    ("Repeat Customers Summary", plot_repeat_customer_rate, 'repeat_customer_summary'),
+    ("customer_demographics", plot_customer_demographics, 'customer_country_summary'),
+]
+
+def render_plot(plot_fn, table, path):
+    plot_fn(table).savefig(path)
+    return path
+
+# Renders every plot whose report table is present. With workers > 1 the plots are
+# rendered in a process pool; each worker only receives its own table.
+def render_plots(report_tables, plots_dir="plots", workers=1):
+    jobs = [(plot_fn, report_tables[table], os.path.join(plots_dir, f"{filename}.png"))
+            for filename, plot_fn, table in PLOTS if table in report_tables]
+
+    if workers <= 1 or len(jobs) <= 1:
+        return [render_plot(*job) for job in jobs]
+
+    with ProcessPoolExecutor(max_workers=min(workers, len(jobs))) as pool:
+        futures = [pool.submit(render_plot, *job) for job in jobs]
+        return [future.result() for future in futures]
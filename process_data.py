@@ -5,6 +5,17 @@ Usage:
     python automation.py
     python automation.py --raw_data_dir input --clean_data_dir processed
     python automation.py --start_date 2024-01-01 --end_date 2024-12-31
+    python automation.py --chunksize 1000000
+    python automation.py --format parquet
+    python automation.py --chunksize 5000000 --engine chunked
+    python automation.py --incremental
+    python automation.py --cache --cache_max_mb 512
+    python automation.py --profile
+    python automation.py clean --format parquet
+    python automation.py analyze --format parquet --start_date 2024-01-01
+    python automation.py analyze --sample 5000 --sample_customers 0.05
+    python automation.py serve --socket pipeline.sock
+    python automation.py --daemon --socket pipeline.sock
 """
 
 import argparse
@@ -12,8 +23,12 @@ import sys
 import logging
 from pathlib import Path
 
-import data_cleaning
-import data_analysis
+import instrumentation
+
+# The stage modules (and with them numpy, pandas and matplotlib) are imported by the commands that use
+# them, so --help, a clean-only run and a job handed to the resident worker never load the rest.
+
+COMMANDS = ["run", "clean", "analyze", "serve"]
 
 
 def setup_logging():
@@ -27,40 +42,174 @@ def parse_args():
     """Parse command-line arguments."""
     parser = argparse.ArgumentParser(description="End-to-end data operations pipeline")
 
+    parser.add_argument("command", nargs="?", default="run", choices=COMMANDS,
+                        help="run: cleaning and analysis (default), clean: cleaning only, analyze: analysis of the clean data on disk, "
+                             "serve: start a resident worker that runs jobs submitted with --daemon")
+
     parser.add_argument("--raw_data_dir", default="data_raw", help="Directory with raw CSV files")
     parser.add_argument("--clean_data_dir", default="data_clean", help="Directory for cleaned data")
     parser.add_argument("--reports_dir", default="reports", help="Directory for reports")
     parser.add_argument("--plots_dir", default="plots", help="Directory for plots")
     parser.add_argument("--start_date", help="Filter from date (YYYY-MM-DD)")
     parser.add_argument("--end_date", help="Filter to date (YYYY-MM-DD)")
+    parser.add_argument("--period_months", type=int, nargs="+", help="Trailing windows (months) for active/repeat customer summaries, e.g. 24 12 6 3 1")
+    parser.add_argument("--plot_workers", type=int, default=1, help="Processes used to render plots")
+    parser.add_argument("--no_plots", action="store_true", help="Skip plot rendering (matplotlib is not imported)")
+    parser.add_argument("--chunksize", type=int, help="Stream transactions in chunks of this many rows")
+    parser.add_argument("--engine", default="pandas", choices=["pandas", "chunked"],
+                        help="Analysis backend: one in-memory fact table (pandas) or partial aggregates over transaction chunks of --chunksize rows (chunked)")
+    parser.add_argument("--workers", type=int, default=1, help="Processes used to clean customers and transactions in partitions")
+    parser.add_argument("--incremental", action="store_true", help="Only process transactions appended since the last run")
+    parser.add_argument("--state_dir", default="state", help="Directory for incremental run state")
+    parser.add_argument("--cache", action="store_true", help="Reuse clean tables, reports and plots whose inputs are unchanged since an earlier run")
+    parser.add_argument("--cache_dir", default="cache", help="Directory for the result cache")
+    parser.add_argument("--cache_max_mb", type=int, default=2048, help="Size limit of the result cache; least recently used entries are evicted")
+    parser.add_argument("--cache_fingerprint", default="stat", choices=["stat", "content"],
+                        help="Detect changed input files by size and modification time (stat) or by content hash (content)")
+    parser.add_argument("--sample", type=int, nargs="?", const=10_000, metavar="ROWS_PER_MONTH",
+                        help="Sampled preview of the headline reports with 95%% error bounds, from up to this many transactions per month "
+                             "(default 10000), written to <reports_dir>/sample")
+    parser.add_argument("--sample_customers", type=float, default=0.1,
+                        help="Fraction of customers sampled for the customer-level estimates of --sample")
+    parser.add_argument("--format", default="csv", choices=["csv", "parquet", "feather"], help="Storage format for cleaned data")
+    parser.add_argument("--partition_by_month", action="store_true", help="Store clean transactions in one directory per transaction month (Hive-style)")
+    parser.add_argument("--clean_write", default="async", choices=["sync", "async", "none"],
+                        help="Write cleaned data before analysis (sync), on a background thread during analysis (async), or not at all (none)")
+    parser.add_argument("--run_report", help="Path of the JSON run report with per-stage metrics (default: <reports_dir>/run_report.json)")
+    parser.add_argument("--profile", action="store_true", help="Run hot stages under cProfile and dump their stats to --profile_dir")
+    parser.add_argument("--profile_dir", default="profiles", help="Directory for cProfile stats")
+    parser.add_argument("--daemon", action="store_true", help="Submit the job to the resident worker listening on --socket instead of running it here")
+    parser.add_argument("--socket", default="pipeline.sock", help="Local socket of the resident worker")
 
     return parser.parse_args()
 
-def main():
-    args = parse_args()
-    setup_logging()
-
+# Runs one pipeline job and returns its status ("completed" or "failed"). dimensions is the resident
+# worker's store of warm clean dimension tables (see daemon.py), None for a one-off run.
+def run_pipeline(args, dimensions=None):
     # Create directories
     Path(args.raw_data_dir).mkdir(exist_ok=True)
     Path(args.clean_data_dir).mkdir(exist_ok=True)
     Path(args.reports_dir).mkdir(exist_ok=True)
     Path(args.plots_dir).mkdir(exist_ok=True)
 
+    instrumentation.start_run(profile_dir=args.profile_dir if args.profile else None)
+    status = "failed"
+
     try:
+        if args.command != "run" and (args.incremental or args.cache):
+            raise ValueError(f"--incremental and --cache run the full pipeline and cannot be used with the {args.command} command")
+
+        if args.sample is not None and (args.incremental or args.cache or args.command == "clean"):
+            raise ValueError("--sample previews the analysis and cannot be combined with --incremental, --cache or the clean command")
+
+        if args.incremental:
+            if args.cache:
+                raise ValueError("--incremental keeps its own state and cannot be combined with --cache")
+            if args.partition_by_month:
+                raise ValueError("--incremental appends to a single clean transactions file and cannot be combined with --partition_by_month")
+            if args.workers != 1 or args.engine != "pandas":
+                raise ValueError("--incremental cleans the new rows in one process and builds reports from its own partial aggregates; it cannot be combined with --workers or --engine")
+            import incremental
+
+            logging.info("Running incremental Data Cleaning & Analysis")
+            with instrumentation.stage("incremental"):
+                incremental.main(raw_dir=args.raw_data_dir, clean_dir=args.clean_data_dir, reports_dir=args.reports_dir, plots_dir=args.plots_dir,
+                                 state_dir=args.state_dir, start_date=args.start_date, end_date=args.end_date, chunksize=args.chunksize, fmt=args.format, period_months=args.period_months,
+                                 plots=not args.no_plots, plot_workers=args.plot_workers)
+            status = "completed"
+            return status
+
+        if args.cache:
+            import cache
+
+            logging.info("Running Data Cleaning & Analysis with the result cache")
+            with instrumentation.stage("cache"):
+                cache.main(raw_dir=args.raw_data_dir, clean_dir=args.clean_data_dir, reports_dir=args.reports_dir, plots_dir=args.plots_dir,
+                           cache_dir=args.cache_dir, max_bytes=args.cache_max_mb * 2**20, fingerprint=args.cache_fingerprint,
+                           start_date=args.start_date, end_date=args.end_date, chunksize=args.chunksize, fmt=args.format, write=args.clean_write,
+                           workers=args.workers, partitioned=args.partition_by_month, period_months=args.period_months,
+                           plots=not args.no_plots, plot_workers=args.plot_workers, engine=args.engine)
+            status = "completed"
+            return status
+
+        customers = products = transactions = None
+
         # Task 1: Data Cleaning
-        logging.info("Running Task-1: Data Cleaning & Validation")
-        data_cleaning.main(raw_dir=args.raw_data_dir, clean_dir=args.clean_data_dir, start_date=args.start_date, end_date=args.end_date)
-        logging.info("Task-1 completed successfully\n")
+        if args.command in ("run", "clean"):
+            import data_cleaning
+
+            logging.info("Running Task-1: Data Cleaning & Validation")
+            with instrumentation.stage("cleaning"):
+                cleaned = dimensions.get(args.raw_data_dir, args.clean_data_dir, args.start_date, args.end_date) if dimensions else None
+                customers, products, transactions = data_cleaning.main(raw_dir=args.raw_data_dir, clean_dir=args.clean_data_dir, start_date=args.start_date, end_date=args.end_date,
+                                                                       chunksize=args.chunksize, fmt=args.format, write=args.clean_write, workers=args.workers,
+                                                                       partitioned=args.partition_by_month, cleaned=cleaned)
+                if dimensions:
+                    dimensions.put({'customers': customers, 'products': products}, args.clean_data_dir)
+            logging.info("Task-1 completed successfully\n")
 
         # Task 2: Data Analysis
-        logging.info("Running Task-2: Data Analysis & Reporting")
-        data_analysis.main(clean_dir=args.clean_data_dir, reports_dir=args.reports_dir, plots_dir=args.plots_dir, start_date=args.start_date, end_date=args.end_date)
-        logging.info("Task-2 completed successfully\n")
+        if args.command in ("run", "analyze"):
+            import data_analysis
+
+            logging.info("Running Task-2: Data Analysis & Reporting")
+            # Cleaned frames are handed over in memory; only streamed transactions (and everything in the
+            # analyze command) are read back from disk
+            with instrumentation.stage("analysis"):
+                data_analysis.main(clean_dir=args.clean_data_dir, reports_dir=args.reports_dir, plots_dir=args.plots_dir, start_date=args.start_date, end_date=args.end_date, fmt=args.format,
+                                   customers=customers, products=products, transactions=transactions, period_months=args.period_months,
+                                   plots=not args.no_plots, plot_workers=args.plot_workers, engine=args.engine, chunksize=args.chunksize,
+                                   sample_rows=args.sample, customer_fraction=args.sample_customers)
+            logging.info("Task-2 completed successfully\n")
 
-        logging.info("Pipeline execution completed")
+        status = "completed"
 
     except Exception as e:
         logging.error(f"✗ Pipeline failed: {e}")
+
+    finally:
+        # Background clean writes are joined even when a later stage failed, so the run report is only
+        # written once every clean file is complete, and a failed write fails the run
+        if args.command in ("run", "clean"):
+            import storage
+
+            try:
+                with instrumentation.stage("wait_clean_writes"):
+                    storage.wait_for_background_writes()
+            except Exception as e:
+                logging.error(f"✗ Writing clean data failed: {e}")
+                status = "failed"
+        if status == "completed":
+            logging.info("Pipeline execution completed")
+
+        # The run report is written for failed runs too, to show how far they got
+        report_path = args.run_report or str(Path(args.reports_dir) / "run_report.json")
+        report = instrumentation.write_report(report_path, status=status, args=vars(args))
+        instrumentation.print_summary(report)
+        logging.info(f"Run report saved to {report_path}")
+
+    return status
+
+
+def main():
+    args = parse_args()
+    setup_logging()
+
+    if args.command == "serve":
+        import daemon
+        try:
+            daemon.serve(args.socket, plots=not args.no_plots)
+        except RuntimeError as e:
+            logging.error(f"✗ {e}")
+            sys.exit(1)
+        return
+
+    if args.daemon:
+        import daemon
+        status = daemon.submit(args.socket, args)
+    else:
+        status = run_pipeline(args)
+    if status != "completed":
         sys.exit(1)
 
 
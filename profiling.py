@@ -0,0 +1,208 @@
+import numpy as np
+import pandas as pd
+
+# Mergeable, single-pass data profiling.
+# Every column is scanned once: one isna() mask, one non-null slice, then either an exact
+# unique set or a HyperLogLog sketch. Partial profiles from chunks or worker processes
+# combine with merge(), so a profile never needs the whole frame in memory.
+
+# Distinct values kept exactly in 'auto' mode before a column switches to HyperLogLog.
+EXACT_UNIQUE_LIMIT = 100_000
+
+
+def _bit_length(x):
+    # Vectorised bit length of a uint64 array. Values below 2**53 convert to float64 exactly, so their
+    # bit length is the frexp exponent (HyperLogLog with p >= 11 only has those); otherwise binary search over shifts.
+    if len(x) and x.max() < np.uint64(2 ** 53):
+        return np.frexp(x.astype(np.float64))[1].astype(np.uint8)
+    x = x.copy()
+    length = np.zeros(x.shape, dtype=np.uint8)
+    for shift in (32, 16, 8, 4, 2, 1):
+        has_high = (x >> np.uint64(shift)) != 0
+        length += np.uint8(shift) * has_high
+        x = np.where(has_high, x >> np.uint64(shift), x)
+    return length + (x != 0)
+
+
+def hash_values(values):
+    return pd.util.hash_pandas_object(pd.Series(values), index=False).to_numpy()
+
+
+# HyperLogLog approximate distinct counter. p=14 gives ~0.8% standard error with 16 KB of registers.
+class HyperLogLog:
+    def __init__(self, p=14, registers=None):
+        self.p = p
+        self.m = 1 << p
+        self.registers = np.zeros(self.m, dtype=np.uint8) if registers is None else registers
+
+    def add_hashes(self, hashes):
+        if len(hashes) == 0:
+            return self
+        hashes = np.asarray(hashes, dtype=np.uint64)
+        index = (hashes >> np.uint64(64 - self.p)).astype(np.intp)
+        rest = hashes & np.uint64((1 << (64 - self.p)) - 1)
+        rank = (64 - self.p + 1 - _bit_length(rest)).astype(np.uint8)
+        np.maximum.at(self.registers, index, rank)
+        return self
+
+    def add(self, values):
+        return self.add_hashes(hash_values(values))
+
+    def merge(self, other):
+        if self.p != other.p:
+            raise ValueError(f"Cannot merge HyperLogLog sketches with p={self.p} and p={other.p}")
+        return HyperLogLog(self.p, np.maximum(self.registers, other.registers))
+
+    # Relative standard error of count()
+    def relative_error(self):
+        return 1.04 / np.sqrt(self.m)
+
+    # Improved raw estimator of Ertl, "New cardinality estimation algorithms for HyperLogLog sketches" (2017).
+    # It uses the histogram of register values and has no bias to correct in the range between linear
+    # counting and the classic estimator, where that one overestimates by a few percent.
+    def count(self):
+        q = 64 - self.p
+        histogram = np.bincount(self.registers, minlength=q + 2)
+        z = self.m * _tau(1 - histogram[q + 1] / self.m)
+        for k in range(q, 0, -1):
+            z = 0.5 * (z + histogram[k])
+        z += self.m * _sigma(histogram[0] / self.m)
+        return int(round(self.m ** 2 / (2 * np.log(2) * z)))
+
+
+def _sigma(x):
+    if x == 1:
+        return np.inf
+    y, z = 1.0, x
+    while True:
+        x *= x
+        previous = z
+        z += x * y
+        y += y
+        if z == previous:
+            return z
+
+
+def _tau(x):
+    if x == 0 or x == 1:
+        return 0.0
+    y, z = 1.0, 1 - x
+    while True:
+        x = np.sqrt(x)
+        previous = z
+        y *= 0.5
+        z -= (1 - x) ** 2 * y
+        if z == previous:
+            return z / 3
+
+
+# dtype of one column read whole, given the dtypes of two of its parts: numeric dtypes widen,
+# categoricals take the union of their categories (sorted, as read_csv creates them), anything else is object.
+def _common_dtype(left, right):
+    if left == right:
+        return left
+    if isinstance(left, pd.CategoricalDtype) and isinstance(right, pd.CategoricalDtype):
+        return pd.CategoricalDtype(sorted(set(left.categories) | set(right.categories)))
+    if isinstance(left, np.dtype) and isinstance(right, np.dtype) and left.kind in 'iuf' and right.kind in 'iuf':
+        return np.result_type(left, right)
+    return np.dtype(object)
+
+
+# Partial profile of one column. unique_mode is 'exact', 'approx' (HyperLogLog) or
+# 'auto' (exact until EXACT_UNIQUE_LIMIT distinct values, then HyperLogLog).
+class ColumnProfile:
+    def __init__(self, dtype, rows=0, nulls=0, sample=None, uniques=None, sketch=None, unique_mode='exact'):
+        self.dtype = dtype
+        self.rows = rows
+        self.nulls = nulls
+        self.sample = sample
+        self.uniques = uniques
+        self.sketch = sketch
+        self.unique_mode = unique_mode
+
+    @classmethod
+    def from_series(cls, series, unique_mode='exact'):
+        null_mask = series.isna().to_numpy()
+        non_null = series.to_numpy()[~null_mask]
+        profile = cls(
+            dtype=series.dtype,
+            rows=len(null_mask),
+            nulls=int(null_mask.sum()),
+            sample=non_null[0] if len(non_null) else None,
+            unique_mode=unique_mode
+        )
+        if unique_mode == 'approx':
+            profile.sketch = HyperLogLog().add(non_null)
+        else:
+            profile.uniques = pd.unique(non_null)
+            profile._maybe_switch_to_sketch()
+        return profile
+
+    def _maybe_switch_to_sketch(self):
+        if self.unique_mode == 'auto' and self.uniques is not None and len(self.uniques) > EXACT_UNIQUE_LIMIT:
+            self.sketch = HyperLogLog().add(self.uniques)
+            self.uniques = None
+
+    def _as_sketch(self):
+        return self.sketch if self.sketch is not None else HyperLogLog().add(self.uniques)
+
+    def merge(self, other):
+        merged = ColumnProfile(
+            dtype=_common_dtype(self.dtype, other.dtype),
+            rows=self.rows + other.rows,
+            nulls=self.nulls + other.nulls,
+            sample=self.sample if self.sample is not None else other.sample,
+            unique_mode=self.unique_mode
+        )
+        if self.sketch is not None or other.sketch is not None:
+            merged.sketch = self._as_sketch().merge(other._as_sketch())
+        else:
+            merged.uniques = pd.unique(np.concatenate([self.uniques, other.uniques]))
+            merged._maybe_switch_to_sketch()
+        return merged
+
+    @property
+    def non_null(self):
+        return self.rows - self.nulls
+
+    @property
+    def unique_count(self):
+        return self.sketch.count() if self.sketch is not None else len(self.uniques)
+
+
+# Partial profile of a whole frame: one ColumnProfile per column, in column order.
+class FrameProfile:
+    def __init__(self, columns, rows=0):
+        self.columns = columns
+        self.rows = rows
+
+    @classmethod
+    def from_frame(cls, df, unique_mode='exact'):
+        columns = {col: ColumnProfile.from_series(df[col], unique_mode) for col in df.columns}
+        return cls(columns, rows=len(df))
+
+    def merge(self, other):
+        columns = dict(self.columns)
+        for col, profile in other.columns.items():
+            columns[col] = columns[col].merge(profile) if col in columns else profile
+        return FrameProfile(columns, rows=self.rows + other.rows)
+
+    def to_frame(self):
+        cols = self.columns.values()
+        return pd.DataFrame({
+            'Column': list(self.columns),
+            'Dtype': [c.dtype for c in cols],
+            'Non-Null Count': [c.non_null for c in cols],
+            'Null Count': [c.nulls for c in cols],
+            'Null %': [round(c.nulls / c.rows * 100, 2) if c.rows else np.nan for c in cols],
+            'Unique Count': [c.unique_count for c in cols],
+            'Sample Values': [c.sample for c in cols]
+        })
+
+
+def merge_profiles(profiles):
+    profiles = list(profiles)
+    merged = profiles[0]
+    for profile in profiles[1:]:
+        merged = merged.merge(profile)
+    return merged
@@ -0,0 +1,121 @@
+import numpy as np
+import pandas as pd
+
+# Windowed customer retention metrics computed in one sorted sweep.
+#
+# Input is a table of customer "events": customer_id, date and the number of distinct
+# transactions on that event. Each customer's events are sorted newest first once. Two dates
+# per customer answer every trailing window:
+#   last_purchase  - most recent event; the customer is active in a window iff it is >= the cutoff
+#   repeat_date    - date at which the running transaction count from the newest event reaches 2;
+#                    the customer made 2+ transactions in a window iff it is >= the cutoff
+# Counts for all cutoffs then come from one searchsorted over the sorted dates, so the cost is
+# O(customers log customers) regardless of how many windows are requested.
+
+
+# Events from transaction rows: one event per distinct (customer, transaction), dated by its latest row,
+# plus zero-transaction events for rows without a transaction_id (they count for activity only).
+def transaction_events(df, customer_col='customer_id', txn_col='transaction_id', date_col='transaction_date'):
+    return EventAccumulator(customer_col, txn_col, date_col).add(df).events()
+
+
+# transaction_events over rows arriving in chunks: a transaction split across chunks is merged by
+# its latest date, and repeated untracked (customer, date) pairs are kept once.
+# Each chunk is reduced on its own and the pieces are combined once, in events().
+class EventAccumulator:
+    def __init__(self, customer_col='customer_id', txn_col='transaction_id', date_col='transaction_date'):
+        self.customer_col = customer_col
+        self.txn_col = txn_col
+        self.date_col = date_col
+        self.per_txn = []
+        self.untracked = []
+
+    def add(self, df):
+        rows = df[[self.customer_col, self.txn_col, self.date_col]]
+        has_txn = rows[self.txn_col].notna()
+
+        self.per_txn.append(rows[has_txn].groupby([self.customer_col, self.txn_col], observed=True)[self.date_col].max().reset_index())
+        self.untracked.append(rows.loc[~has_txn, [self.customer_col, self.date_col]].drop_duplicates())
+        return self
+
+    def events(self):
+        # The pieces are released as soon as they are combined. Only transactions seen in more than one
+        # chunk need regrouping, which keeps the final pass small when transactions are not split.
+        pieces, self.per_txn = self.per_txn, []
+        chunked = len(pieces) > 1
+        per_txn = pd.concat(pieces, ignore_index=True)
+        del pieces
+        split = per_txn.duplicated([self.customer_col, self.txn_col], keep=False) if chunked else None
+        if chunked and split.any():
+            merged = per_txn[split].groupby([self.customer_col, self.txn_col], observed=True)[self.date_col].max().reset_index()
+            per_txn = pd.concat([per_txn[~split], merged], ignore_index=True)
+        untracked = pd.concat(self.untracked).drop_duplicates()
+        per_txn = per_txn.drop(columns=self.txn_col).assign(transactions=1)
+        events = pd.concat([per_txn, untracked.assign(transactions=0)], ignore_index=True)
+        return events.rename(columns={self.customer_col: 'customer_id', self.date_col: 'date'})
+
+
+# Per-customer last_purchase and repeat_date from an events table (customer_id, date, transactions).
+def customer_sweep(events):
+    events = (events.dropna(subset=['customer_id', 'date'])
+              .sort_values(['customer_id', 'date'], ascending=[True, False]))
+    by_customer = events.groupby('customer_id', sort=False, observed=True)
+
+    running_txns = by_customer['transactions'].cumsum()
+    sweep = by_customer['date'].first().rename('last_purchase').to_frame()
+    sweep['repeat_date'] = events[running_txns >= 2].groupby('customer_id', sort=False, observed=True)['date'].first()
+    return sweep
+
+
+def window_cutoffs(ref_date, period_months):
+    return np.array([ref_date - pd.DateOffset(months=n) for n in period_months], dtype='datetime64[ns]')
+
+
+# Number of dates >= each cutoff.
+def _count_since(dates, cutoffs):
+    dates = np.sort(dates.dropna().to_numpy(dtype='datetime64[ns]'))
+    return len(dates) - np.searchsorted(dates, cutoffs, side='left')
+
+
+# Active and repeat customers for every trailing window of n months before ref_date.
+def window_summary(sweep, period_months, ref_date=None):
+    if ref_date is None:
+        ref_date = sweep['last_purchase'].max()
+    cutoffs = window_cutoffs(ref_date, period_months)
+
+    active = _count_since(sweep['last_purchase'], cutoffs)
+    repeat = _count_since(sweep['repeat_date'], cutoffs)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        repeat_rate = repeat / active * 100
+
+    return pd.DataFrame({
+        'period_months': list(period_months),
+        'active_customers': active,
+        'repeat_customers': repeat,
+        'repeat_customer_rate_pct': repeat_rate,
+    })
+
+
+# Monthly cohort retention: customers are grouped by the month of their first event, and each cell
+# is the % of the cohort active k months later (month_0 is always 100, months after the data ends are empty).
+def cohort_retention(events):
+    events = events.dropna(subset=['customer_id', 'date'])
+    if events.empty:
+        return pd.DataFrame(columns=['cohort', 'cohort_size', 'month_0'])
+
+    # Months as integer ordinals so cohort ages are plain subtraction
+    active = pd.DataFrame({'customer_id': events['customer_id'].to_numpy(),
+                           'month': (events['date'].dt.year * 12 + events['date'].dt.month - 1).to_numpy()}).drop_duplicates()
+
+    active['cohort'] = active.groupby('customer_id', observed=True)['month'].transform('min')
+    active['age'] = active['month'] - active['cohort']
+    counts = active.groupby(['cohort', 'age']).size().unstack('age', fill_value=0)
+
+    retention = counts.div(counts[0], axis=0) * 100
+    # Ages past the last observed month have not happened yet for that cohort
+    unobserved = (counts.index.to_numpy()[:, None] + counts.columns.to_numpy()[None, :]) > active['month'].max()
+    retention = retention.mask(unobserved)
+    retention.columns = [f"month_{age}" for age in retention.columns]
+    retention.insert(0, 'cohort_size', counts[0])
+    retention.index = pd.Index([pd.Period(year=m // 12, month=m % 12 + 1, freq='M') for m in retention.index], name='cohort')
+    return retention.reset_index()
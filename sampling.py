@@ -0,0 +1,295 @@
+import numpy as np
+import pandas as pd
+
+import data_analysis
+import instrumentation
+import retention
+import schema
+from profiling import HyperLogLog, hash_values
+
+# Sampled preview of the headline report tables (--sample).
+#
+# One streaming pass over the transactions keeps three small summaries, however long the history is:
+#
+#   month reservoirs   up to sample_rows rows of every transaction month (stratified reservoir sampling).
+#                      Rows are ranked by a hash of their transaction and product ids and each month keeps
+#                      its sample_rows lowest ranks: a uniform sample of the month that does not depend on
+#                      the order or chunking of the rows. Candidates are picked per month with a partial sort
+#                      (argpartition), and once a month's reservoir is full, rows ranked above it are dropped first.
+#   customer sample    every row of the customers whose hashed customer_id falls in the first
+#                      customer_fraction of the hash range, reduced to retention events and revenue per customer
+#   counts, sketches   exact row counts and latest date per month, HyperLogLog sketches of transaction_id
+#                      per month and of customer_id overall
+#
+# Memory and aggregation work are bounded by sample_rows per month and the sampled customers; the pass
+# itself still reads the transaction columns once.
+#
+# Estimates, written with the column names of the exact reports:
+#
+#   monthly_trends, category_metrics, monthly_aov revenue
+#                      stratified expansion: a sampled row stands for N_month / n_month rows of its month.
+#                      Months with at most sample_rows rows are sampled in full and exact.
+#   monthly_aov total_transactions
+#                      HyperLogLog per month (exact for months sampled in full)
+#   segment_summary, active_customers_summary, repeat_customer_summary
+#                      the exact computations on the customer sample, counts and totals divided by customer_fraction
+#
+# Every estimated column <col> is followed by <col>_ci95, the half-width of its 95% confidence interval:
+# normal approximation of the sampling variance, ratios (profit %, AOV, growth, shares) by linearization,
+# HyperLogLog counts by the sketch's standard error. Segment bounds are taken as given.
+
+SAMPLE_DIR = 'sample'
+SAMPLE_TABLES = ['monthly_trends', 'monthly_aov', 'category_metrics', 'segment_summary',
+                 'active_customers_summary', 'repeat_customer_summary', 'preview_summary']
+DEFAULT_SAMPLE_ROWS = 10_000
+DEFAULT_CUSTOMER_FRACTION = 0.1
+CI_SUFFIX = '_ci95'
+Z_95 = 1.959964
+
+# Report columns estimated from the sampled fact rows
+FINANCIAL_COLUMNS = {'total_cost': 'cost_amount', 'total_revenue': 'selling_amount', 'total_profit': 'profit'}
+
+
+# Hashes mapped to uniform values in [0, 1)
+def _unit_interval(hashes):
+    return (np.asarray(hashes, dtype=np.uint64) >> np.uint64(11)).astype(np.float64) / 2.0 ** 53
+
+
+# Months since 1970, the ordinals of monthly periods
+def _month_ordinals(dates):
+    return dates.to_numpy(dtype='datetime64[ns]').astype('datetime64[M]').astype('int64')
+
+
+# Up to size rows per stratum: the ones with the lowest priority seen so far
+class StratifiedReservoir:
+    def __init__(self, size):
+        self.size = size
+        self.rows = None
+        self.thresholds = {}
+
+    # groups maps each stratum to the positions of its rows in df
+    def add(self, df, groups, priorities):
+        positions, strata = [], []
+        for stratum, candidates in groups.items():
+            # Rows ranked above a full reservoir cannot enter it
+            if stratum in self.thresholds:
+                candidates = candidates[priorities[candidates] < self.thresholds[stratum]]
+            if len(candidates) > self.size:
+                candidates = candidates[np.argpartition(priorities[candidates], self.size - 1)[:self.size]]
+            positions.append(candidates)
+            strata.append(np.full(len(candidates), stratum))
+        if not positions:
+            return self
+
+        positions, strata = np.concatenate(positions), np.concatenate(strata)
+        rows = df.iloc[positions].assign(_stratum=strata, _priority=priorities[positions])
+        if self.rows is not None:
+            rows = pd.concat([self.rows, rows], ignore_index=True)
+        rows = rows.sort_values(['_stratum', '_priority'], kind='stable', ignore_index=True)
+        rows = rows[rows.groupby('_stratum').cumcount().to_numpy() < self.size]
+
+        counts = rows.groupby('_stratum')['_priority'].agg(['size', 'max'])
+        self.thresholds = counts.loc[counts['size'] >= self.size, 'max'].to_dict()
+        self.rows = rows
+        return self
+
+
+# Stratified expansion estimates of the totals of columns per value of by, and their variances.
+# sample_sizes is n_h, the rows drawn from stratum h; each stands for N_h / n_h rows, and strata sampled
+# in full add no variance. A drawn row (its _unit) may have several rows in sample after the products
+# merge; they are summed into one value of the unit first.
+def stratified_totals(sample, columns, by, sizes, sample_sizes):
+    units = sample.groupby(['_stratum', by, '_unit'], observed=True)[columns].sum()
+    squares = {f"{col}__sq": units[col] ** 2 for col in columns}
+    sums = units.assign(**squares).groupby(level=['_stratum', by], observed=True)[[*columns, *squares]].sum()
+
+    strata = sums.index.get_level_values('_stratum')
+    n_h = sample_sizes.reindex(strata).to_numpy(dtype=float)
+    N_h = sizes.reindex(strata).to_numpy(dtype=float)
+    totals = sums[columns].mul(N_h / n_h, axis=0).groupby(level=by, observed=True).sum()
+
+    variances = pd.DataFrame(index=totals.index)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for col in columns:
+            s2 = np.clip((sums[f"{col}__sq"].to_numpy() - sums[col].to_numpy() ** 2 / n_h) / (n_h - 1), 0, None)
+            variance = np.nan_to_num(N_h ** 2 * (1 - n_h / N_h) / n_h * s2)
+            variances[col] = pd.Series(variance, index=sums.index).groupby(level=by, observed=True).sum()
+    return totals, variances
+
+
+# Standard errors of the ratios totals[numerator] / totals[denominator] per value of by (linearization)
+def ratio_errors(sample, numerator, denominator, by, sizes, sample_sizes, totals):
+    ratio = totals[numerator] / totals[denominator]
+    residual = sample[numerator] - ratio.reindex(sample[by]).to_numpy() * sample[denominator]
+    _, variances = stratified_totals(sample.assign(_residual=residual), ['_residual'], by, sizes, sample_sizes)
+    return np.sqrt(variances['_residual']) / totals[denominator].abs()
+
+
+# Standard error of a / b from the standard errors of a and b, taken as independent
+def _quotient_error(a, a_error, b, b_error):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.abs(a / b) * np.sqrt((a_error / a) ** 2 + (b_error / b) ** 2)
+
+
+# table with a <col>_ci95 column after each column in errors (standard errors, scaled to 95% here)
+def with_errors(table, errors):
+    table = table.reset_index(drop=True)
+    for col, error in errors.items():
+        table.insert(table.columns.get_loc(col) + 1, f"{col}{CI_SUFFIX}", Z_95 * np.nan_to_num(np.asarray(error, dtype=float)))
+    return table
+
+
+# Folds transaction chunks into the summaries above and turns them into the preview report tables
+class PreviewAccumulator:
+    def __init__(self, products, sample_rows=DEFAULT_SAMPLE_ROWS, customer_fraction=DEFAULT_CUSTOMER_FRACTION):
+        if sample_rows < 1:
+            raise ValueError(f"--sample needs at least 1 row per month, got {sample_rows}")
+        if not 0 < customer_fraction <= 1:
+            raise ValueError(f"--sample_customers must be in (0, 1], got {customer_fraction}")
+        self.products = products
+        self.customer_fraction = customer_fraction
+        self.reservoir = StratifiedReservoir(sample_rows)
+        self.sizes = pd.Series(dtype='int64')
+        self.latest_date = pd.NaT
+        self.month_sketches = {}
+        self.customer_sketch = HyperLogLog()
+        self.events = retention.EventAccumulator()
+        self.revenue = pd.Series(dtype='float64')
+
+    def add(self, transactions):
+        # Rows without a date belong to no month (the cleaner quarantines them)
+        transactions = transactions[transactions['transaction_date'].notna()]
+        months = _month_ordinals(transactions['transaction_date'])
+        groups = pd.Series(months).groupby(months).indices
+        sizes = pd.Series({month: len(positions) for month, positions in groups.items()}, dtype='int64')
+        self.sizes = self.sizes.add(sizes, fill_value=0).astype('int64')
+        if len(transactions):
+            latest = transactions['transaction_date'].max()
+            self.latest_date = latest if pd.isna(self.latest_date) else max(self.latest_date, latest)
+
+        transaction_hashes = hash_values(transactions['transaction_id'])
+        for month, positions in groups.items():
+            self.month_sketches.setdefault(month, HyperLogLog()).add_hashes(transaction_hashes[positions])
+
+        priorities = _unit_interval(pd.util.hash_pandas_object(transactions[['transaction_id', 'product_id']], index=False).to_numpy())
+        self.reservoir.add(transactions, groups, priorities)
+
+        customer_hashes = hash_values(transactions['customer_id'])
+        self.customer_sketch.add_hashes(customer_hashes)
+        sampled = transactions[_unit_interval(customer_hashes) < self.customer_fraction]
+        if len(sampled):
+            txn_prod = data_analysis.fact_rows(sampled, self.products)
+            self.events.add(txn_prod)
+            revenue = txn_prod.groupby('customer_id', observed=True)['selling_amount'].sum()
+            self.revenue = pd.concat([self.revenue, revenue]).groupby(level=0).sum()
+        return self
+
+    def _month_tables(self, txn_prod, sample_sizes):
+        totals, variances = stratified_totals(txn_prod, list(FINANCIAL_COLUMNS.values()), 'month', self.sizes, sample_sizes)
+        errors = {out: np.sqrt(variances[col]).to_numpy() for out, col in FINANCIAL_COLUMNS.items()}
+        errors['profit_pct'] = 100 * ratio_errors(txn_prod, 'profit', 'cost_amount', 'month', self.sizes, sample_sizes, totals).to_numpy()
+
+        monthly_trends = data_analysis.finish_monthly_trends(totals.rename(columns={col: out for out, col in FINANCIAL_COLUMNS.items()}).reset_index())
+        revenue, revenue_error = monthly_trends['total_revenue'].to_numpy(), errors['total_revenue']
+        # Growth over the previous month, whose estimate is independent of this month's
+        errors['revenue_growth_pct'] = np.r_[np.nan, 100 * _quotient_error(revenue[1:], revenue_error[1:], revenue[:-1], revenue_error[:-1])]
+        monthly_trends = with_errors(monthly_trends, errors)
+
+        # Distinct transactions: exact in months sampled in full, HyperLogLog elsewhere
+        months = totals.index.asi8
+        exact = txn_prod.groupby('_stratum')['transaction_id'].nunique()
+        in_full = (self.sizes.reindex(months) == sample_sizes.reindex(months)).to_numpy()
+        sketched = np.array([self.month_sketches[month].count() for month in months])
+        transactions = np.where(in_full, exact.reindex(months).to_numpy(), sketched)
+        transaction_error = np.where(in_full, 0.0, sketched * HyperLogLog().relative_error())
+
+        monthly_aov = data_analysis.finish_monthly_aov(pd.DataFrame({
+            'month': totals.index, 'total_revenue': revenue, 'total_transactions': transactions.astype('int64')}))
+        monthly_aov = with_errors(monthly_aov, {
+            'total_revenue': revenue_error,
+            'total_transactions': transaction_error,
+            'aov': _quotient_error(revenue, revenue_error, transactions, transaction_error),
+        })
+        return monthly_trends, monthly_aov
+
+    def _category_metrics(self, txn_prod, sample_sizes):
+        totals, variances = stratified_totals(txn_prod, list(FINANCIAL_COLUMNS.values()), 'category', self.sizes, sample_sizes)
+        errors = {out: np.sqrt(variances[col]).to_numpy() for out, col in FINANCIAL_COLUMNS.items()}
+        errors['profit_pct'] = 100 * ratio_errors(txn_prod, 'profit', 'cost_amount', 'category', self.sizes, sample_sizes, totals).to_numpy()
+        category_metrics = data_analysis.add_profit_pct(totals.rename(columns={col: out for out, col in FINANCIAL_COLUMNS.items()}).reset_index())
+        return with_errors(category_metrics, errors)
+
+    def _segment_summary(self):
+        f = self.customer_fraction
+        customer_behavior, segment_summary = data_analysis.segment_customers(
+            self.revenue.rename('total_revenue').rename_axis('customer_id').reset_index())
+        segments = customer_behavior.groupby('value_segment', observed=True)['total_revenue']
+        n = segments.count().to_numpy()
+        squares = segments.apply(lambda revenue: (revenue ** 2).sum()).to_numpy()
+        share = segment_summary['revenue_pct'].to_numpy() / 100
+        all_squares = (customer_behavior['total_revenue'] ** 2).sum()
+        sampled_revenue = customer_behavior['total_revenue'].sum()
+
+        segment_summary['num_customers'] = np.round(n / f).astype('int64')
+        segment_summary['total_revenue'] = segment_summary['total_revenue'] / f
+        # Residuals of the share of each segment: y * (1[segment] - share)
+        residual_squares = (1 - share) ** 2 * squares + share ** 2 * (all_squares - squares)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return with_errors(segment_summary, {
+                'num_customers': np.sqrt(n * (1 - f)) / f,
+                'total_revenue': np.sqrt((1 - f) * squares) / f,
+                'avg_revenue_per_customer': segments.std().to_numpy() / np.sqrt(n) * np.sqrt(1 - f),
+                'revenue_pct': 100 * np.sqrt((1 - f) * residual_squares) / sampled_revenue,
+            })
+
+    def _window_tables(self, period_months):
+        f = self.customer_fraction
+        windows = retention.window_summary(retention.customer_sweep(self.events.events()), period_months, self.latest_date)
+        active = windows['active_customers'].to_numpy()
+        rate = windows['repeat_customer_rate_pct'].to_numpy() / 100
+        windows['active_customers'] = np.round(active / f).astype('int64')
+        with np.errstate(divide='ignore', invalid='ignore'):
+            active_customers = with_errors(windows[['period_months', 'active_customers']], {
+                'active_customers': np.sqrt(active * (1 - f)) / f})
+            repeat_customers = with_errors(windows[['period_months', 'repeat_customer_rate_pct']], {
+                'repeat_customer_rate_pct': 100 * np.sqrt(rate * (1 - rate) * (1 - f) / active)})
+        return active_customers, repeat_customers
+
+    def _summary(self, sampled_rows):
+        transaction_sketch = HyperLogLog()
+        for sketch in self.month_sketches.values():
+            transaction_sketch = transaction_sketch.merge(sketch)
+        distinct = {'distinct_customers': self.customer_sketch.count(), 'distinct_transactions': transaction_sketch.count()}
+        summary = pd.DataFrame({
+            'metric': ['transaction_rows', 'sampled_rows', 'sampled_customers', *distinct],
+            'value': [int(self.sizes.sum()), sampled_rows, len(self.revenue), *distinct.values()],
+        })
+        relative = HyperLogLog().relative_error()
+        return with_errors(summary, {'value': [0, 0, 0, *(count * relative for count in distinct.values())]})
+
+    def tables(self, period_months):
+        if self.reservoir.rows is None or not len(self.reservoir.rows):
+            raise ValueError("No dated transactions to sample")
+        sample = self.reservoir.rows.drop(columns='_priority')
+        # Rows drawn per month, counted before the products merge can repeat them
+        sample_sizes = sample['_stratum'].value_counts()
+        txn_prod = data_analysis.fact_rows(sample.assign(_unit=np.arange(len(sample))), self.products)
+
+        report_tables = {}
+        report_tables['monthly_trends'], report_tables['monthly_aov'] = self._month_tables(txn_prod, sample_sizes)
+        report_tables['category_metrics'] = self._category_metrics(txn_prod, sample_sizes)
+        report_tables['segment_summary'] = self._segment_summary()
+        report_tables['active_customers_summary'], report_tables['repeat_customer_summary'] = self._window_tables(period_months)
+        report_tables['preview_summary'] = self._summary(len(sample))
+        return report_tables
+
+
+# Preview report tables from transaction chunks (see above)
+def preview_tables(chunks, products, period_months, sample_rows=DEFAULT_SAMPLE_ROWS, customer_fraction=DEFAULT_CUSTOMER_FRACTION):
+    preview = PreviewAccumulator(products, sample_rows, customer_fraction)
+    for transactions in chunks:
+        with instrumentation.stage('chunk', rows_in=len(transactions)) as stage:
+            preview.add(schema.optimize_dtypes(transactions, 'transactions'))
+            stage.rows_out = len(preview.reservoir.rows) if preview.reservoir.rows is not None else 0
+    with instrumentation.stage('estimates'):
+        return preview.tables(period_months)
@@ -0,0 +1,177 @@
+import sys
+
+import numpy as np
+import pandas as pd
+
+# Dtype plan for customers, products and transactions, shared by data_cleaning and data_analysis.
+#
+#   id        integer IDs as int32 when they fit (never summed); string IDs as categoricals
+#   category  low-cardinality strings as categoricals, which also makes groupbys on them faster
+#   count     small integers (quantity) downcast to int8/int16; int32 is skipped because pandas
+#             keeps int32 for groupby sums, which could overflow
+#   money     float32 when every value round-trips at MONEY_DECIMALS places, else float64;
+#             always widened back with widen_money() before arithmetic
+#   text      left as loaded
+#   date      raw strings, read without read_csv's missing-value handling, so a quarantined row shows the
+#             spelling (e.g. N/A or an empty field) of a date that did not parse
+
+MONEY_DECIMALS = 2
+
+SCHEMA = {
+    'customers': {
+        'customer_id': 'id',
+        'name': 'text',
+        'email': 'text',
+        'signup_date': 'date',
+        'country': 'category',
+    },
+    'products': {
+        'product_id': 'id',
+        'product_name': 'text',
+        'category': 'category',
+        'cost_price': 'money',
+    },
+    'transactions': {
+        'transaction_id': 'id',
+        'customer_id': 'id',
+        'product_id': 'id',
+        'transaction_date': 'date',
+        'quantity': 'count',
+        'price': 'money',
+        'status': 'category',
+    },
+}
+
+# Strings read_csv reads as missing by default
+NA_STRINGS = ['', '#N/A', '#N/A N/A', '#NA', '-1.#IND', '-1.#QNAN', '-NaN', '-nan', '1.#IND', '1.#QNAN',
+              '<NA>', 'N/A', 'NA', 'NULL', 'NaN', 'None', 'n/a', 'nan', 'null']
+
+INT32 = np.iinfo(np.int32)
+INT16 = np.iinfo(np.int16)
+INT8 = np.iinfo(np.int8)
+
+
+# dtype= argument for pd.read_csv: categoricals are built while parsing, so the object column never exists.
+def read_dtypes(table, columns=None):
+    return {col: 'category' for col, kind in SCHEMA[table].items()
+            if kind == 'category' and (columns is None or col in columns)}
+
+
+# converters= argument for pd.read_csv: date columns keep their raw strings.
+def read_converters(table, columns=None):
+    return {col: str for col, kind in SCHEMA[table].items()
+            if kind == 'date' and (columns is None or col in columns)}
+
+
+# df with the missing-value spellings of its raw date columns as NaN, as read_csv would have read them.
+# Profiles are taken of this view, so missing dates still count as nulls.
+def missing_dates_as_na(df, table):
+    dates = {col: df[col].mask(df[col].isin(NA_STRINGS)) for col, kind in SCHEMA[table].items()
+             if kind == 'date' and col in df.columns}
+    return df.assign(**dates) if dates else df
+
+
+def _is_integral(series):
+    return pd.api.types.is_integer_dtype(series) and not isinstance(series.dtype, pd.CategoricalDtype)
+
+
+def _downcast_integer(series, smallest_types):
+    lo, hi = series.min(), series.max()
+    for dtype in smallest_types:
+        info = np.iinfo(dtype)
+        if info.min <= lo and hi <= info.max:
+            return series.astype(dtype)
+    return series
+
+
+def _compact_money(series):
+    if series.dtype != np.float64:
+        return series
+    values = series.to_numpy()
+    if np.nanmax(np.abs(values), initial=0) >= 2 ** 24 / 10 ** MONEY_DECIMALS:
+        return series
+    as_float32 = values.astype(np.float32)
+    lossless = np.array_equal(np.round(as_float32.astype(np.float64), MONEY_DECIMALS), values, equal_nan=True)
+    return series.astype(np.float32) if lossless else series
+
+
+# Applies the dtype plan to a loaded table. compact_money=False keeps money columns in float64
+# (the cleaner computes medians on them).
+def optimize_dtypes(df, table, compact_money=True):
+    for col, kind in SCHEMA[table].items():
+        if col not in df.columns:
+            continue
+        series = df[col]
+        if kind == 'id':
+            if _is_integral(series):
+                df[col] = _downcast_integer(series, [np.int32])
+            elif series.dtype == object or pd.api.types.is_string_dtype(series):
+                df[col] = series.astype('category')
+        elif kind == 'category' and not isinstance(series.dtype, pd.CategoricalDtype):
+            df[col] = series.astype('category')
+        elif kind == 'count' and _is_integral(series):
+            df[col] = _downcast_integer(series, [np.int8, np.int16])
+        elif kind == 'money' and compact_money:
+            df[col] = _compact_money(series)
+    return df
+
+
+# Money columns in float64 for arithmetic; float32 values are rounded back to their exact decimal value.
+def widen_money(series):
+    if series.dtype == np.float32:
+        return series.astype(np.float64).round(MONEY_DECIMALS)
+    return series
+
+
+# fillna that keeps a categorical column categorical. Categories stay sorted, as read_csv creates them,
+# so frames cleaned in partitions combine to the same categories as one frame cleaned whole.
+def fill_missing(series, value):
+    if isinstance(series.dtype, pd.CategoricalDtype) and value not in series.cat.categories:
+        series = series.cat.set_categories(sorted([*series.cat.categories, value]))
+    return series.fillna(value)
+
+
+# pd.concat for frames with the same columns that keeps categoricals categorical when
+# the frames have different categories (the union is sorted, as read_csv creates them).
+def concat_frames(frames):
+    frames = list(frames)
+    combined = pd.concat(frames)
+    for col in frames[0].columns:
+        columns = [frame[col] for frame in frames]
+        if all(isinstance(c.dtype, pd.CategoricalDtype) for c in columns) and not isinstance(combined[col].dtype, pd.CategoricalDtype):
+            combined[col] = pd.Categorical(pd.api.types.union_categoricals(columns, sort_categories=True))
+    return combined
+
+
+# Estimated size of df with pandas' default dtypes (object strings, int64/float64).
+def default_memory_estimate(df):
+    total = 0
+    for col in df.columns:
+        series = df[col]
+        if isinstance(series.dtype, pd.CategoricalDtype):
+            counts = np.bincount(series.cat.codes.to_numpy() + 1, minlength=len(series.cat.categories) + 1)
+            sizes = np.array([sys.getsizeof(None)] + [sys.getsizeof(v) for v in series.cat.categories])
+            total += int((counts * sizes).sum()) + 8 * len(series)
+        elif pd.api.types.is_numeric_dtype(series) or pd.api.types.is_datetime64_any_dtype(series):
+            total += 8 * len(series)
+        else:
+            total += int(series.memory_usage(index=False, deep=True))
+    return total
+
+
+# (size with pandas' default dtypes, actual size) in bytes
+def memory_usage(df):
+    return default_memory_estimate(df), int(df.memory_usage(index=False, deep=True).sum())
+
+
+def memory_report(name, df=None, usage=None):
+    before, after = usage if usage is not None else memory_usage(df)
+    saved = (1 - after / before) * 100 if before else 0.0
+    print(f"Memory {name}: {before / 2**20:,.1f} MB -> {after / 2**20:,.1f} MB ({saved:.0f}% saved)")
+
+
+# Reads a raw CSV with the dtype plan applied.
+def read_csv(path, table, compact_money=True, **kwargs):
+    columns = kwargs.get('usecols')
+    df = pd.read_csv(path, dtype=read_dtypes(table, columns), converters=read_converters(table, columns), **kwargs)
+    return optimize_dtypes(df, table, compact_money)
@@ -0,0 +1,460 @@
+import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+import instrumentation
+import schema
+
+# Pluggable storage for the clean tables handed from data_cleaning to data_analysis.
+# Parquet and Feather keep dtypes (datetimes, categoricals, boolean flags) across the
+# boundary so nothing is re-parsed; CSV stays available for compatibility.
+# Parquet/Feather need pyarrow, which is only imported when those formats are used.
+#
+# Tables with a PARTITION_COLUMNS entry can also be stored in a Hive-style layout, one directory per
+# month of that column, each holding one file in the table's format:
+#
+#     data_clean/transactions/month=2024-01/part-0.parquet
+#     data_clean/transactions/month=__HIVE_DEFAULT_PARTITION__/part-0.parquet   (missing dates)
+#
+# read_table detects the layout and only reads the months overlapping start_date/end_date.
+
+# Columns the CSV backend has to re-parse as dates, since CSV carries no dtypes.
+DATE_COLUMNS = {
+    'customers': ['signup_date'],
+    'transactions': ['transaction_date'],
+}
+
+
+# Month partitioning key of each table that supports the partitioned layout.
+PARTITION_COLUMNS = {
+    'transactions': 'transaction_date',
+}
+
+PARTITION_KEY = 'month'
+NULL_PARTITION = '__HIVE_DEFAULT_PARTITION__'
+
+
+def _date_mask(df, date_col, start_date=None, end_date=None):
+    mask = pd.Series(True, index=df.index)
+    if start_date is not None:
+        mask &= df[date_col] >= start_date
+    if end_date is not None:
+        mask &= df[date_col] <= end_date
+    return mask
+
+
+class CsvBackend:
+    extension = 'csv'
+
+    def write(self, df, path):
+        df.to_csv(path, index=False)
+
+    def read(self, path, name, columns=None, date_col=None, start_date=None, end_date=None, dtype=None):
+        date_columns = [c for c in DATE_COLUMNS.get(name, []) if columns is None or c in columns]
+        df = pd.read_csv(path, usecols=columns, parse_dates=date_columns, dtype=dtype)
+        if date_col and (start_date is not None or end_date is not None):
+            df = df[_date_mask(df, date_col, start_date, end_date)]
+        return df
+
+    def iter_read(self, path, name, chunksize, columns=None, date_col=None, start_date=None, end_date=None, dtype=None):
+        date_columns = [c for c in DATE_COLUMNS.get(name, []) if columns is None or c in columns]
+        for df in pd.read_csv(path, usecols=columns, parse_dates=date_columns, dtype=dtype, chunksize=chunksize):
+            if date_col and (start_date is not None or end_date is not None):
+                df = df[_date_mask(df, date_col, start_date, end_date)]
+            yield df
+
+    def writer(self, path, append=False):
+        return CsvTableWriter(path, append)
+
+
+class ParquetBackend:
+    extension = 'parquet'
+
+    def write(self, df, path):
+        df.to_parquet(path, index=False)
+
+    def read(self, path, name, columns=None, date_col=None, start_date=None, end_date=None, dtype=None):
+        # Date range is pushed down to pyarrow, so row groups outside it are skipped
+        filters = []
+        if date_col and start_date is not None:
+            filters.append((date_col, '>=', pd.Timestamp(start_date)))
+        if date_col and end_date is not None:
+            filters.append((date_col, '<=', pd.Timestamp(end_date)))
+        return pd.read_parquet(path, columns=columns, filters=filters or None)
+
+    def iter_read(self, path, name, chunksize, columns=None, date_col=None, start_date=None, end_date=None, dtype=None):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=chunksize, columns=columns):
+            df = pa.Table.from_batches([batch]).to_pandas()
+            if date_col and (start_date is not None or end_date is not None):
+                df = df[_date_mask(df, date_col, start_date, end_date)]
+            yield df
+
+    def writer(self, path, append=False):
+        return ArrowTableWriter(path, 'parquet', append)
+
+
+class FeatherBackend:
+    extension = 'feather'
+
+    def write(self, df, path):
+        df.reset_index(drop=True).to_feather(path)
+
+    def read(self, path, name, columns=None, date_col=None, start_date=None, end_date=None, dtype=None):
+        # Feather is memory-mapped column by column; the date filter is applied after projection
+        df = pd.read_feather(path, columns=columns)
+        if date_col and (start_date is not None or end_date is not None):
+            df = df[_date_mask(df, date_col, start_date, end_date)]
+        return df
+
+    def iter_read(self, path, name, chunksize, columns=None, date_col=None, start_date=None, end_date=None, dtype=None):
+        import pyarrow as pa
+
+        with pa.memory_map(path) as source:
+            reader = pa.ipc.open_file(source)
+            for i in range(reader.num_record_batches):
+                batch = reader.get_batch(i)
+                if columns is not None:
+                    batch = batch.select(columns)
+                for offset in range(0, batch.num_rows, chunksize):
+                    df = pa.Table.from_batches([batch.slice(offset, chunksize)]).to_pandas()
+                    if date_col and (start_date is not None or end_date is not None):
+                        df = df[_date_mask(df, date_col, start_date, end_date)]
+                    yield df
+
+    def writer(self, path, append=False):
+        return ArrowTableWriter(path, 'feather', append)
+
+
+# Appends chunks to one CSV file, writing the header once.
+# With append=True rows are added to an existing file instead of replacing it.
+class CsvTableWriter:
+    def __init__(self, path, append=False):
+        self.path = path
+        self.rows_written = 0
+        self._started = append and os.path.exists(path)
+
+    def write(self, df):
+        df.to_csv(self.path, mode='a' if self._started else 'w', header=not self._started, index=False)
+        self._started = True
+        self.rows_written += len(df)
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+# Appends chunks to one Parquet file (one row group per chunk) or one Feather/Arrow IPC file.
+# The schema is fixed by the first chunk; later chunks are cast to it.
+# Closed Parquet/Feather files cannot be appended to, so append=True is rejected.
+class ArrowTableWriter:
+    def __init__(self, path, fmt, append=False):
+        if append:
+            raise ValueError(f"Appending to an existing {fmt} file is not supported; use the csv format")
+        self.path = path
+        self.fmt = fmt
+        self.rows_written = 0
+        self._schema = None
+        self._writer = None
+
+    def write(self, df):
+        import pyarrow as pa
+
+        table = pa.Table.from_pandas(df, schema=self._schema, preserve_index=False)
+        if self._writer is None:
+            # Categoricals differ between chunks, so dictionary indices get room for any chunk's categories
+            self._schema = pa.schema([
+                field.with_type(pa.dictionary(pa.int32(), field.type.value_type)) if pa.types.is_dictionary(field.type) else field
+                for field in table.schema
+            ], metadata=table.schema.metadata)
+            table = table.cast(self._schema)
+            if self.fmt == 'parquet':
+                import pyarrow.parquet as pq
+                self._writer = pq.ParquetWriter(self.path, self._schema)
+            else:
+                self._writer = pa.ipc.new_file(self.path, self._schema)
+        self._writer.write_table(table)
+        self.rows_written += len(df)
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+# Routes chunks into the month-partitioned layout: one open writer per month, so a partition
+# receives rows from every chunk that has them. The directory is swapped into place on close.
+class PartitionedTableWriter:
+    def __init__(self, directory, name, fmt):
+        self.directory = directory
+        self.name = name
+        self.fmt = fmt
+        self.root = partitioned_path(directory, name)
+        self.staging = f"{self.root}.partial"
+        self.rows_written = 0
+        self._writers = {}
+        self._empty = None
+        shutil.rmtree(self.staging, ignore_errors=True)
+
+    def _writer(self, month):
+        if month not in self._writers:
+            path = _partition_file(self.staging, month, self.fmt)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            self._writers[month] = get_backend(self.fmt).writer(path)
+        return self._writers[month]
+
+    def write(self, df):
+        if self._empty is None:
+            self._empty = df.iloc[:0]
+        for month, rows in _split_by_month(df, PARTITION_COLUMNS[self.name]):
+            self._writer(month).write(rows)
+        self.rows_written += len(df)
+
+    def close(self, commit=True):
+        if commit and not self._writers and self._empty is not None:
+            # Keep the table's columns even when no rows were written
+            self._writer(NULL_PARTITION).write(self._empty)
+        for writer in self._writers.values():
+            writer.close()
+        self._writers = {}
+        if not commit:
+            shutil.rmtree(self.staging, ignore_errors=True)
+        elif os.path.isdir(self.staging):
+            _remove_other_layout(self.directory, self.name, self.fmt, partitioned=True)
+            shutil.rmtree(self.root, ignore_errors=True)
+            os.rename(self.staging, self.root)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        self.close(commit=exc_type is None)
+
+
+BACKENDS = {
+    'csv': CsvBackend(),
+    'parquet': ParquetBackend(),
+    'feather': FeatherBackend(),
+}
+
+
+def get_backend(fmt):
+    if fmt not in BACKENDS:
+        raise ValueError(f"Unknown storage format '{fmt}', expected one of {sorted(BACKENDS)}")
+    return BACKENDS[fmt]
+
+
+def table_path(directory, name, fmt='csv'):
+    return os.path.join(directory, f"{name}.{get_backend(fmt).extension}")
+
+
+def partitioned_path(directory, name):
+    return os.path.join(directory, name)
+
+
+def is_partitioned(directory, name):
+    return os.path.isdir(partitioned_path(directory, name))
+
+
+def _partition_file(root, month, fmt):
+    return os.path.join(root, f"{PARTITION_KEY}={month}", f"part-0.{get_backend(fmt).extension}")
+
+
+# Removes the layout of a table that is about to be written in the other layout, so reads are never ambiguous.
+def _remove_other_layout(directory, name, fmt, partitioned):
+    if partitioned and os.path.exists(table_path(directory, name, fmt)):
+        os.remove(table_path(directory, name, fmt))
+    elif not partitioned and is_partitioned(directory, name):
+        shutil.rmtree(partitioned_path(directory, name))
+
+
+# Rows of df grouped by month of date_col, as (partition value, rows); missing dates go to NULL_PARTITION.
+def _split_by_month(df, date_col):
+    months = df[date_col].dt.to_period('M')
+    for month, rows in df.groupby(months, sort=True, dropna=False):
+        yield (NULL_PARTITION if pd.isna(month) else str(month)), rows
+
+
+# Month partitions present for a table, as {partition value: file path}
+def _partitions(directory, name, fmt):
+    root = partitioned_path(directory, name)
+    partitions = {}
+    for entry in sorted(os.listdir(root)):
+        key, _, month = entry.partition('=')
+        path = _partition_file(root, month, fmt)
+        if key == PARTITION_KEY and os.path.exists(path):
+            partitions[month] = path
+    return partitions
+
+
+# Partitions overlapping [start_date, end_date]. Rows without a date never pass a date filter.
+def _prune_partitions(partitions, start_date=None, end_date=None):
+    if start_date is None and end_date is None:
+        return dict(partitions)
+    selected = {}
+    for month, path in partitions.items():
+        if month == NULL_PARTITION:
+            continue
+        period = pd.Period(month, freq='M')
+        if start_date is not None and period.end_time < pd.Timestamp(start_date):
+            continue
+        if end_date is not None and period.start_time > pd.Timestamp(end_date):
+            continue
+        selected[month] = path
+    return selected
+
+
+# Files a read_table call with the same arguments touches. Partitions are only pruned when the
+# date filter is on the partitioning column.
+def table_files(directory, name, fmt='csv', date_col=None, start_date=None, end_date=None):
+    if not is_partitioned(directory, name):
+        return [table_path(directory, name, fmt)]
+    partitions = _partitions(directory, name, fmt)
+    if date_col is not None and date_col == PARTITION_COLUMNS.get(name):
+        partitions = _prune_partitions(partitions, start_date, end_date)
+    return list(partitions.values())
+
+
+# Writes df into a fresh partitioned directory next to the old one, then swaps it into place.
+def _write_partitioned(df, directory, name, fmt):
+    root = partitioned_path(directory, name)
+    staging = f"{root}.partial"
+    shutil.rmtree(staging, ignore_errors=True)
+    backend = get_backend(fmt)
+    parts = _split_by_month(df, PARTITION_COLUMNS[name]) if len(df) else [(NULL_PARTITION, df)]
+    for month, rows in parts:
+        path = _partition_file(staging, month, fmt)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        backend.write(rows, path)
+    _remove_other_layout(directory, name, fmt, partitioned=True)
+    shutil.rmtree(root, ignore_errors=True)
+    os.rename(staging, root)
+
+
+# partitioned=True stores tables with a PARTITION_COLUMNS entry in the month-partitioned layout;
+# other tables are always written as one file.
+def write_table(df, directory, name, fmt='csv', partitioned=False):
+    partitioned = partitioned and name in PARTITION_COLUMNS
+    with instrumentation.stage(f"write_{name}", rows_in=len(df)) as stage:
+        if partitioned:
+            _write_partitioned(df, directory, name, fmt)
+        else:
+            _remove_other_layout(directory, name, fmt, partitioned=False)
+            get_backend(fmt).write(df, table_path(directory, name, fmt))
+        for path in table_files(directory, name, fmt):
+            stage.add_written(path)
+
+
+# Reads a clean table. columns projects the read; start_date/end_date filter on date_col,
+# pushed down to the reader where the format supports it. dtype is only needed for CSV, the
+# columnar formats already store their dtypes. A partitioned table only has the month
+# partitions overlapping the date range read.
+def read_table(directory, name, fmt='csv', columns=None, date_col=None, start_date=None, end_date=None, dtype=None):
+    backend = get_backend(fmt)
+    if not is_partitioned(directory, name):
+        return backend.read(table_path(directory, name, fmt), name, columns=columns,
+                            date_col=date_col, start_date=start_date, end_date=end_date, dtype=dtype)
+
+    frames = [backend.read(path, name, columns=columns, date_col=date_col, start_date=start_date, end_date=end_date, dtype=dtype)
+              for path in table_files(directory, name, fmt, date_col, start_date, end_date)]
+    if not frames:
+        # Nothing overlaps the range: an empty frame with the table's columns
+        frames = [backend.read(table_files(directory, name, fmt)[0], name, columns=columns, dtype=dtype).iloc[:0]]
+    return schema.concat_frames(frames).reset_index(drop=True)
+
+
+# Same as read_table, as chunks of at most chunksize rows, so a table larger than memory can be
+# aggregated one chunk at a time. Yields at least one (possibly empty) chunk with the table's columns.
+def iter_table(directory, name, fmt='csv', chunksize=1_000_000, columns=None, date_col=None, start_date=None, end_date=None, dtype=None):
+    backend = get_backend(fmt)
+    empty = True
+    for path in table_files(directory, name, fmt, date_col, start_date, end_date):
+        for df in backend.iter_read(path, name, chunksize, columns=columns, date_col=date_col,
+                                    start_date=start_date, end_date=end_date, dtype=dtype):
+            empty = False
+            yield df
+    if empty:
+        yield backend.read(table_files(directory, name, fmt)[0], name, columns=columns, dtype=dtype).iloc[:0]
+
+
+# Copies a clean table from src_dir to dst_dir in the layout it has in src_dir, replacing the table there.
+# Files that already match (same size and modification time, as left by an earlier copy) are not copied again.
+def copy_table(src_dir, dst_dir, name, fmt='csv'):
+    partitioned = is_partitioned(src_dir, name)
+    os.makedirs(dst_dir, exist_ok=True)
+    _remove_other_layout(dst_dir, name, fmt, partitioned)
+    if partitioned and is_partitioned(dst_dir, name):
+        months = _partitions(src_dir, name, fmt)
+        for month, path in _partitions(dst_dir, name, fmt).items():
+            if month not in months:
+                shutil.rmtree(os.path.dirname(path))
+
+    copied = []
+    for path in table_files(src_dir, name, fmt):
+        target = os.path.join(dst_dir, os.path.relpath(path, src_dir))
+        source_stat = os.stat(path)
+        if not (os.path.exists(target) and os.path.getsize(target) == source_stat.st_size
+                and os.stat(target).st_mtime_ns == source_stat.st_mtime_ns):
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            shutil.copy2(path, target)
+        copied.append(target)
+    return copied
+
+
+def open_table_writer(directory, name, fmt='csv', append=False, partitioned=False):
+    if partitioned and name in PARTITION_COLUMNS:
+        if append:
+            raise ValueError("Appending to a partitioned table is not supported")
+        return PartitionedTableWriter(directory, name, fmt)
+    if not append:
+        _remove_other_layout(directory, name, fmt, partitioned=False)
+    return get_backend(fmt).writer(table_path(directory, name, fmt), append)
+
+
+# Same projection and date filter as read_table, for a clean table already in memory.
+# Always returns a new frame, so callers never mutate a frame that is still being written in the background.
+def select_table(df, columns=None, date_col=None, start_date=None, end_date=None):
+    df = df[columns] if columns is not None else df.copy()
+    if date_col and (start_date is not None or end_date is not None):
+        df = df[_date_mask(df, date_col, start_date, end_date)]
+    return df
+
+
+# Background writes of clean tables. A single worker thread keeps writes ordered;
+# wait_for_background_writes() blocks until they all finish and re-raises the first write error.
+_background_writer = None
+_pending_writes = []
+
+
+def write_tables_in_background(tables, directory, fmt='csv', partitioned=False):
+    global _background_writer
+    if _background_writer is None:
+        _background_writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='clean-writer')
+    for name, df in tables.items():
+        _pending_writes.append(_background_writer.submit(write_table, df, directory, name, fmt, partitioned))
+
+
+def wait_for_background_writes():
+    error = None
+    while _pending_writes:
+        try:
+            _pending_writes.pop(0).result()
+        except Exception as e:
+            error = error or e
+    if error is not None:
+        raise error
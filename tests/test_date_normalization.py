@@ -0,0 +1,27 @@
+import os
+import sys
+
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from date_normalization import DateNormalizer
+
+
+# One day-first date is enough to read every date of the same shape in the column day-first
+def test_ambiguous_day_first_column():
+    raw = pd.Series(['25-03-2024', '05-03-2024', ' 05/03/2024 ', '01-02-2024', None])
+    parsed = DateNormalizer().normalize(raw)
+    expected = pd.to_datetime(['2024-03-25', '2024-03-05', '2024-03-05', '2024-02-01', None])
+    assert parsed.tolist() == expected.tolist()
+
+
+def test_ambiguous_column_defaults_to_month_first():
+    parsed = DateNormalizer().normalize(pd.Series(['05-03-2024', '06-03-2024']))
+    assert parsed.tolist() == pd.to_datetime(['2024-05-03', '2024-06-03']).tolist()
+
+
+# Strings no format parses do not stop the rest of their shape from sharing one format
+def test_unparseable_strings_do_not_split_the_column():
+    parsed = DateNormalizer().normalize(pd.Series(['05-03-2024', '99-99-2024', '25-03-2024', '2024/01/02']))
+    assert parsed.tolist() == [pd.Timestamp('2024-03-05'), pd.NaT, pd.Timestamp('2024-03-25'), pd.Timestamp('2024-01-02')]
@@ -0,0 +1,220 @@
+import json
+import os
+
+import numpy as np
+
+import instrumentation
+import storage
+
+# Declarative validation of the raw tables, applied while they are cleaned.
+#
+# Each table has a list of rules, a column and a check:
+#
+#   not_null        the value is present
+#   non_negative    the value is >= 0 (missing values pass; not_null is the rule for those)
+#   positive        the value is > 0 (missing values pass)
+#   exists_in       the value is one of a reference set, e.g. the product ids of products.csv
+#   parseable_date  the date column parsed to a date (runs after date standardization)
+#
+# Every rule is evaluated as a boolean mask over the whole frame or chunk. Rows failing any rule are
+# removed from the clean data and written to <clean_dir>/quarantine/<table>.csv, with their raw date
+# strings and a `reasons` column listing the codes ("<column>:<check>") of the rules they failed.
+# Per-rule counts are printed and saved to quarantine/validation_summary.json. In chunked mode the
+# rejected rows of each chunk are appended to the quarantine file as they are found, so only the
+# counts are kept in memory.
+
+QUARANTINE_DIR = 'quarantine'
+SUMMARY_FILE = 'validation_summary.json'
+REASONS_COLUMN = 'reasons'
+
+# Reference sets used by exists_in rules
+PRODUCT_IDS = 'products.product_id'
+
+
+def _not_null(values, arg, references):
+    return values.isna()
+
+
+def _non_negative(values, arg, references):
+    return values < 0
+
+
+def _positive(values, arg, references):
+    return values <= 0
+
+
+def _exists_in(values, arg, references):
+    if arg not in references:
+        raise ValueError(f"Validation needs the reference set '{arg}'")
+    return values.notna() & ~values.isin(references[arg])
+
+
+def _parseable_date(values, arg, references):
+    return values.isna()
+
+
+CHECKS = {
+    'not_null': _not_null,
+    'non_negative': _non_negative,
+    'positive': _positive,
+    'exists_in': _exists_in,
+    'parseable_date': _parseable_date,
+}
+
+
+class Rule:
+    def __init__(self, column, check, arg=None):
+        if check not in CHECKS:
+            raise ValueError(f"Unknown validation check '{check}', expected one of {list(CHECKS)}")
+        self.column = column
+        self.check = check
+        self.arg = arg
+        self.code = f"{column}:{check}"
+
+    # Boolean mask of the rows failing the rule
+    def failing(self, df, references):
+        return CHECKS[self.check](df[self.column], self.arg, references).to_numpy(dtype=bool)
+
+
+RULES = {
+    'customers': [
+        Rule('customer_id', 'not_null'),
+        Rule('signup_date', 'parseable_date'),
+    ],
+    'products': [
+        Rule('product_id', 'not_null'),
+        Rule('cost_price', 'non_negative'),
+    ],
+    'transactions': [
+        Rule('transaction_id', 'not_null'),
+        Rule('customer_id', 'not_null'),
+        Rule('product_id', 'not_null'),
+        Rule('price', 'non_negative'),
+        Rule('quantity', 'positive'),
+        Rule('product_id', 'exists_in', PRODUCT_IDS),
+        Rule('transaction_date', 'parseable_date'),
+    ],
+}
+
+
+# Columns the rules of a table read
+def rule_columns(table):
+    return list(dict.fromkeys(rule.column for rule in RULES[table]))
+
+
+# Rows of df failing at least one rule, with the raw values of the columns in raw and the codes of the failed rules
+def _rejected_rows(df, masks, rejected, raw):
+    rows = df[rejected].copy()
+    for col, values in (raw or {}).items():
+        rows[col] = values[rejected].to_numpy()
+    # Each row's failed rules as a bit set; the reason strings are built once per distinct combination
+    codes = list(masks)
+    bits = np.zeros(len(rows), dtype=np.int64)
+    for i, mask in enumerate(masks.values()):
+        bits |= mask[rejected].astype(np.int64) << i
+    combinations, inverse = np.unique(bits, return_inverse=True)
+    reasons = np.array([';'.join(code for i, code in enumerate(codes) if combination >> i & 1) for combination in combinations], dtype=object)
+    rows[REASONS_COLUMN] = reasons[inverse]
+    return rows
+
+
+# Evaluates the rules of table on df and returns the rows that pass. Failing rows go to quarantine
+# (or are only dropped when quarantine is None, e.g. in a first pass that is repeated later).
+# raw maps columns to their values before cleaning, which are what the quarantine file shows.
+def apply(df, table, references=None, quarantine=None, raw=None):
+    with instrumentation.stage('validate', rows_in=len(df)) as stage:
+        masks = {rule.code: rule.failing(df, references or {}) for rule in RULES[table]}
+        rejected = np.logical_or.reduce(list(masks.values())) if masks else np.zeros(len(df), dtype=bool)
+        if quarantine is not None:
+            rows = _rejected_rows(df, masks, rejected, raw) if rejected.any() else None
+            quarantine.record(table, len(df), {code: int(mask.sum()) for code, mask in masks.items()}, rows)
+        if rejected.any():
+            df = df[~rejected]
+        stage.rows_out = len(df)
+    return df
+
+
+# Per-rule counts saved in directory by earlier runs, by table
+def load_summary(directory):
+    summary_path = os.path.join(directory, SUMMARY_FILE)
+    if not os.path.exists(summary_path):
+        return {}
+    with open(summary_path) as fh:
+        return json.load(fh)
+
+
+# Saves per-rule counts of some tables, keeping the counts of the other tables
+def save_summary(directory, counts):
+    summary = load_summary(directory)
+    summary.update(counts)
+    summary = {table: summary[table] for table in RULES if table in summary}
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, SUMMARY_FILE), 'w') as fh:
+        json.dump(summary, fh, indent=2)
+
+
+# Collects the rejected rows and per-rule counts of one run. With a directory, rejected rows are appended to
+# <directory>/<table>.csv as they arrive; without one they are kept in memory (partition workers send them
+# back to the parent, which merges them into its own quarantine). Files of the given tables left by an
+# earlier run are removed; files of other tables are appended to (incremental runs add to the transactions file).
+class Quarantine:
+    def __init__(self, directory=None, tables=()):
+        self.directory = directory
+        self.counts = {}
+        self.frames = []
+        self.writers = {}
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+            for table in tables:
+                if os.path.exists(self.path(table)):
+                    os.remove(self.path(table))
+
+    def path(self, table):
+        return os.path.join(self.directory, f"{table}.csv")
+
+    # Adds counts in the form they are saved in the summary file ({'rows', 'rejected', 'rules'})
+    def add_counts(self, table, counts):
+        total = self.counts.setdefault(table, {'rows': 0, 'rejected': 0, 'rules': {rule.code: 0 for rule in RULES[table]}})
+        total['rows'] += counts['rows']
+        total['rejected'] += counts['rejected']
+        for code, count in counts['rules'].items():
+            total['rules'][code] = total['rules'].get(code, 0) + count
+
+    def _write(self, table, rows):
+        if self.directory is None:
+            self.frames.append((table, rows))
+            return
+        if table not in self.writers:
+            self.writers[table] = storage.CsvTableWriter(self.path(table), append=True)
+        self.writers[table].write(rows)
+
+    def record(self, table, rows, rule_counts, rejected_rows=None):
+        self.add_counts(table, {'rows': rows, 'rejected': 0 if rejected_rows is None else len(rejected_rows), 'rules': rule_counts})
+        if rejected_rows is not None and len(rejected_rows):
+            self._write(table, rejected_rows)
+
+    # Adds the counts and rejected rows collected by another (in-memory) quarantine
+    def merge(self, other):
+        for table, counts in other.counts.items():
+            self.add_counts(table, counts)
+        for table, rows in other.frames:
+            self._write(table, rows)
+
+    # Prints the per-rule counts and saves them to the summary file, next to the counts of tables not validated in this run
+    def close(self):
+        for writer in self.writers.values():
+            writer.close()
+        if not self.counts:
+            return
+
+        print(f"\n{'='*80}")
+        print("VALIDATION")
+        print(f"{'='*80}")
+        for table, counts in self.counts.items():
+            print(f"{table}: {counts['rejected']:,} of {counts['rows']:,} rows quarantined")
+            for code, count in counts['rules'].items():
+                print(f"    {code:<36} {count:>12,}")
+        print()
+
+        if self.directory:
+            save_summary(self.directory, self.counts)